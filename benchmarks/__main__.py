@@ -0,0 +1,103 @@
+# Copyright 2011 webapp2 AUTHORS.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Runs the webapp2 benchmarks.
+
+Examples::
+
+    # Run everything and save the results as a baseline.
+    python -m benchmarks --json baseline.json
+
+    # Run the routing benchmarks and compare them with the baseline.
+    python -m benchmarks -k 'router.*' --compare baseline.json
+
+The exit status is 1 if a regression was found when comparing results.
+"""
+import argparse
+import json
+import sys
+
+from benchmarks import runner, scenarios  # noqa: F401
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks", description="Runs the webapp2 benchmarks."
+    )
+    parser.add_argument(
+        "-k",
+        dest="patterns",
+        action="append",
+        help="only run benchmarks matching this shell-style pattern",
+    )
+    parser.add_argument("--list", action="store_true", help="list benchmarks")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="compare with results from this file")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="relative change considered significant (default: 0.1)",
+    )
+    parser.add_argument(
+        "--min-time",
+        type=float,
+        default=0.2,
+        help="minimum duration of a round, in seconds (default: 0.2)",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="number of rounds (default: 5)"
+    )
+    args = parser.parse_args(argv)
+
+    benchmarks = runner.get_benchmarks(args.patterns)
+    if args.list:
+        for bench in benchmarks:
+            print(bench.name)
+
+        return 0
+
+    results = runner.run(
+        benchmarks, min_time=args.min_time, repeat=args.repeat, out=sys.stdout
+    )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if not args.compare:
+        return 0
+
+    with open(args.compare) as f:
+        baseline = json.load(f)
+
+    regressions = 0
+    print()
+    for name, old, new, ratio, status in runner.compare(
+        results, baseline, threshold=args.threshold
+    ):
+        if status == "regression":
+            regressions += 1
+
+        print(
+            "%-50s %10.2f us -> %10.2f us  %+7.1f%%  %s"
+            % (name, old * 1e6, new * 1e6, (ratio - 1) * 100, status)
+        )
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,210 @@
+# Copyright 2011 webapp2 AUTHORS.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+benchmarks.runner
+=================
+
+A small benchmark runner with JSON output and baseline comparison.
+
+Benchmarks are registered with the :func:`benchmark` decorator. The decorated
+function receives a parameter and returns a callable without arguments, which
+is the code being timed::
+
+    @benchmark("router.match", params=[10, 100])
+    def bench_match(size):
+        router, request = build_router(size)
+        return lambda: router.match(request)
+"""
+import fnmatch
+import platform
+import statistics
+import sys
+import time
+import timeit
+
+import webapp2
+
+#: Registered benchmarks, in definition order.
+_benchmarks = []
+
+
+class Benchmark:
+    """A registered benchmark."""
+
+    def __init__(self, name, setup, param=None):
+        """Initializes the benchmark.
+
+        :param name:
+            The benchmark name. Parametrized benchmarks have the parameter
+            appended, e.g. ``router.match[100]``.
+        :param setup:
+            A function that receives `param` and returns the callable to be
+            timed.
+        :param param:
+            The parameter passed to `setup`.
+        """
+        self.name = name
+        self.setup = setup
+        self.param = param
+
+    def __repr__(self):
+        return f"<Benchmark({self.name!r})>"
+
+
+def benchmark(name, params=None):
+    """A decorator to register a benchmark.
+
+    :param name:
+        The benchmark name.
+    :param params:
+        A list of parameters. One benchmark is registered for each of them.
+    """
+
+    def decorator(func):
+        if params is None:
+            _benchmarks.append(Benchmark(name, func))
+        else:
+            for param in params:
+                _benchmarks.append(Benchmark(f"{name}[{param}]", func, param))
+
+        return func
+
+    return decorator
+
+
+def get_benchmarks(patterns=None):
+    """Returns the registered benchmarks.
+
+    :param patterns:
+        A list of shell-style patterns. If set, only benchmarks with a name
+        matching one of them are returned.
+    :returns:
+        A list of :class:`Benchmark` instances.
+    """
+    if not patterns:
+        return list(_benchmarks)
+
+    return [
+        b for b in _benchmarks if any(fnmatch.fnmatchcase(b.name, p) for p in patterns)
+    ]
+
+
+def measure(func, min_time=0.2, repeat=5):
+    """Times a callable.
+
+    The number of calls per round is increased until a round takes at least
+    `min_time` seconds, then `repeat` rounds are timed.
+
+    :param func:
+        A callable without arguments.
+    :param min_time:
+        Minimum duration of a round, in seconds.
+    :param repeat:
+        Number of timed rounds.
+    :returns:
+        A dictionary with the best and median time per call, in seconds, the
+        number of calls per second based on the best time, and the number of
+        calls and rounds.
+    """
+    timer = timeit.Timer(func)
+    number = 1
+    while True:
+        if timer.timeit(number) >= min_time:
+            break
+
+        number *= 2 if number < 1000 else 10
+
+    times = [t / number for t in timer.repeat(repeat=repeat, number=number)]
+    best = min(times)
+    return {
+        "best": best,
+        "median": statistics.median(times),
+        "ops": 1.0 / best if best else None,
+        "number": number,
+        "repeat": repeat,
+    }
+
+
+def run(benchmarks, min_time=0.2, repeat=5, out=None):
+    """Runs benchmarks.
+
+    :param benchmarks:
+        A list of :class:`Benchmark` instances.
+    :param min_time:
+        Minimum duration of a round, in seconds. See :func:`measure`.
+    :param repeat:
+        Number of timed rounds. See :func:`measure`.
+    :param out:
+        A file-like object to report progress to, or None.
+    :returns:
+        A dictionary with the keys ``meta`` (information about the
+        environment) and ``benchmarks`` (results keyed by benchmark name).
+    """
+    results = {}
+    for bench in benchmarks:
+        func = bench.setup(bench.param)
+        results[bench.name] = rv = measure(func, min_time=min_time, repeat=repeat)
+        if out is not None:
+            out.write(
+                "%-50s %12.2f us %14.0f ops/s\n"
+                % (bench.name, rv["best"] * 1e6, rv["ops"] or 0)
+            )
+
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "webapp2": webapp2.__version__,
+            "date": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "argv": sys.argv[1:],
+        },
+        "benchmarks": results,
+    }
+
+
+def compare(results, baseline, threshold=0.1):
+    """Compares results against a baseline.
+
+    :param results:
+        Results returned by :func:`run`.
+    :param baseline:
+        Results from a previous run, e.g. loaded from a JSON file.
+    :param threshold:
+        Relative change of the best time above which a benchmark is
+        considered a regression or an improvement. Default is 10%.
+    :returns:
+        A list of tuples ``(name, baseline_time, current_time, ratio,
+        status)``, where status is ``'regression'``, ``'improvement'`` or
+        ``'unchanged'``. Benchmarks missing from the baseline are skipped.
+    """
+    rv = []
+    base = baseline["benchmarks"]
+    for name, current in results["benchmarks"].items():
+        if name not in base:
+            continue
+
+        old_time, new_time = base[name]["best"], current["best"]
+        ratio = new_time / old_time if old_time else 1.0
+        if ratio > 1 + threshold:
+            status = "regression"
+        elif ratio < 1 - threshold:
+            status = "improvement"
+        else:
+            status = "unchanged"
+
+        rv.append((name, old_time, new_time, ratio, status))
+
+    return rv
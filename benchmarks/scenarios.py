@@ -0,0 +1,359 @@
+# Copyright 2011 webapp2 AUTHORS.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+benchmarks.scenarios
+====================
+
+Framework benchmarks. Importing this module registers them in
+:mod:`benchmarks.runner`.
+"""
+import datetime
+
+from jinja2 import DictLoader
+
+import webapp2
+from benchmarks.runner import benchmark
+from webapp2_extras import (
+    i18n,
+    jinja2,
+    securecookie,
+    security,
+    sessions,
+    timing,
+    xsrf,
+)
+
+#: Sizes of the synthetic route tables.
+ROUTE_TABLE_SIZES = [10, 100, 1000, 5000]
+
+SECRET_KEY = "benchmark-secret-key"
+
+
+class HelloHandler(webapp2.RequestHandler):
+    def get(self, **kwargs):
+        self.response.write("Hello, world!")
+
+
+def build_routes(size):
+    """Returns `size` routes with one variable each. Every route has a
+    different static prefix, so the last route is the slowest to match.
+    """
+    return [
+        webapp2.Route(
+            r"/section%d/<item_id:\d+>/detail" % i, HelloHandler, name="route-%d" % i
+        )
+        for i in range(size)
+    ]
+
+
+def build_app(routes=None, config=None, debug=False):
+    config = dict(config or {})
+    config.setdefault("webapp2_extras.sessions", {"secret_key": SECRET_KEY})
+    return webapp2.WSGIApplication(routes, debug=debug, config=config)
+
+
+def build_request(app, path="/", **kwargs):
+    request = webapp2.Request.blank(path, **kwargs)
+    request.app = app
+    return request
+
+
+def call_app(app, environ):
+    """Returns a callable that sends a copy of `environ` through the app."""
+
+    def start_response(status, headers, exc_info=None):
+        return lambda data: None
+
+    def func():
+        for _ in app(environ.copy(), start_response):
+            pass
+
+    return func
+
+
+# Routing ---------------------------------------------------------------------
+
+
+@benchmark("app.call", params=ROUTE_TABLE_SIZES)
+def bench_app_call(size):
+    app = build_app(build_routes(size))
+    environ = webapp2.Request.blank("/section%d/42/detail" % (size - 1)).environ
+    return call_app(app, environ)
+
+
+@benchmark("app.call.timing", params=[10])
+def bench_app_call_timing(size):
+    app = build_app(build_routes(size))
+    timing.get_recorder(app=app)
+    environ = webapp2.Request.blank("/section%d/42/detail" % (size - 1)).environ
+    return call_app(app, environ)
+
+
+@benchmark("app.call.not_found", params=ROUTE_TABLE_SIZES)
+def bench_app_call_not_found(size):
+    app = build_app(build_routes(size))
+    environ = webapp2.Request.blank("/not/found").environ
+    return call_app(app, environ)
+
+
+@benchmark("router.default_matcher", params=ROUTE_TABLE_SIZES)
+def bench_router_match(size):
+    app = build_app(build_routes(size))
+    request = build_request(app, "/section%d/42/detail" % (size - 1))
+    return lambda: app.router.default_matcher(request)
+
+
+@benchmark("route._build")
+def bench_route_build(param):
+    route = webapp2.Route(
+        r"/blog/<year:\d{4}>/<month:\d{2}>/<slug>", HelloHandler, name="post"
+    )
+    return lambda: route._build((), {"year": 2011, "month": "07", "slug": "foo"})
+
+
+@benchmark("router.build")
+def bench_router_build(param):
+    app = build_app(build_routes(100))
+    request = build_request(app, "/")
+    return lambda: app.router.build(request, "route-50", (), {"item_id": 42})
+
+
+# Secure cookies --------------------------------------------------------------
+
+COOKIE_VALUE = {
+    "user_id": 1234567,
+    "token": "A" * 22,
+    "remember": 1,
+    "flashes": [["Saved!", "info"]],
+}
+
+
+SERIALIZERS = {
+    "legacy": securecookie.SecureCookieSerializer,
+    "fast": securecookie.FastSecureCookieSerializer,
+}
+
+
+@benchmark("securecookie.serialize", params=list(SERIALIZERS))
+def bench_securecookie_serialize(kind):
+    serializer = SERIALIZERS[kind](SECRET_KEY)
+    return lambda: serializer.serialize("session", COOKIE_VALUE)
+
+
+@benchmark("securecookie.deserialize", params=list(SERIALIZERS))
+def bench_securecookie_deserialize(kind):
+    serializer = SERIALIZERS[kind](SECRET_KEY)
+    value = serializer.serialize("session", COOKIE_VALUE)
+    return lambda: serializer.deserialize("session", value)
+
+
+@benchmark("securecookie.roundtrip", params=list(SERIALIZERS))
+def bench_securecookie_roundtrip(kind):
+    serializer = SERIALIZERS[kind](SECRET_KEY)
+
+    def func():
+        value = serializer.serialize("session", COOKIE_VALUE)
+        serializer.deserialize("session", value)
+
+    return func
+
+
+# Security --------------------------------------------------------------------
+
+#: Arguments of common random tokens: session ids, auth tokens and salts.
+RANDOM_STRINGS = {
+    "sid": {"entropy": 128},
+    "token": {"length": 64},
+    "salt": {"length": 22},
+}
+
+
+@benchmark("security.generate_random_string", params=list(RANDOM_STRINGS))
+def bench_generate_random_string(kind):
+    kwargs = RANDOM_STRINGS[kind]
+    return lambda: security.generate_random_string(**kwargs)
+
+
+#: Pairs of hex digests compared by :func:`security.compare_hashes`.
+HASH_PAIRS = {
+    "equal": ("a" * 64, "a" * 64),
+    "differ_first": ("a" * 64, "b" + "a" * 63),
+    "differ_last": ("a" * 64, "a" * 63 + "b"),
+    "mixed_types": ("a" * 64, b"a" * 64),
+}
+
+
+@benchmark("security.compare_hashes", params=list(HASH_PAIRS))
+def bench_compare_hashes(kind):
+    a, b = HASH_PAIRS[kind]
+    return lambda: security.compare_hashes(a, b)
+
+
+# XSRF ------------------------------------------------------------------------
+
+
+@benchmark("xsrf.generate_token_string")
+def bench_xsrf_generate(param):
+    def func():
+        # A new object per call: tokens are memoized per action.
+        token = xsrf.XSRFToken("user@example.com", SECRET_KEY)
+        token.generate_token_string("/account/settings")
+
+    return func
+
+
+@benchmark("xsrf.generate_token_strings", params=[10])
+def bench_xsrf_generate_many(size):
+    actions = ["/form/%d" % i for i in range(size)]
+
+    def func():
+        token = xsrf.XSRFToken("user@example.com", SECRET_KEY)
+        token.generate_token_strings(actions)
+
+    return func
+
+
+@benchmark("xsrf.verify_token_string")
+def bench_xsrf_verify(param):
+    token_string = xsrf.XSRFToken("user@example.com", SECRET_KEY).generate_token_string(
+        "/account/settings"
+    )
+
+    def func():
+        # A new object per call, as in a new request.
+        token = xsrf.XSRFToken("user@example.com", SECRET_KEY)
+        token.verify_token_string(token_string, "/account/settings", timeout=3600)
+
+    return func
+
+
+# Sessions --------------------------------------------------------------------
+
+
+def _session_cookie(app, size):
+    request = build_request(app)
+    store = sessions.SessionStore(request)
+    session = store.get_session()
+    for i in range(size):
+        session["key-%d" % i] = "value-%d" % i
+
+    response = webapp2.Response()
+    store.save_sessions(response)
+    return response.headers["Set-Cookie"].split(";")[0]
+
+
+@benchmark("sessions.read", params=[1, 20])
+def bench_sessions_read(size):
+    app = build_app()
+    cookie = _session_cookie(app, size)
+
+    def func():
+        request = build_request(app, headers={"Cookie": cookie})
+        store = sessions.SessionStore(request)
+        store.get_session().get("key-0")
+        store.save_sessions(webapp2.Response())
+
+    return func
+
+
+@benchmark("sessions.write", params=[1, 20])
+def bench_sessions_write(size):
+    app = build_app()
+    cookie = _session_cookie(app, size)
+
+    def func():
+        request = build_request(app, headers={"Cookie": cookie})
+        store = sessions.SessionStore(request)
+        session = store.get_session()
+        session["counter"] = session.get("counter", 0) + 1
+        session.add_flash("Saved!")
+        store.save_sessions(webapp2.Response())
+
+    return func
+
+
+# I18n ------------------------------------------------------------------------
+
+
+def _i18n(locale="en_US"):
+    app = build_app()
+    request = build_request(app)
+    app.set_globals(app=app, request=request)
+    try:
+        provider = i18n.I18n(request)
+        provider.set_locale(locale)
+    finally:
+        app.clear_globals()
+
+    return provider
+
+
+@benchmark("i18n.format_date")
+def bench_i18n_format_date(param):
+    provider = _i18n()
+    value = datetime.date(2011, 7, 15)
+    return lambda: provider.format_date(value)
+
+
+@benchmark("i18n.format_datetime")
+def bench_i18n_format_datetime(param):
+    provider = _i18n()
+    value = datetime.datetime(2011, 7, 15, 12, 30)
+    return lambda: provider.format_datetime(value)
+
+
+@benchmark("i18n.format_decimal")
+def bench_i18n_format_decimal(param):
+    provider = _i18n()
+    return lambda: provider.format_decimal(1234567.891)
+
+
+# Templates -------------------------------------------------------------------
+
+TEMPLATES = {
+    "simple.html": "<p>{{ message }}</p>",
+    "list.html": (
+        "<ul>{% for item in items %}"
+        "<li><a href='{{ item.url }}'>{{ item.title }}</a></li>"
+        "{% endfor %}</ul>"
+    ),
+}
+
+
+def _renderer():
+    app = build_app(
+        config={
+            "webapp2_extras.jinja2": {
+                "environment_args": {
+                    "autoescape": True,
+                    "loader": DictLoader(TEMPLATES),
+                },
+            },
+        }
+    )
+    return jinja2.Jinja2(app)
+
+
+@benchmark("jinja2.render_template")
+def bench_jinja2_render_simple(param):
+    renderer = _renderer()
+    return lambda: renderer.render_template("simple.html", message="Hello")
+
+
+@benchmark("jinja2.render_template.list", params=[10, 100])
+def bench_jinja2_render_list(size):
+    renderer = _renderer()
+    items = [{"url": "/item/%d" % i, "title": "Item <%d>" % i} for i in range(size)]
+    return lambda: renderer.render_template("list.html", items=items)
@@ -55,6 +55,15 @@ def session_tests_gaesdk(session):
     run_tests(session, "requirements-dev-gaesdk.txt", gae=True)
 
 
+def session_benchmarks(session):
+    """Runs the benchmarks. Extra arguments are passed to the runner, e.g.
+    ``nox -s benchmarks -- --compare baseline.json``."""
+    session.interpreter = "python3"
+    session.install("-r", "requirements-dev.txt")
+    session.install("-e", ".")
+    session.run("python", "-m", "benchmarks", *session.posargs)
+
+
 def session_docs(session):
     session.interpreter = "python2.7"
     session.install("-r", "requirements-dev.txt")
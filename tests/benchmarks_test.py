@@ -0,0 +1,71 @@
+# Copyright 2011 webapp2 AUTHORS.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import unittest
+
+from benchmarks import runner, scenarios  # noqa: F401
+from tests.test_base import BaseTestCase
+
+
+class TestBenchmarks(BaseTestCase):
+    def test_scenarios_setup(self):
+        # Every scenario must build and run once without errors.
+        for bench in runner.get_benchmarks():
+            func = bench.setup(bench.param)
+            func()
+
+    def test_get_benchmarks(self):
+        names = [b.name for b in runner.get_benchmarks(["router.default_matcher*"])]
+        self.assertEqual(
+            names,
+            [
+                "router.default_matcher[10]",
+                "router.default_matcher[100]",
+                "router.default_matcher[1000]",
+                "router.default_matcher[5000]",
+            ],
+        )
+
+    def test_run(self):
+        out = io.StringIO()
+        benchmarks = runner.get_benchmarks(["route._build"])
+        results = runner.run(benchmarks, min_time=0.001, repeat=1, out=out)
+        self.assertEqual(list(results["benchmarks"]), ["route._build"])
+        result = results["benchmarks"]["route._build"]
+        self.assertTrue(result["best"] > 0)
+        self.assertEqual(result["repeat"], 1)
+        self.assertTrue("python" in results["meta"])
+        self.assertTrue(out.getvalue().startswith("route._build"))
+
+    def test_compare(self):
+        baseline = {"benchmarks": {"a": {"best": 1.0}, "b": {"best": 1.0}}}
+        results = {
+            "benchmarks": {
+                "a": {"best": 1.5},
+                "b": {"best": 0.5},
+                "c": {"best": 1.0},
+            }
+        }
+        rv = runner.compare(results, baseline, threshold=0.1)
+        self.assertEqual(
+            [(name, status) for name, old, new, ratio, status in rv],
+            [("a", "regression"), ("b", "improvement")],
+        )
+        rv = runner.compare(results, baseline, threshold=1.0)
+        self.assertEqual([r[4] for r in rv], ["unchanged", "unchanged"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,296 @@
+# Copyright 2011 webapp2 AUTHORS.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import unittest
+
+import webapp2
+from tests.test_base import BaseTestCase
+from webapp2_extras import auth, security
+
+
+class FakeUser:
+    """A user model that keeps users and tokens in memory and counts reads."""
+
+    users = {}
+    tokens = {}
+    reads = 0
+
+    password_method = "sha1"
+
+    def __init__(self, user_id, name):
+        self.user_id = user_id
+        self.name = name
+        self.password = None
+
+    def get_id(self):
+        return self.user_id
+
+    def set_password(self, raw_password, hashing_pool=None):
+        self.password = security.generate_password_hash(raw_password)
+
+    def put(self):
+        FakeUser.users[self.user_id] = self
+
+    @classmethod
+    def get_by_auth_token(cls, user_id, token):
+        cls.reads += 1
+        ts = cls.tokens.get((user_id, token))
+        if ts is None or user_id not in cls.users:
+            return None, None
+
+        return cls.users[user_id], ts
+
+    @classmethod
+    def create_auth_token(cls, user_id):
+        token = security.generate_random_string(entropy=128)
+        cls.tokens[(user_id, token)] = int(time.time())
+        return token
+
+    @classmethod
+    def delete_auth_token(cls, user_id, token):
+        cls.tokens.pop((user_id, token), None)
+
+
+class BatchedFakeUser(FakeUser):
+    """A user model with batched token operations."""
+
+    renewals = 0
+
+    @classmethod
+    def renew_auth_token(cls, user_id, token):
+        cls.renewals += 1
+        cls.delete_auth_token(user_id, token)
+        return cls.create_auth_token(user_id)
+
+    @classmethod
+    def delete_auth_tokens(cls, user_id):
+        keys = [k for k in cls.tokens if k[0] == user_id]
+        for key in keys:
+            del cls.tokens[key]
+
+        return len(keys)
+
+
+class FakeMemcache:
+    """An in-memory stand-in for the App Engine memcache API."""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, time=0):
+        self.data[key] = value
+        return True
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+class TestUserCache(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        FakeUser.users = {}
+        FakeUser.tokens = {}
+        FakeUser.reads = 0
+        BatchedFakeUser.renewals = 0
+        FakeUser(1, "alice").put()
+        FakeUser(2, "bob").put()
+
+    def get_store(self, **config):
+        config.setdefault("user_model", FakeUser)
+        config.setdefault("user_attributes", ["name"])
+        app = webapp2.WSGIApplication(config={"webapp2_extras.auth": config})
+        return auth.AuthStore(app)
+
+    def test_local_cache(self):
+        store = self.get_store()
+        token = store.create_auth_token(1)
+        user, ts = store.get_user_by_auth_token(1, token)
+        self.assertEqual(user, {"user_id": 1, "name": "alice"})
+
+        # Callers can change the returned dict.
+        user["token"] = token
+        user2, ts2 = store.get_user_by_auth_token(1, token)
+        self.assertEqual(user2, {"user_id": 1, "name": "alice"})
+        self.assertEqual(ts2, ts)
+        self.assertEqual(FakeUser.reads, 1)
+
+        # Unknown tokens are not cached.
+        self.assertEqual(store.get_user_by_auth_token(1, "unknown"), (None, None))
+        self.assertEqual(store.get_user_by_auth_token(1, "unknown"), (None, None))
+        self.assertEqual(FakeUser.reads, 3)
+
+    def test_validate_token(self):
+        store = self.get_store()
+        token = store.create_auth_token(1)
+        for _ in range(3):
+            user, rv_token = store.validate_token(1, token)
+            self.assertEqual(user["name"], "alice")
+            self.assertEqual(rv_token, token)
+
+        self.assertEqual(FakeUser.reads, 1)
+
+    def test_delete_auth_token(self):
+        store = self.get_store()
+        token = store.create_auth_token(1)
+        store.get_user_by_auth_token(1, token)
+        store.delete_auth_token(1, token)
+        self.assertEqual(store.get_user_by_auth_token(1, token), (None, None))
+        self.assertEqual(FakeUser.reads, 2)
+
+    def test_set_password(self):
+        store = self.get_store()
+        tokens = [store.create_auth_token(1) for _ in range(2)]
+        other = store.create_auth_token(2)
+        for token in tokens + [other]:
+            store.get_user_by_auth_token(token == other and 2 or 1, token)
+
+        store.set_password(FakeUser.users[1], "new-password")
+        self.assertTrue(
+            security.check_password_hash("new-password", FakeUser.users[1].password)
+        )
+        self.assertEqual(len(store.user_cache), 1)
+        store.get_user_by_auth_token(1, tokens[0])
+        store.get_user_by_auth_token(2, other)
+        self.assertEqual(FakeUser.reads, 4)
+
+    def test_shared_cache(self):
+        client = FakeMemcache()
+        store = self.get_store(user_cache_client=client, user_cache_ttl=600)
+        self.assertEqual(store.user_cache.ttl, 600)
+        token = store.create_auth_token(1)
+        store.get_user_by_auth_token(1, token)
+        # The user and the cache generation of the user.
+        self.assertEqual(len(client.data), 2)
+
+        # Another instance finds the user in the shared cache.
+        store2 = self.get_store(user_cache_client=client)
+        user, ts = store2.get_user_by_auth_token(1, token)
+        self.assertEqual(user["name"], "alice")
+        self.assertEqual(FakeUser.reads, 1)
+        self.assertEqual(len(store2.user_cache), 1)
+
+        # Changing the password in one instance invalidates the shared entries.
+        store.set_password(FakeUser.users[1], "new-password")
+        store.get_user_by_auth_token(1, token)
+        self.assertEqual(FakeUser.reads, 2)
+
+    def test_shared_cache_concurrent_logins(self):
+        client = FakeMemcache()
+        tokens = [self.get_store().create_auth_token(1) for _ in range(2)]
+        # Each instance caches a token of the same user, and a third one
+        # without any of them in its local cache invalidates them all.
+        stores = [self.get_store(user_cache_client=client) for _ in tokens]
+        for store, token in zip(stores, tokens):
+            store.get_user_by_auth_token(1, token)
+
+        self.get_store(user_cache_client=client).invalidate_user_cache(1)
+        for token in tokens:
+            self.get_store(user_cache_client=client).get_user_by_auth_token(1, token)
+
+        self.assertEqual(FakeUser.reads, 4)
+
+    def test_shared_cache_delete_auth_token(self):
+        client = FakeMemcache()
+        store = self.get_store(user_cache_client=client)
+        token = store.create_auth_token(1)
+        store.get_user_by_auth_token(1, token)
+        store.delete_auth_token(1, token)
+        store2 = self.get_store(user_cache_client=client)
+        self.assertEqual(store2.get_user_by_auth_token(1, token), (None, None))
+
+    def test_renew_auth_token(self):
+        for model in (FakeUser, BatchedFakeUser):
+            store = self.get_store(user_model=model)
+            token = store.create_auth_token(1)
+            store.get_user_by_auth_token(1, token)
+            new_token = store.renew_auth_token(1, token)
+            self.assertNotEqual(new_token, token)
+            self.assertEqual(store.get_user_by_auth_token(1, token), (None, None))
+            user, ts = store.get_user_by_auth_token(1, new_token)
+            self.assertEqual(user["name"], "alice")
+
+        self.assertEqual(BatchedFakeUser.renewals, 1)
+
+    def test_validate_token_renew(self):
+        store = self.get_store(token_new_age=-1)
+        token = store.create_auth_token(1)
+        user, rv_token = store.validate_token(1, token)
+        self.assertEqual(user["name"], "alice")
+        self.assertEqual(rv_token, None)
+        self.assertEqual(FakeUser.tokens, {})
+
+        token = store.create_auth_token(1)
+        user, rv_token = store.validate_token(1, token, renew=True)
+        self.assertEqual(user["name"], "alice")
+        self.assertNotEqual(rv_token, token)
+        self.assertEqual(list(FakeUser.tokens), [(1, rv_token)])
+
+    def test_get_user_by_token_renew(self):
+        app = webapp2.WSGIApplication(
+            config={
+                "webapp2_extras.auth": {
+                    "user_model": BatchedFakeUser,
+                    "token_new_age": -1,
+                },
+                "webapp2_extras.sessions": {"secret_key": "foo"},
+            }
+        )
+        request = webapp2.Request.blank("/")
+        request.app = app
+        a = auth.Auth(request)
+        token = BatchedFakeUser.create_auth_token(1)
+        user = a.get_user_by_token(1, token)
+        self.assertNotEqual(user["token"], token)
+        self.assertTrue(user["token_ts"] > time.time() - 60)
+        self.assertEqual(list(BatchedFakeUser.tokens), [(1, user["token"])])
+        self.assertEqual(BatchedFakeUser.renewals, 1)
+
+    def test_delete_auth_tokens(self):
+        store = self.get_store(user_model=BatchedFakeUser)
+        tokens = [store.create_auth_token(1) for _ in range(3)]
+        other = store.create_auth_token(2)
+        for token in tokens:
+            store.get_user_by_auth_token(1, token)
+
+        self.assertEqual(store.delete_auth_tokens(1), 3)
+        self.assertEqual(len(store.user_cache), 0)
+        for token in tokens:
+            self.assertEqual(store.get_user_by_auth_token(1, token), (None, None))
+
+        user, ts = store.get_user_by_auth_token(2, other)
+        self.assertEqual(user["name"], "bob")
+
+    def test_import_client(self):
+        store = self.get_store(user_cache_client="tests.extras_auth_cache_test.client")
+        self.assertTrue(store.user_cache_client is client)
+
+    def test_disabled(self):
+        for config in ({"user_cache_size": 0}, {"token_cache_age": None}):
+            FakeUser.reads = 0
+            store = self.get_store(**config)
+            token = store.create_auth_token(1)
+            store.get_user_by_auth_token(1, token)
+            store.get_user_by_auth_token(1, token)
+            self.assertEqual(FakeUser.reads, 2)
+
+
+client = FakeMemcache()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+# Copyright 2011 webapp2 AUTHORS.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from unittest import mock
+
+from tests.test_base import BaseTestCase
+from webapp2_extras import cache
+
+
+class TestLRUCache(BaseTestCase):
+    def test_lru(self):
+        c = cache.LRUCache(2)
+        c.set("a", 1)
+        c.set("b", 2)
+        self.assertEqual(c.get("a"), 1)
+        c.set("c", 3)
+        self.assertEqual(c.items(), [("a", 1), ("c", 3)])
+        self.assertEqual(c.get("b", "default"), "default")
+        self.assertEqual((c.hits, c.misses), (1, 1))
+        self.assertEqual(c.pop("a"), 1)
+        self.assertNotIn("a", c)
+        c.clear()
+        self.assertEqual((len(c), c.hits, c.misses), (0, 0, 0))
+
+    def test_mapping(self):
+        c = cache.LRUCache(2)
+        c["a"] = 1
+        c["b"] = 2
+        self.assertEqual(c["a"], 1)
+        self.assertEqual(list(c), ["b", "a"])
+        self.assertEqual(c.keys(), ["b", "a"])
+        del c["b"]
+        self.assertRaises(KeyError, lambda: c["b"])
+        with self.assertRaises(KeyError):
+            del c["b"]
+
+    def test_disabled(self):
+        c = cache.LRUCache(0)
+        c.set("a", 1)
+        self.assertEqual(len(c), 0)
+
+
+class TestTTLCache(BaseTestCase):
+    def test_ttl(self):
+        c = cache.TTLCache(10, ttl=30)
+        with mock.patch.object(cache.time, "monotonic", return_value=100.0):
+            c.set("a", 1)
+            c.set("b", 2)
+
+        with mock.patch.object(cache.time, "monotonic", return_value=129.0):
+            self.assertEqual(c.get("a"), 1)
+            self.assertIn("b", c)
+            self.assertEqual(c.items(), [("b", 2), ("a", 1)])
+
+        with mock.patch.object(cache.time, "monotonic", return_value=130.0):
+            self.assertEqual(c.get("a"), None)
+            self.assertNotIn("b", c)
+            self.assertEqual(c.items(), [])
+            self.assertEqual(c.pop("b", "default"), "default")
+
+        self.assertEqual((c.hits, c.misses), (1, 1))
+        self.assertEqual(len(c), 0)
+        self.assertRaises(KeyError, lambda: c["a"])
+
+    def test_max_size(self):
+        c = cache.TTLCache(2, ttl=30)
+        for key in "abc":
+            c.set(key, key)
+
+        self.assertEqual(c.get("a"), None)
+        self.assertEqual(c.pop("c"), "c")
+        self.assertEqual(len(c), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,217 @@
+# Copyright 2011 webapp2 AUTHORS.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gzip
+import unittest
+import zlib
+
+import webapp2
+from tests.test_base import BaseTestCase
+from webapp2_extras import compression
+
+BODY = b"Hello, world! " * 100
+
+
+def get_request(accept_encoding="gzip, deflate"):
+    headers = {}
+    if accept_encoding is not None:
+        headers["Accept-Encoding"] = accept_encoding
+
+    return webapp2.Request.blank("/", headers=headers)
+
+
+class TestCompression(BaseTestCase):
+    def setUp(self):
+        app = webapp2.WSGIApplication(
+            config={"webapp2_extras.compression": {"encodings": ["gzip", "deflate"]}}
+        )
+        self.compressor = compression.Compressor(app)
+
+    def test_gzip(self):
+        rsp = webapp2.Response(BODY)
+        rv = self.compressor.compress_response(get_request(), rsp)
+        self.assertEqual(rv, "gzip")
+        self.assertEqual(rsp.headers["Content-Encoding"], "gzip")
+        self.assertEqual(rsp.headers["Vary"], "Accept-Encoding")
+        self.assertEqual(rsp.content_length, len(rsp.body))
+        self.assertEqual(gzip.decompress(rsp.body), BODY)
+
+    def test_deflate(self):
+        rsp = webapp2.Response(BODY)
+        rv = self.compressor.compress_response(get_request("deflate"), rsp)
+        self.assertEqual(rv, "deflate")
+        self.assertEqual(zlib.decompress(rsp.body), BODY)
+
+    def test_quality_values(self):
+        req = get_request("gzip;q=0.5, deflate")
+        self.assertEqual(self.compressor.negotiate(req), "deflate")
+        req = get_request("identity")
+        self.assertEqual(self.compressor.negotiate(req), None)
+        req = get_request(None)
+        self.assertEqual(self.compressor.negotiate(req), None)
+
+    def test_skip_small_body(self):
+        rsp = webapp2.Response(b"small")
+        rv = self.compressor.compress_response(get_request(), rsp)
+        self.assertEqual(rv, None)
+        self.assertEqual(rsp.body, b"small")
+        self.assertFalse("Content-Encoding" in rsp.headers)
+        self.assertEqual(rsp.headers["Vary"], "Accept-Encoding")
+
+    def test_skip_not_compressible(self):
+        rsp = webapp2.Response(BODY, content_type="image/png")
+        self.assertEqual(self.compressor.compress_response(get_request(), rsp), None)
+        self.assertFalse("Vary" in rsp.headers)
+
+        rsp = webapp2.Response(BODY)
+        rsp.headers["Content-Encoding"] = "br"
+        self.assertEqual(self.compressor.compress_response(get_request(), rsp), None)
+
+        rsp = webapp2.Response(BODY)
+        rsp.headers["Cache-Control"] = "no-transform"
+        self.assertEqual(self.compressor.compress_response(get_request(), rsp), None)
+
+        rsp = webapp2.Response(status=304)
+        self.assertEqual(self.compressor.compress_response(get_request(), rsp), None)
+
+        rsp = webapp2.Response(BODY, status=206)
+        rsp.headers["Content-Range"] = "bytes 0-%d/10000" % (len(BODY) - 1)
+        self.assertEqual(self.compressor.compress_response(get_request(), rsp), None)
+        self.assertEqual(rsp.body, BODY)
+
+        rsp = webapp2.Response(BODY)
+        rsp.headers["Content-Range"] = "bytes */10000"
+        self.assertEqual(self.compressor.compress_response(get_request(), rsp), None)
+
+    def test_etag(self):
+        rsp = webapp2.Response(BODY)
+        rsp.headers["ETag"] = '"abc"'
+        self.compressor.compress_response(get_request(), rsp)
+        self.assertEqual(rsp.headers["ETag"], '"abc-gzip"')
+
+        # Weak ETags don't identify the bytes, so they are kept.
+        rsp = webapp2.Response(BODY)
+        rsp.headers["ETag"] = 'W/"abc"'
+        self.compressor.compress_response(get_request(), rsp)
+        self.assertEqual(rsp.headers["ETag"], 'W/"abc"')
+
+        # Not compressed: the ETag is kept.
+        rsp = webapp2.Response(BODY)
+        rsp.headers["ETag"] = '"abc"'
+        self.compressor.compress_response(get_request("identity"), rsp)
+        self.assertEqual(rsp.headers["ETag"], '"abc"')
+
+    def test_cache(self):
+        rsp1 = webapp2.Response(BODY)
+        self.compressor.compress_response(get_request(), rsp1)
+        self.assertEqual(self.compressor.cache.misses, 1)
+
+        rsp2 = webapp2.Response(BODY)
+        self.compressor.compress_response(get_request(), rsp2)
+        self.assertEqual(self.compressor.cache.hits, 1)
+        self.assertEqual(rsp1.body, rsp2.body)
+
+        # Same body, another coding.
+        rsp3 = webapp2.Response(BODY)
+        self.compressor.compress_response(get_request("deflate"), rsp3)
+        self.assertEqual(self.compressor.cache.misses, 2)
+        self.assertEqual(len(self.compressor.cache), 2)
+
+    def test_stream(self):
+        closed = []
+
+        class Body:
+            def __iter__(self):
+                for _ in range(100):
+                    yield b"Hello, world! "
+
+            def close(self):
+                closed.append(True)
+
+        rsp = webapp2.Response(app_iter=Body())
+        rv = self.compressor.compress_response(get_request(), rsp)
+        self.assertEqual(rv, "gzip")
+        self.assertEqual(rsp.content_length, None)
+        self.assertEqual(gzip.decompress(b"".join(rsp.app_iter)), BODY)
+        self.assertEqual(closed, [True])
+
+    def test_stream_flushes_chunks(self):
+        produced = []
+
+        def body():
+            for i in range(5):
+                chunk = b"chunk %d " % i * 50
+                produced.append(chunk)
+                yield chunk
+
+        rsp = webapp2.Response(app_iter=body())
+        self.compressor.compress_response(get_request(), rsp)
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        chunks = iter(rsp.app_iter)
+        for i in range(5):
+            # Each compressed chunk decodes to the chunk just produced.
+            data = decompressor.decompress(next(chunks))
+            self.assertEqual(len(produced), i + 1)
+            self.assertEqual(data, produced[i])
+
+        decompressor.decompress(b"".join(chunks))
+        self.assertTrue(decompressor.eof)
+
+    def test_get_set_compressor(self):
+        app = webapp2.WSGIApplication()
+        compressor = compression.get_compressor(app=app)
+        self.assertTrue(isinstance(compressor, compression.Compressor))
+        self.assertTrue(compression.get_compressor(app=app) is compressor)
+
+        compressor2 = compression.Compressor(app)
+        compression.set_compressor(compressor2, app=app)
+        self.assertTrue(compression.get_compressor(app=app) is compressor2)
+
+    def test_handler(self):
+        class HomeHandler(webapp2.RequestHandler):
+            def dispatch(self):
+                try:
+                    webapp2.RequestHandler.dispatch(self)
+                finally:
+                    compressor = compression.get_compressor(app=self.app)
+                    compressor.compress_response(self.request, self.response)
+
+            def get(self):
+                self.response.write(BODY)
+
+        app = webapp2.WSGIApplication([("/", HomeHandler)])
+        rsp = app.get_response("/", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(rsp.headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(rsp.body), BODY)
+
+    def test_install(self):
+        class HomeHandler(webapp2.RequestHandler):
+            def get(self):
+                self.response.write(BODY)
+
+        app = webapp2.WSGIApplication([("/", HomeHandler)])
+        compressor = compression.get_compressor(app=app)
+        compressor.install()
+        rsp = app.get_response("/", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(rsp.headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(rsp.body), BODY)
+
+        compressor.uninstall()
+        rsp = app.get_response("/", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", rsp.headers)
+        self.assertEqual(rsp.body, BODY)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -13,10 +13,19 @@
 # limitations under the License.
 
 import datetime
+import gettext
+import os
+import shutil
+import tempfile
+import threading
+import time
 import unittest
 from decimal import Decimal
+from unittest import mock
 
 import pytz
+from babel.messages.catalog import Catalog
+from babel.messages.mofile import write_mo
 from babel.numbers import NumberFormatError
 
 import webapp2
@@ -497,5 +506,235 @@ class I18nTestCase(unittest.TestCase):
         i18n.get_store().set_timezone_selector("tests.resources.i18n.timezone_selector")
 
 
+class CatalogTestCase(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = tempfile.mkdtemp()
+        self.translations_path = os.path.join(self.path, "locale")
+        self.compiled_path = os.path.join(self.path, "compiled")
+        self.write_catalog("pt_BR", "messages", {"Hello": "Olá"})
+        self.write_catalog("pt_BR", "forms", {"Save": "Salvar"})
+        self.write_catalog("es_ES", "messages", {"Hello": "Hola"})
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        super().tearDown()
+
+    def write_catalog(self, locale, domain, messages, mtime=None):
+        dirname = os.path.join(self.translations_path, locale, "LC_MESSAGES")
+        os.makedirs(dirname, exist_ok=True)
+        catalog = Catalog(locale=locale)
+        for msgid, msgstr in messages.items():
+            catalog.add(msgid, msgstr)
+
+        catalog.add(("One apple", "%(num)d apples"), ("Uma maçã", "%(num)d maçãs"))
+        path = os.path.join(dirname, domain + ".mo")
+        with open(path, "wb") as f:
+            write_mo(f, catalog)
+
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+
+    def get_store(self, debug=False, **config):
+        config.setdefault("translations_path", self.translations_path)
+        config.setdefault("domains", ["messages", "forms"])
+        app = webapp2.WSGIApplication(
+            debug=debug, config={"webapp2_extras.i18n": config}
+        )
+        request = webapp2.Request.blank("/")
+        request.app = app
+        app.set_globals(app=app, request=request)
+        self.addCleanup(app.clear_globals)
+        self.app, self.request = app, request
+        return i18n.get_store(app=app)
+
+    def test_merge_domains(self):
+        trans = self.get_store().get_translations("pt_BR")
+        self.assertEqual(trans.gettext("Hello"), "Olá")
+        self.assertEqual(trans.gettext("Save"), "Salvar")
+        self.assertEqual(trans.ngettext("One apple", "Many apples", 2), "%(num)d maçãs")
+
+    def test_preload(self):
+        store = self.get_store(preload_locales=True)
+        self.assertEqual(store.get_available_locales(), ["es_ES", "pt_BR"])
+        self.assertEqual(
+            sorted(k for k, _ in store.translations.items()), ["es_ES", "pt_BR"]
+        )
+
+        store = self.get_store(preload_locales=["pt_BR"])
+        self.assertEqual([k for k, _ in store.translations.items()], ["pt_BR"])
+        trans = store.translations.get("pt_BR")
+        self.assertTrue(store.get_translations("pt_BR") is trans)
+
+        store = self.get_store(translations_path=os.path.join(self.path, "missing"))
+        self.assertEqual(store.get_available_locales(), [])
+
+    def test_debug_reload(self):
+        store = self.get_store(debug=True)
+        trans = store.get_translations("pt_BR")
+        self.assertTrue(store.get_translations("pt_BR") is trans)
+
+        # A changed source file reloads the locale.
+        self.write_catalog("pt_BR", "forms", {"Save": "Gravar"}, mtime=1)
+        trans2 = store.get_translations("pt_BR")
+        self.assertFalse(trans2 is trans)
+        self.assertEqual(trans2.gettext("Save"), "Gravar")
+        self.assertTrue(store.get_translations("pt_BR") is trans2)
+
+    def test_compiled(self):
+        store = self.get_store(compiled_path=self.compiled_path)
+        trans = store.get_translations("pt_BR")
+        self.assertTrue(isinstance(trans, i18n.MappedTranslations))
+        path = os.path.join(self.compiled_path, "pt_BR.mo")
+        self.assertEqual(trans.files, [path])
+        self.assertEqual(trans.gettext("Hello"), "Olá")
+        self.assertEqual(trans.ugettext("Save"), "Salvar")
+        self.assertEqual(trans.gettext("Missing"), "Missing")
+        self.assertEqual(trans.ngettext("One apple", "Many apples", 1), "Uma maçã")
+        self.assertEqual(trans.ngettext("One apple", "Many apples", 0), "Uma maçã")
+        self.assertEqual(trans.ngettext("One apple", "Many apples", 2), "%(num)d maçãs")
+        self.assertEqual(trans.ngettext("One pear", "Many pears", 2), "Many pears")
+        self.assertEqual(len(trans._catalog), 5)
+        loaded = store.load_translations(
+            self.translations_path, ["pt_BR"], store.domains
+        )
+        catalog = dict(trans._catalog.items())
+        self.assertEqual(catalog.pop(""), trans._catalog[""])
+        self.assertEqual(catalog, {k: v for k, v in loaded._catalog.items() if k})
+
+        # The compiled file is a regular .mo file.
+        with open(path, "rb") as f:
+            self.assertEqual(gettext.GNUTranslations(f).gettext("Save"), "Salvar")
+
+        # Other stores use the compiled file.
+        mtime = os.stat(path).st_mtime_ns
+        store = self.get_store(compiled_path=self.compiled_path)
+        self.assertEqual(store.get_translations("pt_BR").gettext("Hello"), "Olá")
+        self.assertEqual(os.stat(path).st_mtime_ns, mtime)
+
+        # It is compiled again when a source file changes.
+        self.write_catalog("pt_BR", "forms", {"Save": "Gravar"}, mtime=1)
+        store = self.get_store(compiled_path=self.compiled_path)
+        self.assertEqual(store.get_translations("pt_BR").gettext("Save"), "Gravar")
+        # The first catalog still works.
+        self.assertEqual(trans.gettext("Save"), "Salvar")
+
+    def test_compiled_cache_size(self):
+        store = self.get_store(compiled_path=self.compiled_path, compiled_cache_size=2)
+        trans = store.get_translations("pt_BR")
+        for msgid in ("Hello", "Save", "Missing", "Hello"):
+            trans.gettext(msgid)
+
+        self.assertEqual(len(trans._catalog._cache), 2)
+        self.assertEqual(trans.gettext("Save"), "Salvar")
+
+    def test_compiled_merge(self):
+        store = self.get_store(compiled_path=self.compiled_path)
+        trans = store.get_translations("pt_BR")
+        es = store.load_translations(self.translations_path, ["es_ES"], ["messages"])
+        self.assertEqual(trans.gettext("Hello"), "Olá")
+        self.assertTrue(trans.merge(es) is trans)
+        self.assertEqual(trans.gettext("Hello"), "Hola")
+        self.assertEqual(trans.gettext("Save"), "Salvar")
+        self.assertEqual(dict(trans._catalog.items())["Hello"], "Hola")
+        self.assertEqual(len(trans._catalog), 5)
+
+        # Translations of other domains are added as separate catalogs.
+        other = store.load_translations(self.translations_path, ["es_ES"], ["messages"])
+        other.domain = "other"
+        trans.add(other)
+        self.assertEqual(trans.dgettext("other", "Save"), "Salvar")
+
+        # Compiled translations can be merged into regular ones.
+        es.merge(store.get_translations("pt_BR"))
+        self.assertEqual(es.gettext("Save"), "Salvar")
+
+    def test_compiled_not_found(self):
+        store = self.get_store(compiled_path=self.compiled_path)
+        trans = store.get_translations("de_DE")
+        self.assertFalse(isinstance(trans, i18n.MappedTranslations))
+        self.assertEqual(trans.gettext("Hello"), "Hello")
+
+        # Locales that are not valid file names are not compiled.
+        trans = store.get_translations("../pt_BR")
+        self.assertFalse(isinstance(trans, i18n.MappedTranslations))
+        self.assertFalse(os.path.exists(self.compiled_path))
+
+    def test_single_flight(self):
+        store = self.get_store()
+        load_translations = store.load_translations
+        calls = []
+
+        def slow_load(*args):
+            calls.append(args)
+            time.sleep(0.05)
+            return load_translations(*args)
+
+        results = []
+
+        def worker():
+            self.app.set_globals(app=self.app, request=self.request)
+            results.append(store.get_translations("pt_BR"))
+
+        with mock.patch.object(store, "load_translations", slow_load):
+            threads = [threading.Thread(target=worker) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), 8)
+        self.assertTrue(all(trans is results[0] for trans in results))
+        self.assertEqual(store._loading, {})
+
+    def test_unknown_locales(self):
+        store = self.get_store(default_locale="pt_BR")
+        default = store.get_translations("pt_BR")
+        with mock.patch.object(
+            store, "has_catalog", wraps=store.has_catalog
+        ) as has_catalog:
+            for _ in range(3):
+                self.assertTrue(store.get_translations("xx_JUNK") is default)
+
+        self.assertEqual(has_catalog.call_count, 1)
+        self.assertTrue(store.unknown_locales.get("xx_JUNK"))
+        self.assertFalse("xx_JUNK" in store.translations)
+
+        # Variants of a locale with a catalog are known.
+        self.assertEqual(store.get_translations("es_ES.UTF-8").gettext("Hello"), "Hola")
+        self.assertFalse(store.unknown_locales.get("es_ES.UTF-8"))
+
+        # The number of unknown locales is limited.
+        store = self.get_store(unknown_locales_cache_size=2)
+        for i in range(5):
+            store.get_translations("xx_%d" % i)
+
+        self.assertEqual(len(store.unknown_locales), 2)
+
+    def test_translations_cache_size(self):
+        store = self.get_store(translations_cache_size=1)
+        es = store.get_translations("es_ES")
+        pt = store.get_translations("pt_BR")
+        self.assertEqual(len(store.translations), 1)
+        self.assertTrue(store.get_translations("pt_BR") is pt)
+        self.assertFalse(store.get_translations("es_ES") is es)
+
+        store = self.get_store(translations_cache_size=0)
+        self.assertEqual(store.get_translations("pt_BR").gettext("Hello"), "Olá")
+        self.assertEqual(len(store.translations), 0)
+
+    def test_translations_mapping(self):
+        store = self.get_store()
+        trans = gettext.NullTranslations()
+        store.translations["xx_XX"] = trans
+        self.assertTrue(store.get_translations("xx_XX") is trans)
+        self.assertTrue(store.translations["xx_XX"] is trans)
+        self.assertEqual(list(store.translations), ["xx_XX"])
+        del store.translations["xx_XX"]
+        self.assertRaises(KeyError, lambda: store.translations["xx_XX"])
+
+
 if __name__ == "__main__":
     unittest.main()
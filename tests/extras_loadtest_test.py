@@ -0,0 +1,138 @@
+# Copyright 2011 webapp2 AUTHORS.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import unittest
+
+import webapp2
+from tests.test_base import BaseTestCase
+from webapp2_extras import loadtest
+
+
+class HomeHandler(webapp2.RequestHandler):
+    def get(self):
+        self.response.write("home")
+
+
+class EchoHandler(webapp2.RequestHandler):
+    def post(self):
+        self.response.write(self.request.get("name"))
+
+
+class BrokenHandler(webapp2.RequestHandler):
+    def get(self):
+        raise ValueError("broken")
+
+
+def get_app():
+    return webapp2.WSGIApplication(
+        [
+            webapp2.Route("/", HomeHandler, name="home"),
+            webapp2.Route("/echo", EchoHandler, name="echo"),
+            webapp2.Route("/broken", BrokenHandler, name="broken"),
+        ]
+    )
+
+
+class TestLoadTest(BaseTestCase):
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(loadtest.percentile(values, 50), 50)
+        self.assertEqual(loadtest.percentile(values, 95), 95)
+        self.assertEqual(loadtest.percentile(values, 99), 99)
+        self.assertEqual(loadtest.percentile(values, 100), 100)
+        self.assertEqual(loadtest.percentile([3], 99), 3)
+        self.assertEqual(loadtest.percentile([], 50), None)
+
+    def test_replay_body(self):
+        app = get_app()
+        tester = loadtest.LoadTester(
+            app, [loadtest.RecordedRequest.blank("/echo", POST={"name": "foo"})]
+        )
+        for _ in range(2):
+            route_name, latency, status = tester.send(tester.requests[0])
+            self.assertEqual(status, 200)
+
+        # The route name is only stored while a load test runs.
+        self.assertEqual(route_name, "<unknown>")
+
+    def test_run(self):
+        app = get_app()
+        requests = [
+            loadtest.RecordedRequest.blank("/"),
+            loadtest.RecordedRequest.blank("/"),
+            loadtest.RecordedRequest.blank("/echo", POST={"name": "foo"}),
+            loadtest.RecordedRequest.blank("/broken"),
+            loadtest.RecordedRequest.blank("/missing"),
+        ]
+        result = loadtest.LoadTester(app, requests, threads=4).run(total=100, warmup=5)
+        summary = result.summary()
+        self.assertEqual(summary["<total>"]["count"], 100)
+        self.assertEqual(summary["home"]["count"], 40)
+        self.assertEqual(summary["echo"]["count"], 20)
+        self.assertEqual(summary["broken"]["count"], 20)
+        self.assertEqual(summary["broken"]["errors"], 20)
+        self.assertEqual(summary["<unmatched>"]["count"], 20)
+        self.assertEqual(summary["<unmatched>"]["errors"], 0)
+        self.assertEqual(summary["<total>"]["errors"], 20)
+
+        home = summary["home"]
+        self.assertTrue(home["p50"] <= home["p95"] <= home["p99"] <= home["max"])
+        self.assertTrue(home["throughput"] > 0)
+
+        lines = result.format().splitlines()
+        self.assertEqual(len(lines), 6)
+        self.assertTrue(lines[-1].startswith("<total>"))
+        self.assertEqual(app.hooks.get("before_response", []), [])
+
+    def test_run_duration(self):
+        app = get_app()
+        tester = loadtest.LoadTester(
+            app, [loadtest.RecordedRequest.blank("/")], threads=2
+        )
+        result = tester.run(duration=0.05)
+        self.assertTrue(result.summary()["home"]["count"] > 0)
+        self.assertTrue(result.elapsed < 1)
+
+    def test_run_default_total(self):
+        app = get_app()
+        result = loadtest.LoadTester(
+            app, [loadtest.RecordedRequest.blank("/")], threads=3
+        ).run()
+        self.assertEqual(result.summary()["home"]["count"], 3)
+
+    def test_recorder(self):
+        app = get_app()
+        recorder = loadtest.Recorder(app, max_requests=2)
+        app.get_response("/")
+        app.get_response("/echo", POST={"name": "bar"})
+        app.get_response("/")
+        recorder.uninstall()
+        app.get_response("/")
+        self.assertEqual(len(recorder.requests), 2)
+
+        # Recorded requests survive a JSON round trip.
+        data = json.loads(json.dumps([r.to_dict() for r in recorder.requests]))
+        requests = [loadtest.RecordedRequest.from_dict(d) for d in data]
+        self.assertEqual(requests[1].body, b"name=bar")
+
+        result = loadtest.LoadTester(app, requests, threads=2).run(total=10)
+        summary = result.summary()
+        self.assertEqual(summary["home"]["count"], 5)
+        self.assertEqual(summary["echo"]["count"], 5)
+        self.assertEqual(summary["<total>"]["errors"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
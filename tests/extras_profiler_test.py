@@ -0,0 +1,145 @@
+# Copyright 2011 webapp2 AUTHORS.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import pstats
+import shutil
+import tempfile
+import unittest
+
+import webapp2
+from tests.test_base import BaseTestCase
+from webapp2_extras import profiler
+
+
+def busy_function():
+    return sum(range(1000))
+
+
+class HomeHandler(webapp2.RequestHandler):
+    def get(self):
+        self.response.write(str(busy_function()))
+
+
+def get_app(**config):
+    config.setdefault("secret_key", "my-super-secret")
+    return webapp2.WSGIApplication(
+        [
+            webapp2.Route("/", HomeHandler, name="home"),
+            webapp2.Route("/_profiler", profiler.ProfilerHandler),
+        ],
+        config={"webapp2_extras.profiler": config},
+    )
+
+
+class TestProfiler(BaseTestCase):
+    def test_sample_every(self):
+        app = get_app(sample_every=3)
+        prof = profiler.get_profiler(app=app)
+        self.assertTrue(profiler.get_profiler(app=app) is prof)
+
+        for _ in range(7):
+            app.get_response("/")
+
+        self.assertEqual(prof.get_routes(), {"home": 2})
+        stats = prof.get_stats("home")
+        self.assertTrue(isinstance(stats, pstats.Stats))
+        functions = [func[2] for func in stats.stats]
+        self.assertTrue("busy_function" in functions)
+        self.assertTrue("busy_function" in prof.format_stats("home"))
+        self.assertEqual(prof.get_stats("foo"), None)
+        self.assertEqual(prof.format_stats("foo"), None)
+
+        prof.reset()
+        self.assertEqual(prof.get_routes(), {})
+
+    def test_debug_header(self):
+        app = get_app()
+        prof = profiler.get_profiler(app=app)
+
+        app.get_response("/")
+        self.assertEqual(prof.get_routes(), {})
+
+        app.get_response("/", headers={"X-Webapp2-Profile": "invalid"})
+        self.assertEqual(prof.get_routes(), {})
+
+        token = prof.create_token()
+        app.get_response("/", headers={"X-Webapp2-Profile": token})
+        self.assertEqual(prof.get_routes(), {"home": 1})
+
+        # Tokens from other secrets are not accepted.
+        other = profiler.Profiler(get_app(secret_key="other-secret"))
+        self.assertFalse(other.is_valid_token(token))
+
+    def test_max_routes(self):
+        app = webapp2.WSGIApplication(
+            [
+                webapp2.Route("/a", HomeHandler, name="a"),
+                webapp2.Route("/b", HomeHandler, name="b"),
+                webapp2.Route("/c", HomeHandler, name="c"),
+            ],
+            config={"webapp2_extras.profiler": {"sample_every": 1, "max_routes": 2}},
+        )
+        prof = profiler.get_profiler(app=app)
+        app.get_response("/a")
+        app.get_response("/b")
+        app.get_response("/a")
+        app.get_response("/c")
+        self.assertEqual(prof.get_routes(), {"a": 2, "c": 1})
+
+    def test_dump_stats(self):
+        app = get_app(sample_every=1)
+        prof = profiler.get_profiler(app=app)
+        app.get_response("/")
+        tmpdir = tempfile.mkdtemp()
+        try:
+            paths = prof.dump_stats(tmpdir)
+            self.assertEqual(paths, [os.path.join(tmpdir, "home.prof")])
+            stats = pstats.Stats(paths[0])
+            self.assertTrue(stats.total_calls > 0)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_handler(self):
+        app = get_app(sample_every=1)
+        prof = profiler.get_profiler(app=app)
+        app.get_response("/")
+
+        rsp = app.get_response("/_profiler")
+        self.assertEqual(rsp.status_int, 403)
+
+        headers = {"X-Webapp2-Profile": prof.create_token()}
+        rsp = app.get_response("/_profiler", headers=headers)
+        self.assertEqual(rsp.status_int, 200)
+        self.assertTrue("home\t1" in rsp.text.splitlines())
+
+        rsp = app.get_response("/_profiler?route=home", headers=headers)
+        self.assertEqual(rsp.status_int, 200)
+        self.assertTrue("busy_function" in rsp.text)
+
+        rsp = app.get_response("/_profiler?route=foo", headers=headers)
+        self.assertEqual(rsp.status_int, 404)
+
+    def test_uninstall(self):
+        app = get_app(sample_every=1)
+        prof = profiler.Profiler(app)
+        profiler.set_profiler(prof, app=app)
+        prof.uninstall()
+        self.assertEqual(app.hooks, {})
+        app.get_response("/")
+        self.assertEqual(prof.get_routes(), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
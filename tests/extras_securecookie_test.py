@@ -54,6 +54,131 @@ class TestSecureCookie(unittest.TestCase):
         rv2 = serializer2.deserialize(b"foo", result2)
         self.assertEqual(rv2, None)
 
+    def test_fast_serializer(self):
+        serializer = securecookie.FastSecureCookieSerializer(b"secret-key")
+        serializer._get_timestamp = lambda: 1
+
+        value = {"a": [1, 2], "b": "</script>"}
+        result = serializer.serialize(b"foo", value)
+        self.assertTrue(result.startswith(b"2j|"))
+        self.assertEqual(len(result.split(b"|")), 4)
+        self.assertFalse(b"=" in result)
+
+        rv = serializer.deserialize(b"foo", result)
+        self.assertEqual(rv, value)
+        rv = serializer.deserialize("foo", result.decode("ascii"))
+        self.assertEqual(rv, value)
+
+        # no value
+        self.assertEqual(serializer.deserialize(b"foo", None), None)
+        # wrong number of parts
+        self.assertEqual(serializer.deserialize(b"foo", b"a|b"), None)
+        # unknown version or codec
+        self.assertEqual(serializer.deserialize(b"foo", b"3" + result[1:]), None)
+        self.assertEqual(serializer.deserialize(b"foo", b"2x" + result[2:]), None)
+        # bad signature
+        self.assertEqual(serializer.deserialize(b"foo", result + b"foo"), None)
+        # signed for another name
+        self.assertEqual(serializer.deserialize(b"bar", result), None)
+        # signed with another key
+        other = securecookie.FastSecureCookieSerializer(b"other-key")
+        self.assertEqual(other.deserialize(b"foo", result), None)
+        # too old
+        rv = serializer.deserialize(b"foo", result, max_age=-86400)
+        self.assertEqual(rv, None)
+
+        # not correctly encoded
+        header, payload, timestamp, _ = result.split(b"|")
+        signature = serializer._sign(b"foo", header, b"Zm9v", timestamp)
+        bad = b"|".join([header, b"Zm9v", timestamp, signature])
+        self.assertEqual(serializer.deserialize(b"foo", bad), None)
+
+    def test_fast_serializer_legacy(self):
+        legacy = securecookie.SecureCookieSerializer(b"secret-key")
+        serializer = securecookie.FastSecureCookieSerializer(b"secret-key")
+        value = ["a", "b", "c"]
+
+        result = legacy.serialize(b"foo", value)
+        self.assertEqual(serializer.deserialize(b"foo", result), value)
+        rv = serializer.deserialize(b"foo", result, max_age=-86400)
+        self.assertEqual(rv, None)
+
+        serializer = securecookie.FastSecureCookieSerializer(
+            b"secret-key", legacy=False
+        )
+        self.assertEqual(serializer.deserialize(b"foo", result), None)
+
+    def test_key_ring(self):
+        old = securecookie.FastSecureCookieSerializer(
+            securecookie.KeyRing({"k1": "secret-1"})
+        )
+        ring = securecookie.KeyRing([("k1", "secret-1"), ("k2", "secret-2")], "k2")
+        serializer = securecookie.FastSecureCookieSerializer(ring)
+
+        result = serializer.serialize(b"foo", [1])
+        self.assertTrue(result.startswith(b"2j.k2|"))
+        self.assertEqual(serializer.deserialize(b"foo", result), [1])
+        self.assertFalse(serializer.needs_resign(result))
+        # Not known by the old key ring.
+        self.assertEqual(old.deserialize(b"foo", result), None)
+
+        result = old.serialize(b"foo", [2])
+        self.assertTrue(result.startswith(b"2j.k1|"))
+        self.assertEqual(serializer.deserialize(b"foo", result), [2])
+        self.assertTrue(serializer.needs_resign(result))
+
+        # The key id is signed.
+        forged = b"2j.k2" + result[5:]
+        self.assertEqual(serializer.deserialize(b"foo", forged), None)
+
+        # Legacy values are verified with each key.
+        for secret in ("secret-1", "secret-2"):
+            legacy = securecookie.SecureCookieSerializer(secret)
+            result = legacy.serialize(b"foo", [3])
+            self.assertEqual(serializer.deserialize(b"foo", result), [3])
+            self.assertTrue(serializer.needs_resign(result))
+
+        legacy = securecookie.SecureCookieSerializer("secret-3")
+        result = legacy.serialize(b"foo", [3])
+        self.assertEqual(serializer.deserialize(b"foo", result), None)
+
+        self.assertRaises(AssertionError, securecookie.KeyRing, {})
+        self.assertRaises(AssertionError, securecookie.KeyRing, {"a|b": "secret"})
+        self.assertRaises(AssertionError, securecookie.KeyRing, {"a": "b"}, "c")
+        self.assertRaises(AssertionError, securecookie.SecureCookieSerializer, ring)
+
+    def test_fast_serializer_codec(self):
+        class ReprCodec:
+            tag = b"r"
+
+            def dumps(self, value):
+                return repr(value).encode("ascii")
+
+            def loads(self, data):
+                return eval(data)
+
+        serializer = securecookie.FastSecureCookieSerializer(
+            b"secret-key", codec=ReprCodec()
+        )
+        result = serializer.serialize(b"foo", (1, 2))
+        self.assertTrue(result.startswith(b"2r|"))
+        self.assertEqual(serializer.deserialize(b"foo", result), (1, 2))
+
+        # Values encoded by the registered codecs are still read.
+        json_serializer = securecookie.FastSecureCookieSerializer(b"secret-key")
+        result = json_serializer.serialize(b"foo", [1, 2])
+        self.assertEqual(serializer.deserialize(b"foo", result), [1, 2])
+
+    @unittest.skipIf(securecookie.msgpack is None, "msgpack is not installed")
+    def test_fast_serializer_msgpack(self):
+        serializer = securecookie.FastSecureCookieSerializer(
+            b"secret-key", codec="msgpack"
+        )
+        value = {"a": [1, 2], "b": "c"}
+        result = serializer.serialize(b"foo", value)
+        self.assertTrue(result.startswith(b"2m|"))
+        self.assertEqual(serializer.deserialize(b"foo", result), value)
+
 
 if __name__ == "__main__":
     unittest.main()
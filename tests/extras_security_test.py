@@ -12,8 +12,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
 import re
 import unittest
+from unittest import mock
 
 from webapp2_extras import security
 
@@ -37,6 +39,50 @@ class TestSecurity(unittest.TestCase):
         token = security.generate_random_string(128)
         self.assertTrue(re.match(r"^\w{128}$", token) is not None)
 
+    def test_generate_random_string_pool(self):
+        token = security.generate_random_string(entropy=128)
+        self.assertEqual(len(token), 22)
+
+        token = security.generate_random_string(
+            entropy=128, pool=security.HEXADECIMAL_DIGITS
+        )
+        self.assertTrue(re.match(r"^[0-9a-f]{32}$", token) is not None)
+
+        token = security.generate_random_string(1000, pool="aab")
+        self.assertEqual(set(token), {"a", "b"})
+
+        token = security.generate_random_string(10, pool=["x", "y"])
+        self.assertTrue(re.match(r"^[xy]{10}$", token) is not None)
+
+        # Characters that can't be mapped from bytes are still supported.
+        token = security.generate_random_string(10, pool="\u03b1\u03b2")
+        self.assertTrue(re.match(r"^[\u03b1\u03b2]{10}$", token) is not None)
+
+    def test_generate_random_string_rejection(self):
+        # With 3 characters, bytes 255 are rejected so each character is
+        # reached by 85 byte values.
+        buffers = [bytes([255, 0, 255, 1, 255]) + bytes(20), bytes([2, 3, 4, 5] * 10)]
+        with mock.patch.object(security.os, "urandom", side_effect=buffers):
+            token = security.generate_random_string(6, pool="abc")
+
+        self.assertEqual(token, "ab" + "a" * 4)
+
+        with mock.patch.object(
+            security.os, "urandom", side_effect=[bytes([255] * 11), bytes([2, 3, 4])]
+        ):
+            token = security.generate_random_string(3, pool="abc")
+
+        self.assertEqual(token, "cab")
+
+    def test_generate_random_string_uniformity(self):
+        counts = collections.Counter(
+            security.generate_random_string(62000, pool=security.ALPHANUMERIC)
+        )
+        self.assertEqual(len(counts), 62)
+        # Expected 1000 each, with a standard deviation close to 31.6.
+        self.assertTrue(min(counts.values()) > 800)
+        self.assertTrue(max(counts.values()) < 1200)
+
     def test_create_check_password_hash(self):
         self.assertRaises(TypeError, security.generate_password_hash, "foo", "bar")
 
@@ -67,6 +113,74 @@ class TestSecurity(unittest.TestCase):
         self.assertTrue(hashval1 is not None)
         self.assertEqual(hashval1, hashval2)
 
+    def test_slow_password_hashes(self):
+        for method in ("pbkdf2_sha256:1000", "scrypt:1024:8:1"):
+            hashval = security.generate_password_hash("foo", method)
+            self.assertEqual(hashval.split("$")[1], method)
+            self.assertTrue(security.check_password_hash("foo", hashval))
+            self.assertFalse(security.check_password_hash("bar", hashval))
+
+            hashval = security.generate_password_hash("foo", method, pepper="p")
+            self.assertTrue(security.check_password_hash("foo", hashval, pepper="p"))
+            self.assertFalse(security.check_password_hash("foo", hashval))
+
+        # Default costs are stored in the hash.
+        with mock.patch.dict(security.PASSWORD_COSTS, {"scrypt": (2048, 4, 1)}):
+            hashval = security.generate_password_hash("foo", "scrypt")
+
+        self.assertEqual(hashval.split("$")[1], "scrypt:2048:4:1")
+        self.assertTrue(security.check_password_hash("foo", hashval))
+
+        for method in ("pbkdf2_sha256:x", "pbkdf2_sha256:0", "scrypt:1024:8"):
+            self.assertRaises(TypeError, security.generate_password_hash, "foo", method)
+            self.assertFalse(security.check_password_hash("foo", "a$%s$b" % method))
+
+    def test_password_needs_rehash(self):
+        hashval = security.generate_password_hash("foo", "pbkdf2_sha256:1000")
+        self.assertFalse(security.password_needs_rehash(hashval, "pbkdf2_sha256:1000"))
+        self.assertTrue(security.password_needs_rehash(hashval, "pbkdf2_sha256:2000"))
+        self.assertTrue(security.password_needs_rehash(hashval, "scrypt"))
+        self.assertTrue(security.password_needs_rehash("invalid", "sha1"))
+
+        hashval = security.generate_password_hash("foo", "sha1")
+        self.assertFalse(security.password_needs_rehash(hashval, "sha1"))
+
+        with mock.patch.dict(security.PASSWORD_COSTS, {"pbkdf2_sha256": (1000,)}):
+            hashval = security.generate_password_hash("foo", "pbkdf2_sha256")
+            self.assertFalse(security.password_needs_rehash(hashval, "pbkdf2_sha256"))
+
+        self.assertTrue(security.password_needs_rehash(hashval, "pbkdf2_sha256"))
+
+    def test_calibrate_password_method(self):
+        method = security.calibrate_password_method("pbkdf2_sha256", target=0.01)
+        self.assertTrue(re.match(r"^pbkdf2_sha256:\d+000$", method) is not None)
+
+        method = security.calibrate_password_method("scrypt", target=0.01)
+        self.assertTrue(re.match(r"^scrypt:\d+:8:1$", method) is not None)
+        self.assertTrue(security.generate_password_hash("foo", method))
+
+        self.assertRaises(ValueError, security.calibrate_password_method, "sha1")
+
+    def test_hashing_pool(self):
+        pool = security.HashingPool(2)
+        try:
+            hashval = pool.generate_password_hash("foo", "pbkdf2_sha256:1000")
+            self.assertTrue(pool.check_password_hash("foo", hashval))
+            self.assertFalse(pool.check_password_hash("bar", hashval, timeout=10))
+        finally:
+            pool.shutdown()
+
+    def test_compare_hashes(self):
+        self.assertTrue(security.compare_hashes("abc", "abc"))
+        self.assertFalse(security.compare_hashes("abc", "abd"))
+        self.assertFalse(security.compare_hashes("abc", "ab"))
+        self.assertFalse(security.compare_hashes("", "a"))
+        self.assertTrue(security.compare_hashes(b"abc", "abc"))
+        self.assertTrue(security.compare_hashes("\xe9", "\xe9"))
+        self.assertTrue(security.compare_hashes("\xe9", "\xe9".encode()))
+        self.assertFalse(security.compare_hashes("\xe9", "e"))
+        self.assertRaises(TypeError, security.compare_hashes, 1, "a")
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,230 @@
+# Copyright 2011 webapp2 AUTHORS.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import unittest
+from unittest import mock
+
+import webapp2
+from tests.test_base import BaseTestCase
+from webapp2_extras import sessions, sessions_memory
+
+
+def get_app(**config):
+    config.setdefault("secret_key", "my-super-secret")
+    return webapp2.WSGIApplication(config={"webapp2_extras.sessions": config})
+
+
+def get_store(app, rsp=None):
+    headers = []
+    if rsp is not None:
+        cookies = "; ".join(c.split(";")[0] for c in rsp.headers.getall("Set-Cookie"))
+        headers.append(("Cookie", cookies))
+
+    req = webapp2.Request.blank("/", headers=headers)
+    req.app = app
+    return sessions.SessionStore(req)
+
+
+class TestMemorySession(BaseTestCase):
+    def test_get_save_session(self):
+        app = get_app()
+        store = get_store(app)
+        session = store.get_session(backend="memory")
+        session["a"] = {"b": [1]}
+        session.add_flash("foo")
+        rsp = webapp2.Response()
+        store.save_sessions(rsp)
+
+        memory_store = sessions_memory.get_store(app=app)
+        self.assertTrue(sessions_memory.get_store(app=app) is memory_store)
+        self.assertEqual(len(memory_store), 1)
+
+        store = get_store(app, rsp)
+        session = store.get_session(backend="memory")
+        self.assertEqual(session["a"], {"b": [1]})
+        self.assertEqual(session.get_flashes(), [("foo", None)])
+
+        # Changes are not visible until the session is saved.
+        session["a"]["b"].append(2)
+        store2 = get_store(app, rsp)
+        self.assertEqual(store2.get_session(backend="memory")["a"], {"b": [1]})
+
+        rsp = webapp2.Response()
+        store.save_sessions(rsp)
+        store = get_store(app, rsp)
+        session = store.get_session(backend="memory")
+        self.assertEqual(session["a"], {"b": [1, 2]})
+        self.assertEqual(session.get_flashes(), [])
+
+    def test_save_unread_session(self):
+        app = get_app()
+        store = get_store(app)
+        store.get_session(backend="memory")["a"] = "b"
+        rsp = webapp2.Response()
+        store.save_sessions(rsp)
+        sid = store.sessions["session"].sid
+
+        # Saved without being read: the sid is set when it is loaded.
+        store = get_store(app, rsp)
+        store.get_session(backend="memory").modified = True
+        rsp = webapp2.Response()
+        store.save_sessions(rsp)
+        self.assertEqual(store.sessions["session"].sid, sid)
+
+        memory_store = sessions_memory.get_store(app=app)
+        self.assertEqual(len(memory_store), 1)
+        self.assertEqual(memory_store.get(sid), {"a": "b"})
+        self.assertEqual(get_store(app, rsp).get_session(backend="memory")["a"], "b")
+
+    def test_invalid_sid(self):
+        app = get_app()
+        store = get_store(app)
+        store.set_secure_cookie("session", {"_sid": "not-valid"})
+        rsp = webapp2.Response()
+        store.save_sessions(rsp)
+
+        store = get_store(app, rsp)
+        session = store.get_session(backend="memory")
+        self.assertTrue(session.new)
+        session["a"] = "b"
+        store.save_sessions(webapp2.Response())
+        self.assertNotEqual(store.sessions["session"].sid, "not-valid")
+
+    def test_expiration(self):
+        app = get_app(session_max_age=60)
+        store = get_store(app)
+        store.get_session(backend="memory")["a"] = "b"
+        rsp = webapp2.Response()
+        store.save_sessions(rsp)
+
+        memory_store = sessions_memory.get_store(app=app)
+        self.assertEqual(memory_store.purge(), 0)
+        self.assertEqual(get_store(app, rsp).get_session(backend="memory")["a"], "b")
+
+        now = time.time
+        time.time = lambda: now() + 61
+        try:
+            session = get_store(app, rsp).get_session(backend="memory")
+            self.assertTrue(session.new)
+        finally:
+            time.time = now
+
+    def test_sid_miss_cache(self):
+        app = get_app()
+        store = get_store(app)
+        sid = "a" * 22
+        store.set_secure_cookie("session", {"_sid": sid})
+        rsp = webapp2.Response()
+        store.save_sessions(rsp)
+
+        memory_store = sessions_memory.get_store(app=app)
+        with mock.patch.object(memory_store, "get", wraps=memory_store.get) as get:
+            for _ in range(3):
+                store = get_store(app, rsp)
+                self.assertTrue(store.get_session(backend="memory").new)
+
+        # Only the first request looked up the unknown session id.
+        self.assertEqual(get.call_count, 1)
+        self.assertEqual(store.sid_miss_cache.hits, 2)
+
+        # Creating the session id locally invalidates the cache.
+        store = get_store(app)
+        with mock.patch.object(
+            sessions.security, "generate_random_string", return_value=sid
+        ):
+            store.get_session(backend="memory")["a"] = "b"
+            store.save_sessions(webapp2.Response())
+
+        session = get_store(app, rsp).get_session(backend="memory")
+        self.assertFalse(session.new)
+        self.assertEqual(session["a"], "b")
+
+    def test_sid_miss_cache_disabled(self):
+        app = get_app(sid_miss_cache_size=0)
+        store = get_store(app)
+        store.set_secure_cookie("session", {"_sid": "a" * 22})
+        rsp = webapp2.Response()
+        store.save_sessions(rsp)
+
+        memory_store = sessions_memory.get_store(app=app)
+        with mock.patch.object(memory_store, "get", wraps=memory_store.get) as get:
+            for _ in range(3):
+                get_store(app, rsp).get_session(backend="memory").get("a")
+
+        self.assertEqual(get.call_count, 3)
+
+    def test_store(self):
+        app = webapp2.WSGIApplication(
+            config={"webapp2_extras.sessions_memory": {"shards": 4}}
+        )
+        store = sessions_memory.MemoryStore(app)
+        sessions_memory.set_store(store, app=app)
+        self.assertTrue(sessions_memory.get_store(app=app) is store)
+
+        store.set_multi([("k%d" % i, i, None) for i in range(20)] + [("x", 1, -1)])
+        self.assertEqual(len(store), 21)
+        self.assertEqual(store.get("k5"), 5)
+        self.assertEqual(store.get("x"), None)
+        self.assertEqual(store.get("missing"), None)
+        self.assertEqual(len(store), 20)
+
+        store.set_multi([("y", 1, -1)])
+        self.assertEqual(store.purge(), 1)
+        store.delete("k5")
+        store.delete("k5")
+        self.assertEqual(store.get("k5"), None)
+        store.clear()
+        self.assertEqual(len(store), 0)
+
+    def test_store_max_entries(self):
+        app = webapp2.WSGIApplication(
+            config={"webapp2_extras.sessions_memory": {"shards": 1, "max_entries": 3}}
+        )
+        store = sessions_memory.MemoryStore(app)
+        store.set_multi([("a", 1, None), ("b", 2, None), ("c", 3, None)])
+        # Saving a value again makes it the most recent.
+        store.set_multi([("a", 4, None), ("d", 5, None)])
+        self.assertEqual(len(store), 3)
+        self.assertEqual(store.get("b"), None)
+        self.assertEqual(store.get("a"), 4)
+
+        # Without a limit, nothing is discarded.
+        store = sessions_memory.MemoryStore(app, {"max_entries": None})
+        store.set_multi([("k%d" % i, i, None) for i in range(100)])
+        self.assertEqual(len(store), 100)
+
+    def test_store_automatic_purge(self):
+        app = webapp2.WSGIApplication(
+            config={"webapp2_extras.sessions_memory": {"purge_interval": 60}}
+        )
+        store = sessions_memory.MemoryStore(app)
+        store.set_multi([("k%d" % i, i, 10) for i in range(5)])
+
+        now = time.time
+        time.time = lambda: now() + 30
+        try:
+            # Not expired, and too soon to purge.
+            store.set_multi([("x", 1, None)])
+            self.assertEqual(len(store), 6)
+
+            time.time = lambda: now() + 61
+            store.set_multi([("y", 1, None)])
+            self.assertEqual(len(store), 2)
+        finally:
+            time.time = now
+
+
+if __name__ == "__main__":
+    unittest.main()
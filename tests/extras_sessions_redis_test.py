@@ -0,0 +1,249 @@
+# Copyright 2011 webapp2 AUTHORS.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import socketserver
+import threading
+import unittest
+
+import webapp2
+from tests.test_base import BaseTestCase
+from webapp2_extras import sessions, sessions_redis
+
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    """Serves a subset of the Redis protocol from a dictionary."""
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+
+        assert line.startswith(b"*")
+        args = []
+        for _ in range(int(line[1:])):
+            size = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(size + 2)[:-2])
+
+        return args
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+
+        while True:
+            args = self.read_command()
+            if args is None:
+                return
+
+            name = args[0].upper().decode()
+            with server.lock:
+                server.commands.append([name] + args[1:])
+                reply = getattr(self, "cmd_" + name.lower())(*args[1:])
+
+            self.wfile.write(reply)
+            if name == "QUIT":
+                return
+
+    def cmd_ping(self):
+        return b"+PONG\r\n"
+
+    def cmd_quit(self):
+        return b"+OK\r\n"
+
+    def cmd_auth(self, password):
+        if password != b"secret":
+            return b"-ERR invalid password\r\n"
+
+        return b"+OK\r\n"
+
+    def cmd_select(self, db):
+        return b"+OK\r\n"
+
+    def cmd_get(self, key):
+        value = self.server.data.get(key)
+        if value is None:
+            return b"$-1\r\n"
+
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+
+    def cmd_set(self, key, value):
+        self.server.data[key] = value
+        self.server.ttls.pop(key, None)
+        return b"+OK\r\n"
+
+    def cmd_setex(self, key, ttl, value):
+        self.server.data[key] = value
+        self.server.ttls[key] = int(ttl)
+        return b"+OK\r\n"
+
+    def cmd_del(self, *keys):
+        count = sum(self.server.data.pop(k, None) is not None for k in keys)
+        return b":%d\r\n" % count
+
+    def cmd_keys(self, pattern):
+        keys = sorted(self.server.data)
+        return b"*%d\r\n" % len(keys) + b"".join(
+            b"$%d\r\n%s\r\n" % (len(k), k) for k in keys
+        )
+
+
+class FakeRedisServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FakeRedisHandler)
+        self.lock = threading.Lock()
+        self.data = {}
+        self.ttls = {}
+        self.commands = []
+        self.connections = 0
+
+
+class TestRedisSession(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.server = FakeRedisServer()
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        super().tearDown()
+
+    def get_app(self, **config):
+        config.setdefault("secret_key", "my-super-secret")
+        redis_config = {"port": self.server.server_address[1]}
+        redis_config.update(config.pop("redis", {}))
+        return webapp2.WSGIApplication(
+            config={
+                "webapp2_extras.sessions": config,
+                "webapp2_extras.sessions_redis": redis_config,
+            }
+        )
+
+    def get_store(self, app, rsp=None):
+        headers = []
+        if rsp is not None:
+            cookies = "; ".join(
+                c.split(";")[0] for c in rsp.headers.getall("Set-Cookie")
+            )
+            headers.append(("Cookie", cookies))
+
+        req = webapp2.Request.blank("/", headers=headers)
+        req.app = app
+        return sessions.SessionStore(req)
+
+    def test_get_save_session(self):
+        app = self.get_app(session_max_age=3600)
+        store = self.get_store(app)
+        store.get_session(backend="redis")["a"] = "b"
+        store.get_session("other", backend="redis")["c"] = ["d"]
+        rsp = webapp2.Response()
+        store.save_sessions(rsp)
+
+        # Both sessions are saved in one pipeline, with a TTL.
+        self.assertEqual([c[0] for c in self.server.commands], ["SETEX", "SETEX"])
+        self.assertEqual(set(self.server.ttls.values()), {3600})
+        sid = store.sessions["session"].sid
+        key = b"webapp2_session:" + sid.encode()
+        self.assertEqual(self.server.data[key], b'{"a":"b"}')
+
+        store = self.get_store(app, rsp)
+        session = store.get_session(backend="redis")
+        self.assertEqual(session["a"], "b")
+        self.assertEqual(store.get_session("other", backend="redis")["c"], ["d"])
+        session["a"] = "e"
+        rsp = webapp2.Response()
+        store.save_sessions(rsp)
+
+        store = self.get_store(app, rsp)
+        self.assertEqual(store.get_session(backend="redis")["a"], "e")
+
+        # Connections are reused.
+        self.assertEqual(self.server.connections, 1)
+
+    def test_no_ttl(self):
+        app = self.get_app(redis={"key_prefix": "s:"})
+        store = self.get_store(app)
+        store.get_session(backend="redis")["a"] = "b"
+        store.save_sessions(webapp2.Response())
+        self.assertEqual(self.server.commands[0][0], "SET")
+        self.assertEqual(list(self.server.data)[0][:2], b"s:")
+        self.assertEqual(self.server.ttls, {})
+
+    def test_missing_session(self):
+        app = self.get_app()
+        store = self.get_store(app)
+        store.set_secure_cookie("session", {"_sid": "a" * 22})
+        rsp = webapp2.Response()
+        store.save_sessions(rsp)
+
+        session = self.get_store(app, rsp).get_session(backend="redis")
+        self.assertTrue(session.new)
+
+    def test_client(self):
+        app = self.get_app(redis={"password": "secret", "db": 1})
+        client = sessions_redis.get_client(app=app)
+        self.assertTrue(sessions_redis.get_client(app=app) is client)
+
+        self.assertEqual(client.execute("PING"), "PONG")
+        self.assertEqual(
+            self.server.commands[:2], [["AUTH", b"secret"], ["SELECT", b"1"]]
+        )
+        client.set_multi([("a", "1", None), (b"b", b"2", 10)])
+        self.assertEqual(client.get("a"), b"1")
+        self.assertEqual(client.get("missing"), None)
+        self.assertEqual(client.pipeline([("GET", "b"), ("DEL", "a", "b")]), [b"2", 2])
+        self.assertEqual(client.execute("KEYS", "*"), [])
+        self.assertEqual(client.pipeline([]), [])
+        client.close()
+
+    def test_errors(self):
+        app = self.get_app(redis={"password": "wrong"})
+        client = sessions_redis.get_client(app=app)
+        self.assertRaises(sessions_redis.RedisError, client.execute, "PING")
+
+        client = sessions_redis.RedisClient(self.get_app())
+        sessions_redis.set_client(client, app=app)
+        self.assertTrue(sessions_redis.get_client(app=app) is client)
+        self.assertRaises(
+            sessions_redis.RedisError,
+            client.pipeline,
+            [("AUTH", "wrong"), ("PING",)],
+        )
+        # The connection is still usable after an error reply.
+        self.assertEqual(client.execute("PING"), "PONG")
+        self.assertEqual(self.server.connections, 2)
+
+    def test_closed_connection(self):
+        client = sessions_redis.RedisClient(self.get_app())
+        # The server closes the pooled connection, e.g. after being idle.
+        self.assertEqual(client.execute("QUIT"), "OK")
+        self.assertEqual(client.get("a"), None)
+        self.assertEqual(self.server.connections, 2)
+        self.assertEqual(len(client._pool), 1)
+
+        # A new connection that fails is not retried.
+        client.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.assertRaises(OSError, client.get, "a")
+
+
+if __name__ == "__main__":
+    unittest.main()
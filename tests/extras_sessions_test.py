@@ -16,7 +16,7 @@ import unittest
 
 import webapp2
 from tests.test_base import BaseTestCase
-from webapp2_extras import sessions
+from webapp2_extras import securecookie, sessions
 
 app = webapp2.WSGIApplication(
     config={
@@ -27,6 +27,72 @@ app = webapp2.WSGIApplication(
 )
 
 
+class FakeMemcache:
+    """An in-memory stand-in for the App Engine memcache API."""
+
+    def __init__(self):
+        self.data = {}
+        self.calls = []
+
+    def get(self, key):
+        self.calls.append(("get", key))
+        return self.data.get(key)
+
+    def set_multi(self, mapping):
+        self.calls.append(("set_multi", sorted(mapping)))
+        self.data.update(mapping)
+        return []
+
+
+memcache = FakeMemcache()
+
+
+class FakeMemcacheSessionFactory(sessions.CustomBackendSessionFactory):
+    def _get_by_sid(self, sid):
+        if self._is_valid_sid(sid):
+            data = memcache.get(sid)
+            if data is not None:
+                self.sid = sid
+                return sessions.SessionDict(self, data=data)
+
+        self.sid = self._get_new_sid()
+        return sessions.SessionDict(self, new=True)
+
+    @classmethod
+    def set_multi(cls, items):
+        memcache.set_multi(dict(items))
+
+    def add_to_batch(self, batch):
+        if self.session is None or not self.session.modified:
+            return
+
+        batch.add(self.set_multi, (self.sid, dict(self.session)))
+        batch.set_secure_cookie(self.name, {"_sid": self.sid}, **self.session_args)
+
+
+class UnbatchedSessionFactory(sessions.BaseSessionFactory):
+    """A factory that only implements save_session()."""
+
+    get_session = sessions.SecureCookieSessionFactory.get_session
+    _load_session = sessions.SecureCookieSessionFactory._load_session
+
+    def save_session(self, response):
+        if self.session is not None and self.session.modified:
+            self.session_store.save_secure_cookie(
+                response, self.name, dict(self.session), **self.session_args
+            )
+
+
+class CountingSessionFactory(sessions.SecureCookieSessionFactory):
+    """A built-in factory that overrides save_session()."""
+
+    saved = 0
+
+    def save_session(self, response):
+        CountingSessionFactory.saved += 1
+        super().save_session(response)
+
+
 class TestSecureCookieSession(BaseTestCase):
     factory = sessions.SecureCookieSessionFactory
 
@@ -186,6 +252,411 @@ class TestSecureCookieSession(BaseTestCase):
         res = store.get_secure_cookie("foo")
         self.assertEqual(res, {"bar": "baz"})
 
+    def test_session_dict_changes(self):
+        session = sessions.SessionDict(None, data={"a": 1, "b": [1], "c": "c"})
+        self.assertFalse(session.modified)
+
+        # Same values are not changes.
+        session["a"] = 1
+        session["c"] = "c"
+        session.update(a=1)
+        self.assertEqual(session.pop("missing", None), None)
+        self.assertFalse(session.modified)
+
+        # Mutable values are always stored: they may be changed later.
+        prefs = []
+        session["b"] = prefs
+        self.assertEqual(session.changed, {"b"})
+        prefs.extend([1, 2])
+        self.assertEqual(session["b"], [1, 2])
+        self.assertTrue(session["b"] is prefs)
+
+        session["a"] = 2
+        session["a"] = True
+        del session["c"]
+        session.setdefault("d", {})["x"] = 1
+        self.assertTrue(session.modified)
+        self.assertEqual(
+            session.get_changes(),
+            ({"a": True, "b": [1, 2], "d": {"x": 1}}, {"c"}),
+        )
+
+        session["c"] = "again"
+        session.pop("a")
+        self.assertEqual(session.changed, {"b", "c", "d"})
+        self.assertEqual(session.deleted, {"a"})
+
+        session.clear()
+        self.assertEqual(session, {})
+        self.assertEqual(session.changed, set())
+        self.assertEqual(session.deleted, {"a", "b", "c", "d"})
+
+        session.modified = False
+        self.assertFalse(session.modified)
+        session.modified = True
+        self.assertTrue(session.modified)
+
+    def test_session_dict_flashes(self):
+        session = sessions.SessionDict(None, data={"a": 1})
+        self.assertEqual(session.get_flashes(), [])
+        self.assertFalse(session.modified)
+
+        session.add_flash("foo")
+        self.assertEqual(session.changed, {"_flash"})
+        session.modified = False
+        session.add_flash("bar")
+        self.assertEqual(session.changed, {"_flash"})
+        self.assertEqual(session.get_flashes(), [("foo", None), ("bar", None)])
+        self.assertEqual(session.deleted, {"_flash"})
+
+    def test_session_dict_lazy(self):
+        calls = []
+
+        def loader():
+            calls.append(1)
+            return {"a": 1}
+
+        session = sessions.SessionDict(None, loader=loader)
+        self.assertFalse(session.loaded)
+        self.assertFalse(session.modified)
+        self.assertEqual(calls, [])
+        self.assertEqual(session["a"], 1)
+        self.assertEqual(dict(session), {"a": 1})
+        self.assertEqual(len(session), 1)
+        self.assertFalse(session.new)
+        self.assertTrue(session.loaded)
+        self.assertEqual(calls, [1])
+
+        for func in (
+            lambda s: "a" in s,
+            lambda s: list(s),
+            lambda s: s.get("a"),
+            lambda s: s.items(),
+            lambda s: s == {"a": 1},
+            lambda s: repr(s),
+            lambda s: s.copy(),
+            lambda s: s.setdefault("b", 2),
+            lambda s: s.pop("a"),
+            lambda s: s.clear(),
+        ):
+            calls = []
+            session = sessions.SessionDict(None, loader=loader)
+            func(session)
+            self.assertEqual(calls, [1])
+
+        session = sessions.SessionDict(None, loader=lambda: None)
+        self.assertTrue(session.new)
+        self.assertEqual(session, {})
+
+    def test_lazy_secure_cookie_session(self):
+        req = webapp2.Request.blank("/")
+        req.app = app
+        store = sessions.SessionStore(req)
+        store.get_session().update(foo={"bar": 1}, user="me")
+        rsp = webapp2.Response()
+        store.save_sessions(rsp)
+        cookies = rsp.headers.get("Set-Cookie")
+
+        def get_store():
+            req = webapp2.Request.blank("/", headers=[("Cookie", cookies)])
+            req.app = app
+            return sessions.SessionStore(req)
+
+        # The cookie is not read if the session is not used.
+        store = get_store()
+        calls = []
+        store.get_secure_cookie = lambda *args, **kwargs: calls.append(1)
+        store.get_session()
+        store.save_sessions(webapp2.Response())
+        self.assertEqual(calls, [])
+
+        # Unchanged sessions are not saved.
+        store = get_store()
+        session = store.get_session()
+        session["user"] = "me"
+        self.assertFalse(session.new)
+        rsp = webapp2.Response()
+        store.save_sessions(rsp)
+        self.assertEqual(rsp.headers.get("Set-Cookie"), None)
+
+        store = get_store()
+        store.get_session()["foo"] = {"bar": 2}
+        rsp = webapp2.Response()
+        store.save_sessions(rsp)
+        self.assertTrue(rsp.headers.get("Set-Cookie").startswith("session="))
+
+        # A mutable value equal to the current one may be changed later.
+        store = get_store()
+        prefs = {"bar": 1}
+        store.get_session()["foo"] = prefs
+        prefs["theme"] = "dark"
+        rsp = webapp2.Response()
+        store.save_sessions(rsp)
+        cookies = rsp.headers.get("Set-Cookie")
+        self.assertEqual(get_store().get_session()["foo"], prefs)
+
+    def test_serializer_config(self):
+        app = webapp2.WSGIApplication(
+            config={
+                "webapp2_extras.sessions": {
+                    "secret_key": "my-super-secret",
+                    "serializer": "webapp2_extras.securecookie."
+                    "FastSecureCookieSerializer",
+                }
+            }
+        )
+        req = webapp2.Request.blank("/")
+        req.app = app
+        store = sessions.SessionStore(req)
+        self.assertTrue(
+            isinstance(store.serializer, securecookie.FastSecureCookieSerializer)
+        )
+        store.get_session()["foo"] = "bar"
+        rsp = webapp2.Response()
+        store.save_sessions(rsp)
+        self.assertTrue(rsp.headers["Set-Cookie"].startswith("session=2j|"))
+
+        # The serializer is shared by the app requests.
+        cookies = rsp.headers.get("Set-Cookie")
+        req = webapp2.Request.blank("/", headers=[("Cookie", cookies)])
+        req.app = app
+        store2 = sessions.SessionStore(req)
+        self.assertTrue(store2.serializer is store.serializer)
+        self.assertEqual(store2.get_session()["foo"], "bar")
+
+    def test_serializer_migration(self):
+        # Cookies saved with the default serializer are read by the fast one.
+        req = webapp2.Request.blank("/")
+        req.app = app
+        store = sessions.SessionStore(req)
+        store.get_session()["foo"] = "bar"
+        rsp = webapp2.Response()
+        store.save_sessions(rsp)
+
+        cookies = rsp.headers.get("Set-Cookie")
+        req = webapp2.Request.blank("/", headers=[("Cookie", cookies)])
+        req.app = app
+        store = sessions.SessionStore(
+            req,
+            config={
+                "secret_key": "my-super-secret",
+                "serializer": securecookie.FastSecureCookieSerializer,
+            },
+        )
+        self.assertEqual(store.get_session()["foo"], "bar")
+
+    def test_key_rotation(self):
+        def get_app(keys, current=None):
+            key_ring = securecookie.KeyRing(keys, current=current)
+            return webapp2.WSGIApplication(
+                config={
+                    "webapp2_extras.sessions": {
+                        "secret_key": key_ring,
+                        "serializer": securecookie.FastSecureCookieSerializer,
+                    }
+                }
+            )
+
+        def get_store(app, cookies=None):
+            headers = [("Cookie", cookies)] if cookies else []
+            req = webapp2.Request.blank("/", headers=headers)
+            req.app = app
+            return sessions.SessionStore(req)
+
+        old_app = get_app({"old": "old-secret"})
+        store = get_store(old_app)
+        store.get_session()["foo"] = "bar"
+        rsp = webapp2.Response()
+        store.save_sessions(rsp)
+        cookies = rsp.headers.get("Set-Cookie")
+        self.assertTrue(cookies.startswith("session=2j.old|"))
+
+        # The new key is current; the old cookie is read and re-signed
+        # on the next save, even without changes.
+        new_app = get_app({"old": "old-secret", "new": "new-secret"}, "new")
+        store = get_store(new_app, cookies)
+        self.assertEqual(store.get_session()["foo"], "bar")
+        self.assertTrue(store.needs_resign("session"))
+        rsp = webapp2.Response()
+        store.save_sessions(rsp)
+        cookies = rsp.headers.get("Set-Cookie")
+        self.assertTrue(cookies.startswith("session=2j.new|"))
+
+        # A cookie signed with the current key is not saved again.
+        store = get_store(new_app, cookies)
+        self.assertEqual(store.get_session()["foo"], "bar")
+        self.assertFalse(store.needs_resign("session"))
+        rsp = webapp2.Response()
+        store.save_sessions(rsp)
+        self.assertEqual(rsp.headers.get("Set-Cookie"), None)
+
+        # Removing the old key doesn't affect re-signed cookies, but the key
+        # id must be known.
+        store = get_store(get_app({"new": "new-secret"}), cookies)
+        self.assertEqual(store.get_session()["foo"], "bar")
+        store = get_store(get_app({"other": "new-secret"}), cookies)
+        self.assertEqual(store.get_session().new, True)
+
+    def test_resign_disabled(self):
+        req = webapp2.Request.blank("/")
+        req.app = app
+        store = sessions.SessionStore(req)
+        store.get_session()["foo"] = "bar"
+        rsp = webapp2.Response()
+        store.save_sessions(rsp)
+
+        # A cookie in the default format is re-signed by the fast serializer.
+        config = {
+            "secret_key": "my-super-secret",
+            "serializer": securecookie.FastSecureCookieSerializer,
+        }
+        cookies = rsp.headers.get("Set-Cookie")
+        req = webapp2.Request.blank("/", headers=[("Cookie", cookies)])
+        req.app = app
+        store = sessions.SessionStore(req, config=config)
+        self.assertEqual(store.get_session()["foo"], "bar")
+        rsp2 = webapp2.Response()
+        store.save_sessions(rsp2)
+        self.assertTrue(rsp2.headers["Set-Cookie"].startswith("session=2j|"))
+
+        config["resign_cookies"] = False
+        req = webapp2.Request.blank("/", headers=[("Cookie", cookies)])
+        req.app = app
+        store = sessions.SessionStore(req, config=config)
+        self.assertEqual(store.get_session()["foo"], "bar")
+        rsp2 = webapp2.Response()
+        store.save_sessions(rsp2)
+        self.assertEqual(rsp2.headers.get("Set-Cookie"), None)
+
+    def test_cookie_cache(self):
+        app = webapp2.WSGIApplication(
+            config={"webapp2_extras.sessions": {"secret_key": "my-super-secret"}}
+        )
+        req = webapp2.Request.blank("/")
+        req.app = app
+        store = sessions.SessionStore(req)
+        store.set_secure_cookie("foo", {"bar": ["baz"]})
+        rsp = webapp2.Response()
+        store.save_sessions(rsp)
+        cookies = rsp.headers.get("Set-Cookie")
+
+        def get_store():
+            req = webapp2.Request.blank("/", headers=[("Cookie", cookies)])
+            req.app = app
+            return sessions.SessionStore(req)
+
+        store = get_store()
+        calls = []
+        deserialize = store.serializer.deserialize_with_timestamp
+
+        def counting_deserialize(*args):
+            calls.append(args)
+            return deserialize(*args)
+
+        store.serializer.deserialize_with_timestamp = counting_deserialize
+        try:
+            value = store.get_secure_cookie("foo")
+            self.assertEqual(value, {"bar": ["baz"]})
+            self.assertEqual(len(calls), 1)
+
+            # Mutations don't leak into the cached value.
+            value["bar"].append("ding")
+            value["other"] = 1
+            self.assertEqual(store.get_secure_cookie("foo"), {"bar": ["baz"]})
+            self.assertEqual(get_store().get_secure_cookie("foo"), {"bar": ["baz"]})
+            self.assertEqual(len(calls), 1)
+
+            # The age is checked on cache hits.
+            self.assertEqual(store.get_secure_cookie("foo", max_age=-86400), None)
+            self.assertEqual(len(calls), 1)
+
+            # A forged value is not cached.
+            req = webapp2.Request.blank("/", headers=[("Cookie", "foo=forged")])
+            req.app = app
+            store = sessions.SessionStore(req)
+            self.assertEqual(store.get_secure_cookie("foo"), None)
+            self.assertEqual(store.get_secure_cookie("foo"), None)
+            self.assertEqual(len(calls), 3)
+        finally:
+            del store.serializer.deserialize_with_timestamp
+
+    def test_cookie_cache_disabled(self):
+        app = webapp2.WSGIApplication(
+            config={
+                "webapp2_extras.sessions": {
+                    "secret_key": "my-super-secret",
+                    "cookie_cache_size": 0,
+                }
+            }
+        )
+        req = webapp2.Request.blank("/")
+        req.app = app
+        store = sessions.SessionStore(req)
+        store.set_secure_cookie("foo", {"bar": "baz"})
+        rsp = webapp2.Response()
+        store.save_sessions(rsp)
+
+        cookies = rsp.headers.get("Set-Cookie")
+        req = webapp2.Request.blank("/", headers=[("Cookie", cookies)])
+        req.app = app
+        store = sessions.SessionStore(req)
+        self.assertEqual(store.get_secure_cookie("foo"), {"bar": "baz"})
+        self.assertEqual(len(store.cookie_cache), 0)
+
+    def test_batched_save(self):
+        memcache.calls = []
+        req = webapp2.Request.blank("/")
+        req.app = app
+        store = sessions.SessionStore(req)
+        store.get_session("mc1", factory=FakeMemcacheSessionFactory)["a"] = "b"
+        store.get_session("mc2", factory=FakeMemcacheSessionFactory)["c"] = "d"
+        store.get_session("mc3", factory=FakeMemcacheSessionFactory)
+        store.get_session("cookie")["e"] = "f"
+        store.get_session("old", factory=UnbatchedSessionFactory)["g"] = "h"
+
+        rsp = webapp2.Response()
+        store.save_sessions(rsp)
+        # Saving again doesn't repeat cookies.
+        store.save_sessions(rsp)
+
+        # A single call saves both memcache sessions.
+        sids = sorted(store.sessions[name].sid for name in ("mc1", "mc2"))
+        self.assertEqual(memcache.calls, [("set_multi", sids)] * 2)
+        headers = rsp.headers.getall("Set-Cookie")
+        self.assertEqual(
+            sorted(h.split("=")[0] for h in headers),
+            ["cookie", "mc1", "mc2", "old"],
+        )
+
+        cookies = "; ".join(h.split(";")[0] for h in headers)
+        req = webapp2.Request.blank("/", headers=[("Cookie", cookies)])
+        req.app = app
+        store = sessions.SessionStore(req)
+        session = store.get_session("mc1", factory=FakeMemcacheSessionFactory)
+        self.assertEqual(session["a"], "b")
+        session = store.get_session("mc2", factory=FakeMemcacheSessionFactory)
+        self.assertEqual(session["c"], "d")
+        self.assertEqual(store.get_session("cookie")["e"], "f")
+        session = store.get_session("old", factory=UnbatchedSessionFactory)
+        self.assertEqual(session["g"], "h")
+
+    def test_save_session_override(self):
+        req = webapp2.Request.blank("/")
+        req.app = app
+        store = sessions.SessionStore(req)
+        store.get_session("counted", factory=CountingSessionFactory)["a"] = "b"
+        CountingSessionFactory.saved = 0
+        rsp = webapp2.Response()
+        store.save_sessions(rsp)
+        self.assertEqual(CountingSessionFactory.saved, 1)
+
+        cookies = rsp.headers["Set-Cookie"].split(";")[0]
+        req = webapp2.Request.blank("/", headers=[("Cookie", cookies)])
+        req.app = app
+        store = sessions.SessionStore(req)
+        session = store.get_session("counted", factory=CountingSessionFactory)
+        self.assertEqual(session["a"], "b")
+
     def test_set_session_store(self):
         app = webapp2.WSGIApplication(
             config={
@@ -0,0 +1,124 @@
+# Copyright 2011 webapp2 AUTHORS.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import unittest
+
+import webapp2
+from tests.test_base import BaseTestCase
+from webapp2_extras import jinja2, sessions, timing
+
+current_dir = os.path.abspath(os.path.dirname(__file__))
+template_path = os.path.join(current_dir, "resources", "jinja2_templates")
+
+
+class SessionHandler(webapp2.RequestHandler):
+    def get(self):
+        store = sessions.get_store(request=self.request)
+        store.get_session()["foo"] = "bar"
+        self.response.write(
+            jinja2.get_jinja2(app=self.app).render_template(
+                "template1.html", message="Hello"
+            )
+        )
+        store.save_sessions(self.response)
+
+
+def get_app(debug=False):
+    return webapp2.WSGIApplication(
+        [
+            webapp2.Route("/", SessionHandler, name="home"),
+            webapp2.Route("/unnamed", SessionHandler),
+        ],
+        debug=debug,
+        config={
+            "webapp2_extras.sessions": {"secret_key": "my-super-secret"},
+            "webapp2_extras.jinja2": {"template_path": template_path},
+        },
+    )
+
+
+class TestTiming(BaseTestCase):
+    def test_snapshot(self):
+        app = get_app()
+        recorder = timing.get_recorder(app=app)
+        self.assertTrue(timing.get_recorder(app=app) is recorder)
+
+        for _ in range(3):
+            rsp = app.get_response("/")
+            self.assertEqual(rsp.status_int, 200)
+
+        app.get_response("/unnamed")
+        app.get_response("/not-found")
+
+        data = recorder.snapshot()
+        self.assertEqual(
+            sorted(data["home"].keys()),
+            [
+                "adapt",
+                "context",
+                "handler",
+                "match",
+                "response",
+                "sessions",
+                "template",
+            ],
+        )
+        self.assertEqual(data["home"]["handler"]["count"], 3)
+        self.assertEqual(data["home"]["adapt"]["count"], 1)
+        self.assertEqual(data["/unnamed"]["handler"]["count"], 1)
+        self.assertEqual(data["<unmatched>"]["match"]["count"], 1)
+
+        buckets = data["home"]["handler"]["buckets"]
+        self.assertEqual(buckets[-1], ["+Inf", 3])
+        self.assertEqual(len(buckets), len(recorder.buckets) + 1)
+        # Cumulative counts.
+        counts = [count for bound, count in buckets]
+        self.assertEqual(counts, sorted(counts))
+
+        # Snapshots are JSON-serializable.
+        json.dumps(data)
+
+        recorder.snapshot(reset=True)
+        self.assertEqual(recorder.snapshot(), {})
+
+    def test_server_timing(self):
+        app = get_app(debug=False)
+        timing.get_recorder(app=app)
+        rsp = app.get_response("/")
+        self.assertFalse("Server-Timing" in rsp.headers)
+
+        app = get_app(debug=True)
+        timing.get_recorder(app=app)
+        rsp = app.get_response("/")
+        header = rsp.headers["Server-Timing"]
+        names = [part.split(";")[0] for part in header.split(", ")]
+        self.assertTrue("handler" in names)
+        self.assertTrue("template" in names)
+        self.assertTrue("dur=" in header)
+
+    def test_uninstall(self):
+        app = get_app()
+        recorder = timing.TimingRecorder(app)
+        timing.set_recorder(recorder, app=app)
+        self.assertTrue(timing.get_recorder(app=app) is recorder)
+        recorder.uninstall()
+        self.assertEqual(app.hooks, {})
+        app.get_response("/")
+        self.assertEqual(recorder.snapshot(), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -13,8 +13,12 @@
 # limitations under the License.
 
 import base64
+import hashlib
+import hmac
 import unittest
+from unittest import mock
 
+import webapp2
 from webapp2_extras import xsrf
 
 
@@ -90,6 +94,198 @@ class TestXSRFToken(unittest.TestCase):
             base64.b64encode(b"NODE|NOTINT"),
         )
 
+    def test_token_format(self):
+        token = xsrf.XSRFToken("user@example.com", "secret", current_time=1354160000)
+        digest = hmac.new(
+            b"secret", b"user@example.com|action|1354160000", hashlib.sha1
+        ).hexdigest()
+        self.assertEqual(
+            token.generate_token_string("action"),
+            base64.urlsafe_b64encode(digest.encode() + b"|1354160000"),
+        )
+
+    def test_generate_token_strings(self):
+        token = xsrf.XSRFToken("user@example.com", "secret", current_time=1354160000)
+        tokens = token.generate_token_strings(["/a", "/b", None])
+        self.assertEqual(len(tokens), 3)
+        for action, token_string in tokens.items():
+            self.assertEqual(token_string, token.generate_token_string(action))
+            token.verify_token_string(token_string, action)
+
+        # Tokens of other users don't verify.
+        other = xsrf.XSRFToken("other@example.com", "secret", current_time=1354160000)
+        self.assertRaises(
+            xsrf.XSRFTokenInvalid, other.verify_token_string, tokens["/a"], "/a"
+        )
+
+    def test_verification_cache(self):
+        token = xsrf.XSRFToken("user@example.com", "secret", current_time=1354160000)
+        token_string = token.generate_token_string("action")
+        with mock.patch.object(
+            token, "_make_token_string", wraps=token._make_token_string
+        ) as make_token_string:
+            token.verify_token_string(token_string, "action")
+            token.verify_token_string(token_string.decode(), "action")
+            token.verify_token_string(
+                token_string, "action", timeout=10, current_time=1354160010
+            )
+
+        self.assertEqual(make_token_string.call_count, 1)
+
+        # Expiry and the action are still checked.
+        self.assertRaises(
+            xsrf.XSRFTokenExpiredException,
+            token.verify_token_string,
+            token_string,
+            "action",
+            timeout=10,
+            current_time=1354160011,
+        )
+        self.assertRaises(
+            xsrf.XSRFTokenInvalid, token.verify_token_string, token_string, "other"
+        )
+
+    def test_generate_token_string_memoized(self):
+        token = xsrf.XSRFToken("user@example.com", "secret")
+        with mock.patch.object(
+            token, "_make_token_string", wraps=token._make_token_string
+        ) as make_token_string:
+            a = token.generate_token_string("/a")
+            self.assertTrue(token.generate_token_string("/a") is a)
+            token.generate_token_strings(["/a", "/b"])
+
+        self.assertEqual(make_token_string.call_count, 2)
+
+
+class FormHandler(webapp2.RequestHandler):
+    built = 0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        FormHandler.built += 1
+
+    def get(self):
+        self.response.write(xsrf.generate_token("/form"))
+
+    def post(self):
+        self.response.write("saved")
+
+
+class LoginHandler(webapp2.RequestHandler):
+    def post(self):
+        self.request.logged_in_user = "me"
+        self.response.write(xsrf.generate_token("/form"))
+
+
+def get_user_id(request):
+    user_id = getattr(request, "logged_in_user", None)
+    if user_id is None:
+        user_id = request.headers.get("X-User", "")
+
+    return user_id
+
+
+class TestXSRFProtection(unittest.TestCase):
+    def get_app(self, **config):
+        config.setdefault("secret_key", "secret")
+        config.setdefault("user_id_getter", get_user_id)
+        app = webapp2.WSGIApplication(
+            [
+                ("/form", FormHandler),
+                ("/hooks/ping", FormHandler),
+                ("/login", LoginHandler),
+            ],
+            config={"webapp2_extras.xsrf": config},
+        )
+        xsrf.get_protection(app=app)
+        FormHandler.built = 0
+        return app
+
+    def test_protection(self):
+        app = self.get_app()
+        headers = [("X-User", "me")]
+        token = app.get_response("/form", headers=headers).text
+        self.assertEqual(FormHandler.built, 1)
+
+        rsp = app.get_response("/form", POST={"xsrf_token": token}, headers=headers)
+        self.assertEqual(rsp.status_int, 200)
+        self.assertEqual(rsp.text, "saved")
+
+        rsp = app.get_response(
+            "/form", method="POST", headers=headers + [("X-XSRF-Token", token)]
+        )
+        self.assertEqual(rsp.status_int, 200)
+        self.assertEqual(FormHandler.built, 3)
+
+        # Missing token, other user, and bad token: the handler isn't built.
+        rsp = app.get_response("/form", POST={"a": "b"}, headers=headers)
+        self.assertEqual(rsp.status_int, 403)
+        rsp = app.get_response("/form", POST={"xsrf_token": token})
+        self.assertEqual(rsp.status_int, 403)
+        rsp = app.get_response("/form", POST={"xsrf_token": "bad"}, headers=headers)
+        self.assertEqual(rsp.status_int, 403)
+        self.assertEqual(FormHandler.built, 3)
+
+    def test_expired_token(self):
+        app = self.get_app(timeout=10)
+        token = xsrf.XSRFToken("", "secret", current_time=1354160000)
+        rsp = app.get_response(
+            "/form", POST={"xsrf_token": token.generate_token_string()}
+        )
+        self.assertEqual(rsp.status_int, 403)
+
+    def test_check_action(self):
+        app = self.get_app(check_action=True)
+        token = app.get_response("/form").text
+        rsp = app.get_response("/form", POST={"xsrf_token": token})
+        self.assertEqual(rsp.status_int, 200)
+
+        other = xsrf.XSRFToken("", "secret").generate_token_string("/other")
+        rsp = app.get_response("/form", POST={"xsrf_token": other})
+        self.assertEqual(rsp.status_int, 403)
+
+    def test_exempt_paths(self):
+        app = self.get_app(exempt_paths=["/hooks/"])
+        self.assertEqual(app.get_response("/hooks/ping", POST={}).status_int, 200)
+        self.assertEqual(app.get_response("/form", POST={}).status_int, 403)
+
+        xsrf.get_protection(app=app).uninstall()
+        self.assertEqual(app.get_response("/form", POST={}).status_int, 200)
+
+    def test_login_then_submit(self):
+        app = self.get_app()
+        token = app.get_response("/form").text
+        # The login request is verified for the anonymous user, and renders
+        # a form for the logged in user.
+        rsp = app.get_response("/login", POST={"xsrf_token": token})
+        self.assertEqual(rsp.status_int, 200)
+
+        headers = [("X-User", "me")]
+        rsp = app.get_response("/form", POST={"xsrf_token": rsp.text}, headers=headers)
+        self.assertEqual(rsp.status_int, 200)
+        self.assertEqual(rsp.text, "saved")
+
+    def test_token_per_request(self):
+        app = self.get_app()
+        protection = xsrf.get_protection(app=app)
+        req = webapp2.Request.blank("/", headers=[("X-User", "me")])
+        req.app = app
+        token = protection.get_token(req)
+        self.assertTrue(protection.get_token(req) is token)
+        self.assertEqual(token.user_id, b"me")
+        req.logged_in_user = ""
+        self.assertEqual(protection.get_token(req).user_id, b"")
+        req.logged_in_user = None
+        self.assertTrue(protection.get_token(req) is token)
+        self.assertEqual(
+            protection.generate_token(req, "/a"),
+            token.generate_token_string().decode(),
+        )
+
+        other = xsrf.XSRFProtection(app)
+        xsrf.set_protection(other, app=app)
+        self.assertTrue(xsrf.get_protection(app=app) is other)
+
 
 if __name__ == "__main__":
     unittest.main()
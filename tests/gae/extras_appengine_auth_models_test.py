@@ -12,10 +12,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from unittest import mock
+
 from google.appengine.ext.ndb import model
 
 from tests.gae import test_base
-from webapp2_extras import auth
+from webapp2_extras import auth, security
 from webapp2_extras.appengine.auth import models
 
 
@@ -65,6 +67,101 @@ class TestAuthModels(test_base.BaseTestCase):
             auth.InvalidAuthIdError, m.get_by_auth_password, "auth_id_2", "foo"
         )
 
+    def test_get_by_auth_id_owner(self):
+        m = models.User
+        success, user = m.create_user(auth_id="auth_id_1", allocate_id=True)
+        success, user = user.add_auth_id("auth_id_2")
+        for auth_id in ("auth_id_1", "auth_id_2"):
+            unique = models.Unique.get_by_id(f"User.auth_id:{auth_id}")
+            self.assertEqual(unique.owner, user.key)
+
+        # Users are found with key gets.
+        with mock.patch.object(m, "query") as query:
+            self.assertEqual(m.get_by_auth_id("auth_id_1"), user)
+            self.assertEqual(m.get_by_auth_id("auth_id_2"), user)
+
+        self.assertEqual(query.call_count, 0)
+
+        # A stale owner doesn't return another user.
+        user.auth_ids = ["auth_id_1"]
+        user.put()
+        self.assertEqual(m.get_by_auth_id("auth_id_2"), None)
+
+    def test_create_user_without_allocate_id(self):
+        m = models.User
+        with mock.patch.object(m, "allocate_ids") as allocate_ids:
+            success, user = m.create_user(auth_id="auth_id_1")
+
+        self.assertTrue(success)
+        self.assertEqual(allocate_ids.call_count, 0)
+        unique = models.Unique.get_by_id("User.auth_id:auth_id_1")
+        self.assertEqual(unique.owner, None)
+
+        # The first lookup stores the owner.
+        self.assertEqual(m.get_by_auth_id("auth_id_1"), user)
+        unique = models.Unique.get_by_id("User.auth_id:auth_id_1")
+        self.assertEqual(unique.owner, user.key)
+
+    def test_get_by_auth_id_legacy(self):
+        m = models.User
+        user = m(auth_ids=["auth_id_1"])
+        user.put()
+        models.Unique(id="User.auth_id:auth_id_1").put()
+
+        # The query is used, and the owner is stored for the next lookups.
+        self.assertEqual(m.get_by_auth_id("auth_id_1"), user)
+        unique = models.Unique.get_by_id("User.auth_id:auth_id_1")
+        self.assertEqual(unique.owner, user.key)
+
+    def test_backfill_unique_owners(self):
+        m = models.User
+        users = [m(auth_ids=["auth_id_%d" % i]) for i in range(5)]
+        model.put_multi(users)
+        models.Unique(id="User.auth_id:auth_id_0").put()
+        success, user = m.create_user(auth_id="auth_id_new", allocate_id=True)
+
+        total = 0
+        cursor, more = None, True
+        while more:
+            updated, cursor, more = m.backfill_unique_owners(cursor, batch_size=2)
+            total += updated
+
+        self.assertEqual(total, 5)
+        for user in users + [user]:
+            unique = models.Unique.get_by_id(f"User.auth_id:{user.auth_ids[0]}")
+            self.assertEqual(unique.owner, user.key)
+
+        # Nothing left to update.
+        updated, cursor, more = m.backfill_unique_owners()
+        self.assertEqual(updated, 0)
+
+    def test_rehash_on_login(self):
+        m = models.User
+        success, user = m.create_user(auth_id="auth_id_1", password_raw="foo")
+        self.assertTrue(user.password.split("$")[1] == "sha1")
+
+        with mock.patch.object(m, "password_method", "pbkdf2_sha256:1000"):
+            self.assertRaises(
+                auth.InvalidPasswordError, m.get_by_auth_password, "auth_id_1", "bar"
+            )
+            self.assertEqual(user.key.get().password.split("$")[1], "sha1")
+
+            pool = security.HashingPool(1)
+            try:
+                u = m.get_by_auth_password("auth_id_1", "foo", hashing_pool=pool)
+            finally:
+                pool.shutdown()
+
+            password = user.key.get().password
+            self.assertEqual(password.split("$")[1], "pbkdf2_sha256:1000")
+            self.assertEqual(u.password, password)
+
+            # Not hashed again while the method doesn't change.
+            with mock.patch.object(m, "put") as put:
+                m.get_by_auth_password("auth_id_1", "foo")
+
+            self.assertEqual(put.call_count, 0)
+
     def test_create_user(self):
         m = models.User
         success, info = m.create_user(auth_id="auth_id_1", password_raw="foo")
@@ -96,6 +193,72 @@ class TestAuthModels(test_base.BaseTestCase):
         self.assertEqual(success, False)
         self.assertEqual(info, extras)
 
+    def test_create_users(self):
+        m = models.User
+        success, existing = m.create_user(auth_id="auth_id_0", email="a@example.com")
+        rows = [
+            {"auth_id": "auth_id_%d" % i, "email": "%d@example.com" % i}
+            for i in range(5)
+        ]
+        # Repeated in the batch, and an existing email.
+        rows.append({"auth_id": "auth_id_1", "email": "x@example.com"})
+        rows.append({"auth_id": "auth_id_x", "email": "a@example.com"})
+        rows.append({"auth_id": "auth_id_y", "password_raw": "foo", "email": "y"})
+
+        results = m.create_users(rows, unique_properties=["email"], batch_size=3)
+        self.assertEqual(len(results), len(rows))
+        self.assertEqual(results[0], (False, ["auth_id"]))
+        for success, user in results[1:5]:
+            self.assertTrue(success)
+            self.assertEqual(m.get_by_auth_id(user.auth_ids[0]), user)
+
+        self.assertEqual(results[5], (False, ["auth_id"]))
+        self.assertEqual(results[6], (False, ["email"]))
+        success, user = results[7]
+        self.assertTrue(success)
+        self.assertTrue(security.check_password_hash("foo", user.password))
+
+        # Only the values of failed rows were removed.
+        self.assertEqual(models.Unique.get_by_id("User.email:0@example.com"), None)
+        self.assertEqual(models.Unique.get_by_id("User.email:x@example.com"), None)
+        self.assertEqual(models.Unique.get_by_id("User.auth_id:auth_id_x"), None)
+        unique = models.Unique.get_by_id("User.auth_id:auth_id_1")
+        self.assertEqual(unique.owner, results[1][1].key)
+        self.assertEqual(m.query().count(), 6)
+
+    def test_create_users_failed_row(self):
+        m = models.User
+        m.create_user(auth_id="auth_id_0", email="taken")
+        rows = [
+            {"auth_id": "auth_id_1", "email": "taken"},
+            # The auth_id of the failed row is still free.
+            {"auth_id": "auth_id_1", "email": "free"},
+        ]
+        results = m.create_users(rows, unique_properties=["email"])
+        self.assertEqual(results[0], (False, ["email"]))
+        self.assertTrue(results[1][0])
+        self.assertEqual(m.get_by_auth_id("auth_id_1"), results[1][1])
+
+    def test_create_users_conflict(self):
+        m = models.User
+        rows = [{"auth_id": "auth_id_1", "email": "a"}]
+
+        # Another request reserves a value after the batch check.
+        create_async = models.Unique.create_async
+
+        def reserve(value, owner=None):
+            if value == "User.email:a":
+                models.Unique.create(value)
+
+            return create_async(value, owner=owner)
+
+        with mock.patch.object(models.Unique, "create_async", reserve):
+            results = m.create_users(rows, unique_properties=["email"])
+
+        self.assertEqual(results, [(False, ["email"])])
+        self.assertEqual(models.Unique.get_by_id("User.auth_id:auth_id_1"), None)
+        self.assertEqual(m.query().count(), 0)
+
     def test_add_auth_ids(self):
         m = models.User
         success, new_user = m.create_user(auth_id="auth_id_1", password_raw="foo")
@@ -152,6 +315,65 @@ class TestAuthModels(test_base.BaseTestCase):
         m.delete_signup_token(auth_id, token)
         self.assertIsNone(m.validate_signup_token(auth_id, token))
 
+    def test_token_async(self):
+        m = models.UserToken
+
+        entity, future = m.create_async("foo", "auth")
+        self.assertEqual(future.get_result(), entity.key)
+
+        other, future = m.create_async("foo", "auth")
+        future.get_result()
+
+        futures = m.get_multi_async("foo", "auth", [entity.token, "missing"])
+        self.assertEqual([f.get_result() for f in futures], [entity, None])
+
+        for f in m.delete_multi_async("foo", "auth", [entity.token]):
+            f.get_result()
+
+        self.assertIsNone(m.get(user="foo", subject="auth", token=entity.token))
+        self.assertIsNotNone(m.get(user="foo", subject="auth", token=other.token))
+
+    def test_delete_by_user(self):
+        m = models.UserToken
+
+        for _ in range(5):
+            m.create("foo", "auth")
+
+        m.create("foo", "signup")
+        m.create("foo2", "auth")
+        m.create("fo", "auth")
+
+        self.assertEqual(m.delete_by_user("foo", "auth", batch_size=2), 5)
+        self.assertEqual(m.query_keys("foo", "auth").count(), 0)
+        self.assertEqual(m.query_keys("foo").count(), 1)
+        self.assertEqual(m.query_keys("foo2").count(), 1)
+        self.assertEqual(m.query_keys("fo").count(), 1)
+
+        self.assertEqual(m.delete_by_user("foo"), 1)
+        self.assertEqual(m.query().count(), 2)
+
+    def test_renew_auth_token(self):
+        m = models.User
+        auth_id = "foo"
+
+        token = m.create_auth_token(auth_id)
+        new_token = m.renew_auth_token(auth_id, token)
+        self.assertNotEqual(new_token, token)
+        self.assertIsNone(m.validate_auth_token(auth_id, token))
+        self.assertIsNotNone(m.validate_auth_token(auth_id, new_token))
+
+    def test_delete_auth_tokens(self):
+        m = models.User
+        auth_id = "foo"
+
+        tokens = [m.create_auth_token(auth_id) for _ in range(3)]
+        signup_token = m.create_signup_token(auth_id)
+        self.assertEqual(m.delete_auth_tokens(auth_id), 3)
+        for token in tokens:
+            self.assertIsNone(m.validate_auth_token(auth_id, token))
+
+        self.assertIsNotNone(m.validate_signup_token(auth_id, signup_token))
+
 
 class TestUniqueModel(test_base.BaseTestCase):
     def setUp(self):
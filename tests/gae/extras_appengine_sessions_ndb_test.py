@@ -12,6 +12,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from unittest import mock
+
 from google.appengine.api import memcache
 
 import webapp2
@@ -173,6 +175,168 @@ class TestNdbSession(test_base.BaseTestCase):
         s = key.get()
         self.assertEqual(s.data, None)
 
+    def test_batched_save(self):
+        req = webapp2.Request.blank("/")
+        req.app = app
+        store = sessions.SessionStore(req)
+        store.get_session("db1", backend="datastore")["a"] = "b"
+        store.get_session("db2", backend="datastore")["c"] = "d"
+        store.get_session("mc1", backend="memcache")["e"] = "f"
+        store.get_session("mc2", backend="memcache")["g"] = "h"
+
+        with mock.patch.object(
+            sessions_ndb.model, "put_multi", wraps=sessions_ndb.model.put_multi
+        ) as put_multi, mock.patch.object(
+            memcache, "set_multi", wraps=memcache.set_multi
+        ) as set_multi:
+            rsp = webapp2.Response()
+            store.save_sessions(rsp)
+
+        # One call per backend and service.
+        self.assertEqual(put_multi.call_count, 1)
+        self.assertEqual(len(put_multi.call_args[0][0]), 2)
+        self.assertEqual(set_multi.call_count, 2)
+        self.assertEqual(len(rsp.headers.getall("Set-Cookie")), 4)
+
+        cookies = "; ".join(c.split(";")[0] for c in rsp.headers.getall("Set-Cookie"))
+        req = webapp2.Request.blank("/", headers=[("Cookie", cookies)])
+        req.app = app
+        store = sessions.SessionStore(req)
+        self.assertEqual(store.get_session("db1", backend="datastore")["a"], "b")
+        self.assertEqual(store.get_session("db2", backend="datastore")["c"], "d")
+        self.assertEqual(store.get_session("mc1", backend="memcache")["e"], "f")
+        self.assertEqual(store.get_session("mc2", backend="memcache")["g"], "h")
+
 
 if __name__ == "__main__":
     test_base.main()
+
+
+class TestWriteBehind(test_base.BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.register_model("Session", sessions_ndb.Session)
+        self.app = webapp2.WSGIApplication(
+            config={
+                "webapp2_extras.sessions": {"secret_key": "my-super-secret"},
+                "webapp2_extras.appengine.sessions_ndb": {
+                    "write_behind": True,
+                    "max_queue_size": 3,
+                    "max_lag": 60,
+                },
+            }
+        )
+        self.queue = sessions_ndb.get_write_behind_queue(app=self.app)
+
+    def save_session(self, cookies=None, **values):
+        headers = [("Cookie", cookies)] if cookies else []
+        req = webapp2.Request.blank("/", headers=headers)
+        req.app = self.app
+        store = sessions.SessionStore(req)
+        session = store.get_session(backend="datastore")
+        session.update(values)
+        rsp = webapp2.Response()
+        store.save_sessions(rsp)
+        return session, rsp
+
+    def test_queued_writes(self):
+        session, rsp = self.save_session(a="b")
+        sid = session.container.sid
+
+        # Memcache is updated, datastore is not.
+        self.assertEqual(memcache.get(sid), {"a": "b"})
+        self.assertEqual(sessions_ndb.model.Key(sessions_ndb.Session, sid).get(), None)
+        self.assertEqual(len(self.queue), 1)
+
+        # Queued data is read even if memcache lost it.
+        memcache.delete(sid)
+        session, rsp = self.save_session(rsp.headers.get("Set-Cookie"), c="d")
+        self.assertEqual(dict(session), {"a": "b", "c": "d"})
+        self.assertEqual(len(self.queue), 1)
+
+        self.queue.flush(wait=True)
+        self.assertEqual(len(self.queue), 0)
+        entity = sessions_ndb.model.Key(sessions_ndb.Session, sid).get()
+        self.assertEqual(entity.data, {"a": "b", "c": "d"})
+
+    def test_memcache_first(self):
+        session, rsp = self.save_session(a="b")
+        sid = session.container.sid
+
+        # Another instance saved a newer version in memcache.
+        memcache.set(sid, {"a": "newer"})
+        req = webapp2.Request.blank(
+            "/", headers=[("Cookie", rsp.headers.get("Set-Cookie"))]
+        )
+        req.app = self.app
+        store = sessions.SessionStore(req)
+        self.assertEqual(dict(store.get_session(backend="datastore")), {"a": "newer"})
+
+    def run_deferred(self, func, *args, **kwargs):
+        """Runs a deferred task right away."""
+        self.assertEqual(kwargs, {"_queue": "default"})
+        func(*args)
+
+    def test_max_queue_size(self):
+        with mock.patch.object(
+            sessions_ndb.deferred, "defer", side_effect=self.run_deferred
+        ) as defer:
+            self.save_session(a="1")
+            self.save_session(a="2")
+            self.assertEqual(defer.call_count, 0)
+            self.save_session(a="3")
+
+        self.assertEqual(defer.call_count, 1)
+        self.assertEqual(len(defer.call_args[0][1]), 3)
+        self.assertEqual(len(self.queue), 0)
+        self.assertEqual(sessions_ndb.Session.query().count(), 3)
+
+    def test_max_lag(self):
+        self.queue.config["max_lag"] = 0
+        with mock.patch.object(sessions_ndb.deferred, "defer") as defer:
+            self.save_session(a="b")
+            self.assertEqual(len(self.queue), 0)
+            self.queue.on_request_finished(None, None)
+
+        # The request hands the write to a task, and doesn't save it.
+        self.assertEqual(defer.call_count, 1)
+        self.assertEqual(sessions_ndb.Session.query().count(), 0)
+
+    def test_failed_writes_are_queued_again(self):
+        session, rsp = self.save_session(a="b")
+        with mock.patch.object(
+            sessions_ndb.deferred, "defer", side_effect=RuntimeError()
+        ):
+            self.queue.flush()
+
+        self.assertEqual(len(self.queue), 1)
+        with mock.patch.object(
+            sessions_ndb.model, "put_multi", side_effect=RuntimeError()
+        ):
+            self.queue.flush(wait=True)
+
+        self.assertEqual(len(self.queue), 1)
+        self.queue.flush(wait=True)
+        self.assertEqual(len(self.queue), 0)
+        self.assertEqual(sessions_ndb.Session.query().count(), 1)
+
+    def test_flush_at_exit(self):
+        self.save_session(a="b")
+        self.assertIn(self.queue, sessions_ndb._queues)
+        with mock.patch.object(
+            sessions_ndb.tasklets, "get_context", side_effect=RuntimeError()
+        ):
+            sessions_ndb._flush_at_exit()
+
+        self.assertEqual(len(self.queue), 1)
+        sessions_ndb._flush_at_exit()
+        self.assertEqual(len(self.queue), 0)
+        self.assertEqual(sessions_ndb.Session.query().count(), 1)
+
+    def test_disabled(self):
+        queue = sessions_ndb.get_write_behind_queue(app=app)
+        self.assertFalse(queue.config["write_behind"])
+        self.assertNotIn(
+            queue.on_request_finished, app.hooks.get("request_finished", [])
+        )
+        self.assertNotIn(queue, sessions_ndb._queues)
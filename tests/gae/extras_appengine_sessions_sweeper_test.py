@@ -0,0 +1,114 @@
+# Copyright 2011 webapp2 AUTHORS.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+import io
+from unittest import mock
+
+from google.appengine.api import memcache
+
+import webapp2
+from tests.gae import test_base
+from webapp2_extras import json
+from webapp2_extras.appengine import sessions_ndb, sessions_sweeper
+
+
+class TestSessionSweeper(test_base.BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.register_model("Session", sessions_ndb.Session)
+        for i in range(25):
+            sid = "session-%d" % i
+            sessions_ndb.Session(id=sid, data={"i": i}).put()
+            memcache.set(sid, {"i": i})
+
+        # Sessions are swept from the future, so all of them are expired.
+        self.now = datetime.datetime.utcnow() + datetime.timedelta(hours=2)
+
+    def count(self):
+        return sessions_ndb.Session.query().count()
+
+    def test_sweep(self):
+        sweeper = sessions_sweeper.SessionSweeper(3600, batch_size=10)
+        result = sweeper.sweep(now=self.now)
+        self.assertEqual(result.deleted, 25)
+        self.assertEqual(result.batches, 3)
+        self.assertEqual(result.cursor, None)
+        self.assertEqual(self.count(), 0)
+        self.assertEqual(memcache.get("session-0"), None)
+        self.assertTrue(result.throughput > 0)
+
+    def test_sweep_keeps_recent_sessions(self):
+        sweeper = sessions_sweeper.SessionSweeper(3600, batch_size=10)
+        result = sweeper.sweep()
+        self.assertEqual(result.deleted, 0)
+        self.assertEqual(self.count(), 25)
+
+    def test_restart(self):
+        sweeper = sessions_sweeper.SessionSweeper(3600, batch_size=10)
+        result = sweeper.sweep(max_batches=1, now=self.now)
+        self.assertEqual(result.deleted, 10)
+        self.assertNotEqual(result.cursor, None)
+
+        result = sweeper.sweep(cursor=result.cursor, now=self.now)
+        self.assertEqual(result.deleted, 15)
+        self.assertEqual(self.count(), 0)
+
+    def test_rate_limit(self):
+        sweeper = sessions_sweeper.SessionSweeper(3600, batch_size=10, max_rate=5)
+        with mock.patch.object(sessions_sweeper.time, "sleep") as sleep:
+            sweeper.sweep(now=self.now)
+
+        # Sleeps between batches, not after the last one.
+        self.assertEqual(sleep.call_count, 2)
+        self.assertTrue(sleep.call_args_list[0][0][0] > 1.5)
+
+    def test_from_config(self):
+        app = webapp2.WSGIApplication(
+            config={"webapp2_extras.sessions": {"session_max_age": 60}}
+        )
+        sweeper = sessions_sweeper.SessionSweeper.from_config(app)
+        self.assertEqual(sweeper.max_age, 60)
+
+        sweeper = sessions_sweeper.SessionSweeper.from_config(
+            app, {"max_age": 30, "batch_size": 5}
+        )
+        self.assertEqual((sweeper.max_age, sweeper.batch_size), (30, 5))
+
+        app = webapp2.WSGIApplication()
+        self.assertRaises(ValueError, sessions_sweeper.SessionSweeper.from_config, app)
+
+    def test_handler(self):
+        app = webapp2.WSGIApplication(
+            [("/sweep", sessions_sweeper.SessionSweeperHandler)],
+            config={"webapp2_extras.appengine.sessions_sweeper": {"max_age": 0}},
+        )
+        rsp = app.get_response("/sweep")
+        self.assertEqual(rsp.status_int, 403)
+
+        rsp = app.get_response("/sweep", headers=[("X-Appengine-Cron", "true")])
+        self.assertEqual(rsp.status_int, 200)
+        self.assertEqual(json.decode(rsp.body)["deleted"], 25)
+        self.assertEqual(self.count(), 0)
+
+    def test_main(self):
+        # With max_age 0, every session saved before the sweep is expired.
+        out = io.StringIO()
+        rv = sessions_sweeper.main(
+            ["--max-age", "0", "--batch-size", "10", "--max-batches", "2"], out=out
+        )
+        self.assertEqual(rv, 0)
+        self.assertIn("Deleted 20 sessions in 2 batches", out.getvalue())
+        self.assertIn("Continue with: --cursor ", out.getvalue())
+        self.assertEqual(self.count(), 5)
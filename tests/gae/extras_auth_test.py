@@ -168,6 +168,25 @@ class TestAuth(test_base.BaseTestCase):
             auth.InvalidAuthIdError, s.validate_password, "auth_id_2", "foo"
         )
 
+    def test_validate_password_hashing_pool(self):
+        app = webapp2.WSGIApplication(
+            config={"webapp2_extras.auth": {"password_workers": 2}}
+        )
+        s = auth.get_store(app=app)
+        self.assertEqual(s.hashing_pool.max_workers, 2)
+        self.assertTrue(auth.AuthStore(webapp2.WSGIApplication()).hashing_pool is None)
+
+        m = models.User
+        success, user = m.create_user(auth_id="auth_id", password_raw="foo")
+        try:
+            u = s.validate_password("auth_id", "foo")
+            self.assertEqual(u, s.user_to_dict(user))
+            self.assertRaises(
+                auth.InvalidPasswordError, s.validate_password, "auth_id", "bar"
+            )
+        finally:
+            s.hashing_pool.shutdown()
+
     def test_validate_token(self):
         app = webapp2.WSGIApplication()
         req = webapp2.Request.blank("/")
@@ -882,6 +882,92 @@ class TestHandler(BaseTestCase):
         self.assertEqual(rsp.unicode_body, "föö")
         self.assertEqual(rsp.body, value)
 
+    def test_hooks(self):
+        events = []
+
+        def on_started(request):
+            events.append(("request_started", request.path))
+
+        def on_phase(request, name, duration):
+            self.assertTrue(duration >= 0)
+            events.append(("phase", name))
+
+        def on_before_response(request, response):
+            response.headers["X-Hook"] = "yes"
+            events.append(("before_response", response.status_int))
+
+        def on_finished(request, response):
+            events.append(("request_finished", response.status_int))
+
+        app = webapp2.WSGIApplication([webapp2.Route("/", HomeHandler)])
+        app.add_hook("request_started", on_started)
+        app.add_hook("phase", on_phase)
+        app.add_hook("before_response", on_before_response)
+        app.add_hook("request_finished", on_finished)
+
+        rsp = app.get_response("/")
+        self.assertEqual(rsp.status_int, 200)
+        self.assertEqual(rsp.headers["X-Hook"], "yes")
+        self.assertEqual(
+            events,
+            [
+                ("phase", "context"),
+                ("request_started", "/"),
+                ("phase", "match"),
+                ("phase", "adapt"),
+                ("phase", "handler"),
+                ("before_response", 200),
+                ("phase", "response"),
+                ("request_finished", 200),
+            ],
+        )
+
+        # The handler is adapted only once.
+        del events[:]
+        app.get_response("/")
+        self.assertFalse(("phase", "adapt") in events)
+
+        # Not found requests still finish.
+        del events[:]
+        rsp = app.get_response("/not-found")
+        self.assertEqual(rsp.status_int, 404)
+        self.assertEqual(events[-1], ("request_finished", 404))
+
+        app.remove_hook("phase", on_phase)
+        self.assertFalse("phase" in app.hooks)
+        del events[:]
+        app.get_response("/")
+        self.assertFalse([e for e in events if e[0] == "phase"])
+
+    def test_hook_abort(self):
+        def on_started(request):
+            webapp2.abort(403)
+
+        app = webapp2.WSGIApplication([webapp2.Route("/", HomeHandler)])
+        app.add_hook("request_started", on_started)
+        rsp = app.get_response("/")
+        self.assertEqual(rsp.status_int, 403)
+
+    def test_time_phase(self):
+        phases = []
+        app = webapp2.WSGIApplication()
+        req = webapp2.Request.blank("/")
+        req.app = app
+
+        # Nothing is timed without hooks.
+        with app.time_phase(req, "foo"):
+            pass
+
+        app.add_hook("phase", lambda r, n, d: phases.append((r, n)))
+        with app.time_phase(req, "foo"):
+            pass
+
+        # No active request.
+        with app.time_phase(None, "bar"):
+            pass
+
+        self.assertEqual(phases, [(req, "foo")])
+
 
 if __name__ == "__main__":
     unittest.main()
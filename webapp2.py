@@ -29,6 +29,7 @@ import os
 import re
 import sys
 import threading
+import time
 import traceback
 from collections import OrderedDict
 from urllib.parse import quote, unquote, urlencode, urljoin, urlunsplit
@@ -96,6 +97,8 @@ _route_re = re.compile(
 )
 #: Regex extract charset from environ.
 _charset_re = re.compile(r";\s*charset=([^;]*)", re.I)
+#: Monotonic clock used to time request phases.
+_timer = time.perf_counter
 
 #: To show exceptions in debug mode.
 _debug_template = """<html>
@@ -1332,20 +1335,24 @@ class Router:
         :returns:
             The returned value from the handler.
         """
-        route, args, kwargs = rv = self.match(request)
+        with _time_phase(request, "match"):
+            route, args, kwargs = rv = self.match(request)
+
         request.route, request.route_args, request.route_kwargs = rv
 
         if route.handler_adapter is None:
-            handler = route.handler
-            if isinstance(handler, str):
-                if handler not in self.handlers:
-                    self.handlers[handler] = handler = import_string(handler)
-                else:
-                    handler = self.handlers[handler]
+            with _time_phase(request, "adapt"):
+                handler = route.handler
+                if isinstance(handler, str):
+                    if handler not in self.handlers:
+                        self.handlers[handler] = handler = import_string(handler)
+                    else:
+                        handler = self.handlers[handler]
 
-            route.handler_adapter = self.adapt(handler)
+                route.handler_adapter = self.adapt(handler)
 
-        return route.handler_adapter(request, response)
+        with _time_phase(request, "handler"):
+            return route.handler_adapter(request, response)
 
     def default_adapter(self, handler):
         """Adapts a handler for dispatching.
@@ -1525,6 +1532,9 @@ class WSGIApplication:
     #: A dictionary mapping HTTP error codes to callables to handle those
     #: HTTP exceptions. See :meth:`handle_exception`.
     error_handlers = None
+    #: A dictionary mapping event names to lists of callables. See
+    #: :meth:`add_hook`.
+    hooks = None
     #: Active :class:`WSGIApplication` instance. See :meth:`set_globals`.
     app = None
     #: Active :class:`Request` instance. See :meth:`set_globals`.
@@ -1546,6 +1556,7 @@ class WSGIApplication:
         self.debug = debug
         self.registry = {}
         self.error_handlers = {}
+        self.hooks = {}
         self.config = self.config_class(config)
         self.router = self.router_class(routes)
 
@@ -1581,6 +1592,92 @@ class WSGIApplication:
             WSGIApplication.app = WSGIApplication.active_instance = None
             WSGIApplication.request = None
 
+    def add_hook(self, event, func):
+        """Registers a callable to be called when an event happens.
+
+        Hooks are called in the order they were added. These events are
+        triggered while a request is processed:
+
+        - ``request_started``: called with ``(request)`` after the request and
+          response objects are built.
+        - ``phase``: called with ``(request, name, duration)`` when a phase of
+          the request finishes. The duration is measured in seconds using a
+          monotonic clock. Built-in phases are ``context`` (building the
+          request and response), ``match``, ``adapt`` (importing and adapting
+          the handler), ``handler``, ``response`` (calling the response) and,
+          when the corresponding extras are used, ``sessions`` and
+          ``template``. See :meth:`time_phase`.
+        - ``before_response``: called with ``(request, response)`` right
+          before the response is called, so it can still be modified.
+        - ``request_finished``: called with ``(request, response)`` after the
+          response was called.
+
+        An exception raised by a ``request_started`` hook is handled like an
+        exception raised by a handler, so hooks can abort requests.
+
+        :param event:
+            The event name.
+        :param func:
+            A callable that receives the event arguments.
+        """
+        # Copy on write, so other threads can iterate over the hooks safely.
+        self.hooks[event] = self.hooks.get(event, []) + [func]
+
+    def remove_hook(self, event, func):
+        """Unregisters a hook previously added with :meth:`add_hook`.
+
+        :param event:
+            The event name.
+        :param func:
+            The registered callable.
+        """
+        hooks = [f for f in self.hooks.get(event, []) if f != func]
+        if hooks:
+            self.hooks[event] = hooks
+        else:
+            self.hooks.pop(event, None)
+
+    def call_hooks(self, event, *args):
+        """Calls all hooks registered for an event.
+
+        :param event:
+            The event name.
+        :param args:
+            Arguments passed to the hooks.
+        """
+        for func in self.hooks.get(event, ()):
+            func(*args)
+
+    def time_phase(self, request, name):
+        """Returns a context manager that times a phase of a request.
+
+        When the block exits, ``phase`` hooks are called with the elapsed
+        time. If no ``phase`` hooks are registered this does nothing, so it
+        is cheap to use in hot paths::
+
+            with app.time_phase(request, 'my-phase'):
+                do_something()
+
+        :param request:
+            A :class:`Request` instance. If None, the active request is used,
+            if any.
+        :param name:
+            The phase name.
+        :returns:
+            A context manager.
+        """
+        if "phase" not in self.hooks:
+            return _null_phase_timer
+
+        if request is None:
+            if _local is not None:
+                request = getattr(_local, "request", None)
+
+            if request is None:
+                return _null_phase_timer
+
+        return _PhaseTimer(self, request, name)
+
     def __call__(self, environ, start_response):
         """Called by WSGI when a request comes in.
 
@@ -1592,8 +1689,14 @@ class WSGIApplication:
         :returns:
             An iterable with the response to return to the client.
         """
+        started = _timer()
         with self.request_context_class(self, environ) as (request, response):
+            hooks = self.hooks
             try:
+                if hooks:
+                    self.call_hooks("phase", request, "context", _timer() - started)
+                    self.call_hooks("request_started", request)
+
                 if request.method not in self.allowed_methods:
                     # 501 Not Implemented.
                     raise exc.HTTPNotImplemented()
@@ -1615,7 +1718,15 @@ class WSGIApplication:
                     response = self._internal_error(e)
 
             try:
-                return response(environ, start_response)
+                if not hooks:
+                    return response(environ, start_response)
+
+                self.call_hooks("before_response", request, response)
+                with self.time_phase(request, "response"):
+                    rv = response(environ, start_response)
+
+                self.call_hooks("request_finished", request, response)
+                return rv
             except Exception as e:
                 return self._internal_error(e)(environ, start_response)
 
@@ -1717,6 +1828,40 @@ class WSGIApplication:
         return self.request_class.blank(*args, **kwargs).get_response(self)
 
 
+class _PhaseTimer:
+    """Times a request phase. See :meth:`WSGIApplication.time_phase`."""
+
+    __slots__ = ("app", "request", "name", "started")
+
+    def __init__(self, app, request, name):
+        self.app = app
+        self.request = request
+        self.name = name
+
+    def __enter__(self):
+        self.started = _timer()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = _timer() - self.started
+        self.app.call_hooks("phase", self.request, self.name, duration)
+
+
+class _NullPhaseTimer:
+    """A phase timer that does nothing, used when no hooks are registered."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+_null_phase_timer = _NullPhaseTimer()
+
+
 _import_string_error = """\
 import_string() failed for %r. Possible reasons are:
 
@@ -2063,6 +2208,15 @@ def _parse_route_template(template, default_sufix=""):
     return regex, reverse_template, args_count, kwargs_count, variables
 
 
+def _time_phase(request, name):
+    """Times a request phase if the request is bound to an app."""
+    app = request.app
+    if app is None or not app.hooks:
+        return _null_phase_timer
+
+    return app.time_phase(request, name)
+
+
 def _get_route_variables(match, default_kwargs=None):
     """Returns (args, kwargs) for a route match."""
     kwargs = default_kwargs or {}
@@ -21,9 +21,9 @@ Auth related models.
 import time
 
 try:
-    from ndb import model
+    from ndb import model, tasklets
 except ImportError:  # pragma: no cover
-    from google.appengine.ext.ndb import model
+    from google.appengine.ext.ndb import model, tasklets
 
 from webapp2_extras import auth, security
 
@@ -73,8 +73,12 @@ class Unique(model.Model):
     Based on the idea from http://goo.gl/pBQhB
     """
 
+    #: Key of the entity that owns the value, if known. It is used to find
+    #: entities by unique value with key gets instead of queries.
+    owner = model.KeyProperty(indexed=False)
+
     @classmethod
-    def create(cls, value):
+    def create(cls, value, owner=None):
         """Creates a new unique value.
 
         :param value:
@@ -86,6 +90,8 @@ class Unique(model.Model):
             For example, for a unique property `email` from kind `User`, the
             value can be `User.email:me@myself.com`. In this case `User.email`
             is the scope, and `me@myself.com` is the value to be unique.
+        :param owner:
+            Optional key of the entity that owns the value.
         :returns:
             True if the unique value was created, False otherwise.
         """
@@ -93,15 +99,17 @@ class Unique(model.Model):
         def txn(e):
             return e.put() if not e.key.get() else None
 
-        entity = cls(key=model.Key(cls, value))
+        entity = cls(key=model.Key(cls, value), owner=owner)
         return model.transaction(lambda: txn(entity)) is not None
 
     @classmethod
-    def create_multi(cls, values):
+    def create_multi(cls, values, owner=None):
         """Creates multiple unique values at once.
 
         :param values:
             A sequence of values to be unique. See :meth:`create`.
+        :param owner:
+            Optional key of the entity that owns the values.
         :returns:
             A tuple (bool, list_of_keys). If all values were created, bool is
             True and list_of_keys is empty. If one or more values weren't
@@ -119,7 +127,7 @@ class Unique(model.Model):
             return entity.put() if not entity.key.get() else None
 
         keys = [model.Key(cls, value) for value in values]
-        entities = [cls(key=key) for key in keys]
+        entities = [cls(key=key, owner=owner) for key in keys]
         created = [model.transaction(lambda: func(e)) for e in entities]
 
         if created != keys:
@@ -129,6 +137,31 @@ class Unique(model.Model):
 
         return True, []
 
+    @classmethod
+    def create_async(cls, value, owner=None):
+        """Like :meth:`create`, but returns a future. Transactions started
+        this way run in parallel.
+
+        :param value:
+            The value to be unique. See :meth:`create`.
+        :param owner:
+            Optional key of the entity that owns the value.
+        :returns:
+            A future resolving to True if the unique value was created, False
+            otherwise.
+        """
+        entity = cls(key=model.Key(cls, value), owner=owner)
+
+        @tasklets.tasklet
+        def txn():
+            if (yield entity.key.get_async()) is not None:
+                return False
+
+            yield entity.put_async()
+            return True
+
+        return model.transaction_async(txn)
+
     @classmethod
     def delete_multi(cls, values):
         """Deletes multiple unique values at once.
@@ -138,6 +171,20 @@ class Unique(model.Model):
         """
         return model.delete_multi(model.Key(cls, v) for v in values)
 
+    @classmethod
+    def get_owner_key(cls, value):
+        """Returns the key of the entity that owns a unique value.
+
+        :param value:
+            The unique value.
+        :returns:
+            A tuple ``(unique, owner_key)``. `unique` is the :class:`Unique`
+            entity or None if the value doesn't exist, and `owner_key` is
+            None if the owner is not known.
+        """
+        unique = model.Key(cls, value).get()
+        return unique, unique.owner if unique is not None else None
+
 
 class UserToken(model.Model):
     """Stores validation tokens for users."""
@@ -191,6 +238,114 @@ class UserToken(model.Model):
         entity.put()
         return entity
 
+    @classmethod
+    def create_async(cls, user, subject, token=None):
+        """Like :meth:`create`, but doesn't wait for the token to be saved.
+
+        :param user:
+            User unique ID.
+        :param subject:
+            The subject of the key.
+        :param token:
+            Optionally an existing token may be provided.
+            If None, a random token will be generated.
+        :returns:
+            A tuple ``(UserToken, future)``. The future is the result of
+            ``put_async()`` and must be waited for.
+        """
+        user = str(user)
+        token = token or security.generate_random_string(entropy=128)
+        key = cls.get_key(user, subject, token)
+        entity = cls(key=key, user=user, subject=subject, token=token)
+        return entity, entity.put_async()
+
+    @classmethod
+    def get_multi_async(cls, user, subject, tokens):
+        """Fetches several tokens of a user in a single batch.
+
+        :param user:
+            User unique ID.
+        :param subject:
+            The subject of the keys.
+        :param tokens:
+            A list of token strings.
+        :returns:
+            A list of futures, one per token, resolving to a
+            :class:`UserToken` or None.
+        """
+        return model.get_multi_async([cls.get_key(user, subject, t) for t in tokens])
+
+    @classmethod
+    def delete_multi_async(cls, user, subject, tokens):
+        """Deletes several tokens of a user in a single batch.
+
+        :param user:
+            User unique ID.
+        :param subject:
+            The subject of the keys.
+        :param tokens:
+            A list of token strings.
+        :returns:
+            A list of futures, one per token.
+        """
+        return model.delete_multi_async([cls.get_key(user, subject, t) for t in tokens])
+
+    @classmethod
+    def query_keys(cls, user, subject=None):
+        """Returns a keys-only query for the tokens of a user.
+
+        Token keys start with the user ID, so this is a key range query and
+        doesn't need an index on the unindexed ``user`` property.
+
+        :param user:
+            User unique ID.
+        :param subject:
+            The subject of the keys, or None for all subjects.
+        :returns:
+            A ``model.Query`` instance. Iterate it with ``keys_only=True``.
+        """
+        prefix = f"{str(user)}."
+        if subject is not None:
+            prefix += f"{subject}."
+
+        # "/" is the character that follows "." in the key ordering.
+        start = model.Key(cls, prefix)
+        end = model.Key(cls, prefix[:-1] + "/")
+        return cls.query(cls._key >= start, cls._key < end)
+
+    @classmethod
+    def delete_by_user(cls, user, subject=None, batch_size=500):
+        """Deletes all tokens of a user, using a keys-only query.
+
+        :param user:
+            User unique ID.
+        :param subject:
+            The subject of the keys, or None to delete tokens of all subjects.
+        :param batch_size:
+            Number of keys fetched and deleted per batch.
+        :returns:
+            The number of deleted tokens.
+        """
+        query = cls.query_keys(user, subject)
+        futures = []
+        batch = []
+        count = 0
+        for key in query.iter(keys_only=True, batch_size=batch_size):
+            batch.append(key)
+            if len(batch) == batch_size:
+                futures.extend(model.delete_multi_async(batch))
+                count += len(batch)
+                batch = []
+
+        if batch:
+            futures.extend(model.delete_multi_async(batch))
+            count += len(batch)
+
+        for future in futures:
+            future.get_result()
+
+        return count
+
     @classmethod
     def get(cls, user=None, subject=None, token=None):
         """Fetches a user token.
@@ -232,6 +387,14 @@ class User(model.Expando):
     # doesn't use password.
     password = model.StringProperty()
 
+    #: Method used to hash passwords, as accepted by
+    #: :func:`webapp2_extras.security.generate_password_hash`, e.g.
+    #: ``'pbkdf2_sha256'``. Passwords hashed with another method or cost
+    #: are hashed again when users log in.
+    password_method = "sha1"
+    #: Length of password salts.
+    password_salt_length = 12
+
     def get_id(self):
         """Returns this user's unique ID, which can be an integer or string."""
         return self._key.id()
@@ -252,7 +415,7 @@ class User(model.Expando):
         """
         self.auth_ids.append(auth_id)
         unique = f"{self.__class__.__name__}.auth_id:{auth_id}"
-        ok = self.unique_model.create(unique)
+        ok = self.unique_model.create(unique, owner=self.key)
         if ok:
             self.put()
             return True, self
@@ -271,7 +434,63 @@ class User(model.Expando):
         :returns:
             A user object.
         """
-        return cls.query(cls.auth_ids == auth_id).get()
+        # Resolve the user through the unique value, with two key gets.
+        value = f"{cls.__name__}.auth_id:{auth_id}"
+        unique, owner = cls.unique_model.get_owner_key(value)
+        if owner is not None:
+            user = owner.get()
+            if user is not None and auth_id in user.auth_ids:
+                return user
+
+        # Legacy data: the owner was not stored with the unique value.
+        user = cls.query(cls.auth_ids == auth_id).get()
+        if user is not None and unique is not None and owner is None:
+            unique.owner = user.key
+            unique.put()
+
+        return user
+
+    @classmethod
+    def backfill_unique_owners(cls, cursor=None, batch_size=100):
+        """Stores the owner key in the :class:`Unique` auth_id values of
+        existing users, so that :meth:`get_by_auth_id` can use key gets.
+
+        Process one batch per call, e.g. from a chain of tasks::
+
+            updated, cursor, more = User.backfill_unique_owners(cursor)
+            if more:
+                deferred.defer(backfill, cursor)
+
+        :param cursor:
+            A ``Cursor`` returned by a previous call, or None to start.
+        :param batch_size:
+            Number of users processed per call.
+        :returns:
+            A tuple ``(updated, cursor, more)``, with the number of updated
+            unique values, the cursor for the next call and a boolean
+            indicating if there are more users to process.
+        """
+        users, cursor, more = cls.query().fetch_page(batch_size, start_cursor=cursor)
+        values = [
+            (user.key, f"{cls.__name__}.auth_id:{auth_id}")
+            for user in users
+            for auth_id in user.auth_ids
+        ]
+        uniques = model.get_multi([model.Key(cls.unique_model, v) for _, v in values])
+        updated = []
+        for (owner, value), unique in zip(values, uniques):
+            if unique is None:
+                unique = cls.unique_model(key=model.Key(cls.unique_model, value))
+            elif unique.owner is not None:
+                continue
+
+            unique.owner = owner
+            updated.append(unique)
+
+        if updated:
+            model.put_multi(updated)
+
+        return len(updated), cursor, more
 
     @classmethod
     def get_by_auth_token(cls, user_id, token):
@@ -296,13 +515,19 @@ class User(model.Expando):
         return None, None
 
     @classmethod
-    def get_by_auth_password(cls, auth_id, password):
+    def get_by_auth_password(cls, auth_id, password, hashing_pool=None):
         """Returns a user object, validating password.
 
+        If the password was hashed with another method or cost than
+        :attr:`password_method`, it is hashed again and the user is saved.
+
         :param auth_id:
             Authentication id.
         :param password:
             Password to be checked.
+        :param hashing_pool:
+            A :class:`webapp2_extras.security.HashingPool` used to hash the
+            password, or None to hash it in the current thread.
         :returns:
             A user object, if found and password matches.
         :raises:
@@ -312,11 +537,31 @@ class User(model.Expando):
         if not user:
             raise auth.InvalidAuthIdError()
 
-        if not security.check_password_hash(password, user.password):
+        hasher = hashing_pool or security
+        if not hasher.check_password_hash(password, user.password):
             raise auth.InvalidPasswordError()
 
+        if security.password_needs_rehash(user.password, cls.password_method):
+            user.set_password(password, hashing_pool=hashing_pool)
+            user.put()
+
         return user
 
+    def set_password(self, raw_password, hashing_pool=None):
+        """Sets the password hash, using :attr:`password_method`. The user is
+        not saved.
+
+        :param raw_password:
+            The plain password.
+        :param hashing_pool:
+            A :class:`webapp2_extras.security.HashingPool` used to hash the
+            password, or None to hash it in the current thread.
+        """
+        hasher = hashing_pool or security
+        self.password = hasher.generate_password_hash(
+            raw_password, self.password_method, self.password_salt_length
+        )
+
     @classmethod
     def validate_token(cls, user_id, subject, token):
         """Checks for existence of a token, given user_id, subject and token.
@@ -346,6 +591,25 @@ class User(model.Expando):
         """
         return cls.token_model.create(user_id, "auth").token
 
+    @classmethod
+    def renew_auth_token(cls, user_id, token):
+        """Replaces an authorization token with a new one. The old token is
+        deleted and the new one is saved in the same round trip.
+
+        :param user_id:
+            User unique ID.
+        :param token:
+            A string with the authorization token to be replaced.
+        :returns:
+            A string with the new authorization token.
+        """
+        futures = cls.token_model.delete_multi_async(user_id, "auth", [token])
+        entity, future = cls.token_model.create_async(user_id, "auth")
+        for f in futures + [future]:
+            f.get_result()
+
+        return entity.token
+
     @classmethod
     def validate_auth_token(cls, user_id, token):
         return cls.validate_token(user_id, "auth", token)
@@ -361,6 +625,18 @@ class User(model.Expando):
         """
         cls.token_model.get_key(user_id, "auth", token).delete()
 
+    @classmethod
+    def delete_auth_tokens(cls, user_id):
+        """Deletes all authorization tokens of a user, e.g. to log out all
+        sessions.
+
+        :param user_id:
+            User unique ID.
+        :returns:
+            The number of deleted tokens.
+        """
+        return cls.token_model.delete_by_user(user_id, "auth")
+
     @classmethod
     def create_signup_token(cls, user_id):
         entity = cls.token_model.create(user_id, "signup")
@@ -375,7 +651,9 @@ class User(model.Expando):
         cls.token_model.get_key(user_id, "signup", token).delete()
 
     @classmethod
-    def create_user(cls, auth_id, unique_properties=None, **user_values):
+    def create_user(
+        cls, auth_id, unique_properties=None, *, allocate_id=False, **user_values
+    ):
         """Creates a new user.
 
         :param auth_id:
@@ -390,6 +668,11 @@ class User(model.Expando):
             The value of `auth_id` must be unique.
         :param unique_properties:
             Sequence of extra property names that must be unique.
+        :param allocate_id:
+            If True and no id is passed in `user_values`, allocates the user
+            id first, to store the user key as owner of the unique values.
+            This costs an extra call. Otherwise the owner is stored by the
+            first :meth:`get_by_auth_id` call for the user.
         :param user_values:
             Keyword arguments to create a new user entity. Since the model is
             an ``Expando``, any provided custom properties will be saved.
@@ -400,6 +683,56 @@ class User(model.Expando):
             otherwise it is a list of duplicated unique properties that
             caused creation to fail.
         """
+        user, uniques = cls._build_user(auth_id, unique_properties, user_values)
+        if user.key is None and allocate_id:
+            # Allocate the key to store it as owner of the unique values.
+            start, _ = cls.allocate_ids(1)
+            user.key = model.Key(cls, start)
+
+        ok, existing = cls.unique_model.create_multi(
+            (k for k, v in uniques), owner=user.key
+        )
+        if ok:
+            user.put()
+            return True, user
+        else:
+            properties = [v for k, v in uniques if k in existing]
+            return False, properties
+
+    @classmethod
+    def create_users(cls, rows, unique_properties=None, batch_size=500):
+        """Creates many users, e.g. to import accounts.
+
+        Rows are processed in batches. For each batch, existing unique values
+        are checked with a single ``get_multi()``, the remaining ones are
+        reserved with parallel transactions and the users are saved with
+        ``put_multi()``. If a row fails, only the unique values reserved for
+        that row are deleted.
+
+        :param rows:
+            A sequence of dictionaries with the keyword arguments of
+            :meth:`create_user`, including ``auth_id``.
+        :param unique_properties:
+            Sequence of extra property names that must be unique.
+        :param batch_size:
+            Number of rows processed per batch.
+        :returns:
+            A list with a tuple (boolean, info) per row, as returned by
+            :meth:`create_user`.
+        """
+        rows = list(rows)
+        results = []
+        for i in range(0, len(rows), batch_size):
+            results.extend(
+                cls._create_users_batch(rows[i : i + batch_size], unique_properties)
+            )
+
+        return results
+
+    @classmethod
+    def _build_user(cls, auth_id, unique_properties, user_values):
+        """Returns a new user, not saved, and a list of tuples
+        ``(unique_value, property_name)``."""
         assert (
             user_values.get("password") is None
         ), "Use password_raw instead of password to create new users."
@@ -411,7 +744,9 @@ class User(model.Expando):
 
         if "password_raw" in user_values:
             user_values["password"] = security.generate_password_hash(
-                user_values.pop("password_raw"), length=12
+                user_values.pop("password_raw"),
+                cls.password_method,
+                cls.password_salt_length,
             )
 
         user_values["auth_ids"] = [auth_id]
@@ -424,10 +759,64 @@ class User(model.Expando):
                 key = f"{cls.__name__}.{name}:{user_values[name]}"
                 uniques.append((key, name))
 
-        ok, existing = cls.unique_model.create_multi(k for k, v in uniques)
-        if ok:
-            user.put()
-            return True, user
-        else:
-            properties = [v for k, v in uniques if k in existing]
-            return False, properties
+        return user, uniques
+
+    @classmethod
+    def _create_users_batch(cls, rows, unique_properties):
+        built = []
+        for row in rows:
+            user_values = dict(row)
+            auth_id = user_values.pop("auth_id")
+            built.append(cls._build_user(auth_id, unique_properties, user_values))
+
+        missing = [user for user, _ in built if user.key is None]
+        if missing:
+            start, end = cls.allocate_ids(len(missing))
+            for user, user_id in zip(missing, range(start, end + 1)):
+                user.key = model.Key(cls, user_id)
+
+        # Values that already exist, or that are repeated in the batch.
+        unique_model = cls.unique_model
+        values = [k for _, uniques in built for k, _ in uniques]
+        entities = model.get_multi([model.Key(unique_model, v) for v in values])
+        taken = {v for v, e in zip(values, entities) if e is not None}
+        failed = []
+        for _, uniques in built:
+            failed.append([name for value, name in uniques if value in taken])
+            if not failed[-1]:
+                # Only rows that pass reserve their values for later rows.
+                taken.update(value for value, _ in uniques)
+
+        # Reserve the values of valid rows in parallel.
+        futures = [
+            [
+                (value, unique_model.create_async(value, owner=user.key))
+                for value, _ in uniques
+            ]
+            if not failed[i]
+            else []
+            for i, (user, uniques) in enumerate(built)
+        ]
+
+        results = []
+        users = []
+        rollback = []
+        for i, (user, uniques) in enumerate(built):
+            created = [value for value, f in futures[i] if f.get_result()]
+            if failed[i] or len(created) < len(uniques):
+                rollback.extend(created)
+                properties = failed[i] or [
+                    name for value, name in uniques if value not in created
+                ]
+                results.append((False, properties))
+            else:
+                users.append(user)
+                results.append((True, user))
+
+        if rollback:
+            unique_model.delete_multi(rollback)
+
+        if users:
+            model.put_multi(users)
+
+        return results
@@ -52,11 +52,20 @@ class MemcacheSessionFactory(sessions.CustomBackendSessionFactory):
         self.sid = self._get_new_sid()
         return sessions.SessionDict(self, new=True)
 
-    def save_session(self, response):
+    @classmethod
+    def set_multi(cls, items):
+        """Saves sessions in a single memcache call.
+
+        :param items:
+            A list of tuples ``(sid, data)``.
+        """
+        memcache.set_multi(dict(items))
+
+    def add_to_batch(self, batch):
         if self.session is None or not self.session.modified:
             return
 
-        memcache.set(self.sid, dict(self.session))
-        self.session_store.save_secure_cookie(
-            response, self.name, {"_sid": self.sid}, **self.session_args
-        )
+        # Reading the data loads the session, which sets the sid.
+        data = dict(self.session)
+        batch.add(self.set_multi, (self.sid, data))
+        batch.set_secure_cookie(self.name, {"_sid": self.sid}, **self.session_args)
@@ -18,15 +18,23 @@ webapp2_extras.appengine.sessions_ndb
 
 Extended sessions stored in datastore using the ndb library.
 """
+import atexit
+import copy
+import logging
+import threading
+import time
+import weakref
 
 from google.appengine.api import memcache
+from google.appengine.ext import deferred
 
+import webapp2
 from webapp2_extras import sessions
 
 try:
-    from ndb import model
+    from ndb import model, tasklets
 except ImportError:  # pragma: no cover
-    from google.appengine.ext.ndb import model
+    from google.appengine.ext.ndb import model, tasklets
 
 try:
     from ndb.model import PickleProperty
@@ -53,6 +61,34 @@ except ImportError:  # pragma: no cover
                 return pickle.loads(v.stringvalue())
 
 
+#: Default configuration values for this module. Keys are:
+#:
+#: write_behind
+#:     If True, memcache is updated when sessions are saved, but datastore
+#:     writes are queued by :class:`WriteBehindQueue` and sent later in
+#:     batches. Default is False.
+#:
+#: max_queue_size
+#:     In write-behind mode, number of queued sessions that triggers a
+#:     flush. Default is 100.
+#:
+#: max_lag
+#:     In write-behind mode, time in seconds after which queued sessions are
+#:     flushed. This is a soft bound: it is checked when sessions are queued
+#:     and when requests finish, so an idle instance keeps its queue until
+#:     the next request. Default is 5.
+#:
+#: flush_queue
+#:     In write-behind mode, name of the task queue that receives the
+#:     deferred tasks saving flushed sessions. Default is ``default``.
+default_config = {
+    "write_behind": False,
+    "max_queue_size": 100,
+    "max_lag": 5,
+    "flush_queue": "default",
+}
+
+
 class Session(model.Model):
     """A model to store session data."""
 
@@ -62,15 +98,22 @@ class Session(model.Model):
     data = PickleProperty()
 
     @classmethod
-    def get_by_sid(cls, sid):
+    def get_by_sid(cls, sid, fallback=None):
         """Returns a ``Session`` instance by session id.
 
         :param sid:
             A session id.
+        :param fallback:
+            Optional callable that receives the session id and returns its
+            data or None. It is called if the session is not in memcache,
+            before looking it up in datastore.
         :returns:
             An existing ``Session`` entity.
         """
         data = memcache.get(sid)
+        if not data and fallback is not None:
+            data = fallback(sid)
+
         if not data:
             session = model.Key(cls, sid).get()
             if session:
@@ -84,6 +127,190 @@ class Session(model.Model):
         memcache.set(self._key.id(), self.data)
         super().put()
 
+    @classmethod
+    def cache_multi(cls, entities):
+        """Updates the memcache entries of sessions, using one call.
+
+        :param entities:
+            A list of ``Session`` instances.
+        """
+        memcache.set_multi({entity._key.id(): entity.data for entity in entities})
+
+    @classmethod
+    def put_multi(cls, entities):
+        """Saves sessions and updates their memcache entries, using one call
+        for each service.
+
+        :param entities:
+            A list of ``Session`` instances.
+        """
+        cls.cache_multi(entities)
+        model.put_multi(entities)
+
+
+def _put_sessions(entities):
+    """Saves sessions flushed by :class:`WriteBehindQueue`, from a deferred
+    task."""
+    model.put_multi(entities)
+
+
+class WriteBehindQueue:
+    """Queues datastore writes of sessions, to take them out of the request
+    path.
+
+    Sessions are added to memcache right away, so they are read back from
+    there. Datastore writes are kept in the queue, one per session id, until
+    it holds ``max_queue_size`` sessions or its oldest session waited
+    ``max_lag`` seconds. Then the request that reached the bound hands them
+    to a deferred task, which saves them with a single ``put_multi`` in its
+    own request. Adding the task takes one task queue call; the request
+    doesn't wait for datastore. The task is retried until the writes
+    succeed. If the task can't be added, the sessions are queued again.
+
+    Queued sessions are durable only once their task was added. Until then
+    they are kept in the instance memory and in memcache, so if the instance
+    stops abruptly, the datastore writes of up to ``max_queue_size``
+    sessions are lost. Bounds are checked only when sessions are queued and
+    when requests finish, so on an idle instance sessions can wait longer
+    than ``max_lag``. Call ``flush(wait=True)`` from the shutdown handler
+    (``/_ah/stop``) to save them. The queues are also flushed when the
+    process exits, but App Engine doesn't always let that happen.
+
+    Deferred tasks require the ``deferred`` builtin handler to be enabled.
+    """
+
+    #: Configuration key.
+    config_key = __name__
+
+    #: Loaded configuration.
+    config = None
+
+    def __init__(self, app, config=None):
+        """Initializes the queue and registers its hooks when write-behind
+        mode is enabled.
+
+        :param app:
+            A :class:`webapp2.WSGIApplication` instance.
+        :param config:
+            A dictionary of configuration values to be overridden. See
+            the available keys in :data:`default_config`.
+        """
+        self.config = app.config.load_config(
+            self.config_key,
+            default_values=default_config,
+            user_values=config,
+            required_keys=None,
+        )
+        self._pending = {}
+        self._queued_at = None
+        self._lock = threading.Lock()
+        if self.config["write_behind"]:
+            app.add_hook("request_finished", self.on_request_finished)
+            _queues.add(self)
+
+    def get(self, sid):
+        """Returns the data of a queued session, or None."""
+        entity = self._pending.get(sid)
+        if entity is None:
+            return None
+
+        # Don't let the session change the data waiting to be saved.
+        return copy.deepcopy(entity.data)
+
+    def add(self, entities):
+        """Updates memcache entries and queues the datastore writes of
+        sessions.
+
+        :param entities:
+            A list of ``Session`` instances.
+        """
+        type(entities[0]).cache_multi(entities)
+        with self._lock:
+            self._pending.update((e._key.id(), e) for e in entities)
+            if self._queued_at is None:
+                self._queued_at = time.time()
+
+        if self.should_flush():
+            self.flush()
+
+    def should_flush(self):
+        """Returns True if the queue reached one of its bounds."""
+        queued_at = self._queued_at
+        if queued_at is None:
+            return False
+
+        return (
+            len(self._pending) >= self.config["max_queue_size"]
+            or time.time() - queued_at >= self.config["max_lag"]
+        )
+
+    def flush(self, wait=False):
+        """Saves all queued sessions. Sessions that failed to be saved are
+        queued again, unless they were updated since.
+
+        :param wait:
+            If True, saves the sessions in the current request. Otherwise
+            they are saved by a deferred task.
+        """
+        with self._lock:
+            entities = list(self._pending.values())
+            self._pending = {}
+            self._queued_at = None
+
+        if not entities:
+            return
+
+        try:
+            if wait:
+                model.put_multi(entities)
+            else:
+                deferred.defer(
+                    _put_sessions, entities, _queue=self.config["flush_queue"]
+                )
+        except Exception:
+            logging.exception("Failed to save %d sessions", len(entities))
+            with self._lock:
+                for entity in entities:
+                    self._pending.setdefault(entity._key.id(), entity)
+
+                if self._queued_at is None:
+                    self._queued_at = time.time()
+
+    def on_request_finished(self, request, response):
+        """Flushes the queue if a bound was reached."""
+        if self.should_flush():
+            self.flush()
+
+    def __len__(self):
+        return len(self._pending)
+
+
+#: Write-behind queues flushed when the process exits.
+_queues = weakref.WeakSet()
+
+
+def _flush_at_exit():
+    """Saves the sessions of all write-behind queues when the process exits.
+    Errors are logged, as datastore may not be usable anymore."""
+    queues = [queue for queue in list(_queues) if len(queue)]
+    if not queues:
+        return
+
+    try:
+        tasklets.get_context()
+    except Exception:
+        logging.exception("Can't save queued sessions at exit: no ndb context")
+        return
+
+    for queue in queues:
+        try:
+            queue.flush(wait=True)
+        except Exception:
+            logging.exception("Failed to save queued sessions at exit")
+
+
+atexit.register(_flush_at_exit)
+
 
 class DatastoreSessionFactory(sessions.CustomBackendSessionFactory):
     """A session factory that stores data serialized in datastore.
@@ -100,15 +327,37 @@ class DatastoreSessionFactory(sessions.CustomBackendSessionFactory):
 
     See in :meth:`webapp2_extras.sessions.SessionStore` an example of how to
     make sessions available in a :class:`webapp2.RequestHandler`.
+
+    Set ``write_behind`` in the configuration of this module to save
+    sessions through the app :class:`WriteBehindQueue`::
+
+        config['webapp2_extras.appengine.sessions_ndb'] = {
+            'write_behind': True,
+            'max_lag': 10,
+        }
     """
 
     #: The session model class.
     session_model = Session
 
+    @webapp2.cached_property
+    def write_behind_queue(self):
+        """The app :class:`WriteBehindQueue`, or None if write-behind mode is
+        disabled."""
+        queue = get_write_behind_queue(app=self.session_store.request.app)
+        return queue if queue.config["write_behind"] else None
+
     def _get_by_sid(self, sid):
         """Returns a session given a session id."""
         if self._is_valid_sid(sid):
-            data = self.session_model.get_by_sid(sid)
+            # Memcache has the most recent data, also from other instances.
+            # The local queue is used if memcache evicted the session, before
+            # datastore, which may not have the queued data yet.
+            queue = self.write_behind_queue
+            data = self.session_model.get_by_sid(
+                sid, fallback=queue.get if queue is not None else None
+            )
+
             if data is not None:
                 self.sid = sid
                 return sessions.SessionDict(self, data=data)
@@ -116,11 +365,64 @@ class DatastoreSessionFactory(sessions.CustomBackendSessionFactory):
         self.sid = self._get_new_sid()
         return sessions.SessionDict(self, new=True)
 
-    def save_session(self, response):
+    def add_to_batch(self, batch):
         if self.session is None or not self.session.modified:
             return
 
-        self.session_model(id=self.sid, data=dict(self.session))._put()
-        self.session_store.save_secure_cookie(
-            response, self.name, {"_sid": self.sid}, **self.session_args
-        )
+        # Reading the data loads the session, which sets the sid.
+        data = dict(self.session)
+        if self.write_behind_queue is not None:
+            writer = self.write_behind_queue.add
+        else:
+            writer = self.session_model.put_multi
+
+        batch.add(writer, self.session_model(id=self.sid, data=data))
+        batch.set_secure_cookie(self.name, {"_sid": self.sid}, **self.session_args)
+
+
+# Factories -------------------------------------------------------------------
+
+
+#: Key used to store :class:`WriteBehindQueue` in the app registry.
+_registry_key = "webapp2_extras.appengine.sessions_ndb.WriteBehindQueue"
+
+
+def get_write_behind_queue(factory=WriteBehindQueue, key=_registry_key, app=None):
+    """Returns an instance of :class:`WriteBehindQueue` from the app registry.
+
+    It'll try to get it from the current app registry, and if it is not
+    registered it'll be instantiated and registered. A second call to this
+    function will return the same instance.
+
+    :param factory:
+        The callable used to build and register the instance if it is not yet
+        registered. The default is the class :class:`WriteBehindQueue` itself.
+    :param key:
+        The key used to store the instance in the registry. A default is used
+        if it is not set.
+    :param app:
+        A :class:`webapp2.WSGIApplication` instance used to store the instance.
+        The active app is used if it is not set.
+    """
+    app = app or webapp2.get_app()
+    queue = app.registry.get(key)
+    if queue is None:
+        queue = app.registry[key] = factory(app)
+
+    return queue
+
+
+def set_write_behind_queue(queue, key=_registry_key, app=None):
+    """Sets an instance of :class:`WriteBehindQueue` in the app registry.
+
+    :param queue:
+        An instance of :class:`WriteBehindQueue`.
+    :param key:
+        The key used to retrieve the instance from the registry. A default
+        is used if it is not set.
+    :param app:
+        A :class:`webapp2.WSGIApplication` instance used to retrieve the
+        instance. The active app is used if it is not set.
+    """
+    app = app or webapp2.get_app()
+    app.registry[key] = queue
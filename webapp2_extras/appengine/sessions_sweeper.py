@@ -0,0 +1,305 @@
+# Copyright 2011 webapp2 AUTHORS.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+webapp2_extras.appengine.sessions_sweeper
+=========================================
+
+Deletes expired datastore sessions.
+
+The sweeper can run from a cron handler, or from the command line using
+the remote API::
+
+    python -m webapp2_extras.appengine.sessions_sweeper \\
+        --remote-api myapp.appspot.com --max-age 1209600
+"""
+import argparse
+import datetime
+import sys
+import time
+
+from google.appengine.api import memcache, users
+from google.appengine.datastore.datastore_query import Cursor
+
+import webapp2
+from webapp2_extras import json, sessions
+from webapp2_extras.appengine import sessions_ndb
+
+#: Default configuration values for this module. Keys are:
+#:
+#: max_age
+#:     Sessions not updated for this number of seconds are deleted. If it is
+#:     None, ``session_max_age`` from :mod:`webapp2_extras.sessions` is used.
+#:
+#: batch_size
+#:     Number of sessions fetched and deleted in each batch. Default is 500.
+#:
+#: max_rate
+#:     Maximum number of deleted sessions per second, or None to not limit
+#:     the rate. Default is None.
+#:
+#: deadline
+#:     Maximum time in seconds spent by :class:`SessionSweeperHandler` in a
+#:     request. The handler returns a cursor to continue from when it stops.
+#:     Default is 540.
+default_config = {
+    "max_age": None,
+    "batch_size": 500,
+    "max_rate": None,
+    "deadline": 540,
+}
+
+
+class SweepResult:
+    """Progress of a :meth:`SessionSweeper.sweep` call."""
+
+    def __init__(self):
+        #: Number of deleted sessions.
+        self.deleted = 0
+        #: Number of batches.
+        self.batches = 0
+        #: Duration of the sweep, in seconds.
+        self.elapsed = 0.0
+        #: A web-safe cursor to continue the sweep from, or None if it is
+        #: complete.
+        self.cursor = None
+
+    @property
+    def throughput(self):
+        """Deleted sessions per second."""
+        return self.deleted / self.elapsed if self.elapsed else 0.0
+
+    def to_dict(self):
+        return {
+            "deleted": self.deleted,
+            "batches": self.batches,
+            "elapsed": self.elapsed,
+            "throughput": self.throughput,
+            "cursor": self.cursor,
+        }
+
+
+class SessionSweeper:
+    """Deletes sessions that were not updated for a while.
+
+    Sessions are queried by their ``updated`` property, oldest first, one
+    batch at a time. Each batch is removed from datastore and memcache with
+    one call to each service. A sweep can be stopped after a number of
+    batches or some time, and continued later from the returned cursor.
+    Starting over is also safe, as deleted sessions are not found again.
+    """
+
+    def __init__(self, max_age, batch_size=500, max_rate=None, session_model=None):
+        """Initializes the sweeper.
+
+        :param max_age:
+            Sessions not updated for this number of seconds are deleted.
+        :param batch_size:
+            Number of sessions deleted in each batch.
+        :param max_rate:
+            Maximum number of deleted sessions per second, or None.
+        :param session_model:
+            The session model class. Default is
+            :class:`webapp2_extras.appengine.sessions_ndb.Session`.
+        """
+        self.max_age = max_age
+        self.batch_size = batch_size
+        self.max_rate = max_rate
+        self.session_model = session_model or sessions_ndb.Session
+
+    @classmethod
+    def from_config(cls, app, config=None):
+        """Returns a sweeper configured for an app.
+
+        :param app:
+            A :class:`webapp2.WSGIApplication` instance.
+        :param config:
+            A dictionary of configuration values to be overridden. See
+            the available keys in :data:`default_config`.
+        """
+        config = app.config.load_config(
+            __name__, default_values=default_config, user_values=config
+        )
+        max_age = config["max_age"]
+        if max_age is None:
+            max_age = app.config.load_config(
+                sessions.SessionStore.config_key,
+                default_values=sessions.default_config,
+            )["session_max_age"]
+
+        if max_age is None:
+            raise ValueError(
+                "Set max_age in the %s config, or session_max_age in the "
+                "%s config, to sweep sessions."
+                % (__name__, sessions.SessionStore.config_key)
+            )
+
+        return cls(
+            max_age, batch_size=config["batch_size"], max_rate=config["max_rate"]
+        )
+
+    def get_query(self, now=None):
+        """Returns a query for expired sessions, oldest first.
+
+        :param now:
+            Current UTC time, as a naive datetime.
+        """
+        now = now or datetime.datetime.utcnow()
+        updated = self.session_model.updated
+        cutoff = now - datetime.timedelta(seconds=self.max_age)
+        return self.session_model.query(updated < cutoff).order(updated)
+
+    def delete_batch(self, keys):
+        """Deletes sessions from datastore and memcache.
+
+        :param keys:
+            A list of session keys.
+        """
+        sessions_ndb.model.delete_multi(keys)
+        memcache.delete_multi([key.id() for key in keys])
+
+    def sweep(self, cursor=None, max_batches=None, deadline=None, now=None):
+        """Deletes expired sessions.
+
+        :param cursor:
+            A web-safe cursor returned by a previous sweep, to continue it.
+        :param max_batches:
+            Maximum number of batches to delete, or None.
+        :param deadline:
+            Maximum duration of the sweep in seconds, or None. The current
+            batch is always completed.
+        :param now:
+            Current UTC time, as a naive datetime. Used to compute the
+            expiration cutoff.
+        :returns:
+            A :class:`SweepResult` instance.
+        """
+        result = SweepResult()
+        query = self.get_query(now)
+        start_cursor = Cursor(urlsafe=cursor) if cursor else None
+        started = webapp2._timer()
+        while True:
+            keys, start_cursor, more = query.fetch_page(
+                self.batch_size, start_cursor=start_cursor, keys_only=True
+            )
+            if keys:
+                self.delete_batch(keys)
+                result.deleted += len(keys)
+
+            result.batches += 1
+            result.elapsed = webapp2._timer() - started
+            if not more or not keys:
+                result.cursor = None
+                break
+
+            result.cursor = start_cursor.urlsafe()
+            if isinstance(result.cursor, bytes):
+                result.cursor = result.cursor.decode("ascii")
+
+            if max_batches is not None and result.batches >= max_batches:
+                break
+
+            if deadline is not None and result.elapsed >= deadline:
+                break
+
+            if self.max_rate:
+                delay = result.deleted / float(self.max_rate) - result.elapsed
+                if delay > 0:
+                    time.sleep(delay)
+
+        result.elapsed = webapp2._timer() - started
+        return result
+
+
+class SessionSweeperHandler(webapp2.RequestHandler):
+    """Runs a sweep and returns the :class:`SweepResult` as JSON. Add it to
+    the app routes, and call it from cron::
+
+        webapp2.Route('/tasks/sweep-sessions', sessions_sweeper.SessionSweeperHandler)
+
+    The sweep stops after the configured ``deadline``. A ``cursor`` query
+    argument continues a previous sweep.
+
+    Access is only allowed to cron and task queue requests, and to app
+    admins. To use another authorization method, override :meth:`is_admin`.
+    """
+
+    def is_admin(self):
+        """Checks if the current request can run the sweeper."""
+        headers = self.request.headers
+        if headers.get("X-Appengine-Cron") == "true":
+            return True
+
+        if headers.get("X-Appengine-TaskName"):
+            return True
+
+        return users.is_current_user_admin()
+
+    def get(self):
+        if not self.is_admin():
+            self.abort(403)
+
+        sweeper = SessionSweeper.from_config(self.app)
+        config = self.app.config.load_config(__name__, default_values=default_config)
+        result = sweeper.sweep(
+            cursor=self.request.get("cursor") or None, deadline=config["deadline"]
+        )
+        self.response.content_type = "application/json"
+        self.response.write(json.encode(result.to_dict()))
+
+
+def main(argv=None, out=sys.stdout):
+    """Runs a sweep from the command line, and reports its throughput.
+
+    Without ``--remote-api`` the datastore and memcache stubs already set up
+    in the process are used, e.g. the testbed stubs.
+    """
+    parser = argparse.ArgumentParser(
+        prog="python -m webapp2_extras.appengine.sessions_sweeper",
+        description="Deletes expired datastore sessions.",
+    )
+    parser.add_argument(
+        "--max-age",
+        type=int,
+        required=True,
+        help="delete sessions not updated for this number of seconds",
+    )
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--max-rate", type=float, help="deleted sessions per second")
+    parser.add_argument("--max-batches", type=int, help="stop after these batches")
+    parser.add_argument("--cursor", help="continue a previous sweep")
+    parser.add_argument("--remote-api", metavar="HOST", help="app host to connect to")
+    args = parser.parse_args(argv)
+
+    if args.remote_api:
+        from google.appengine.ext.remote_api import remote_api_stub
+
+        remote_api_stub.ConfigureRemoteApiForOAuth(args.remote_api, "/_ah/remote_api")
+
+    sweeper = SessionSweeper(
+        args.max_age, batch_size=args.batch_size, max_rate=args.max_rate
+    )
+    result = sweeper.sweep(cursor=args.cursor, max_batches=args.max_batches)
+    out.write(
+        "Deleted %d sessions in %d batches in %.1fs (%.1f sessions/s).\n"
+        % (result.deleted, result.batches, result.elapsed, result.throughput)
+    )
+    if result.cursor:
+        out.write("Continue with: --cursor %s\n" % result.cursor)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -22,7 +22,7 @@ import logging
 import time
 
 import webapp2
-from webapp2_extras import sessions
+from webapp2_extras import cache, security, sessions
 
 #: Default configuration values for this module. Keys are:
 #:
@@ -57,6 +57,30 @@ from webapp2_extras import sessions
 #:     A list of extra user attributes to be stored in the session.
 #      The user object must provide all of them as attributes.
 #:     Default is an empty list.
+#:
+#: password_workers
+#:     Number of threads used to check passwords, shared by all requests of
+#:     the app. Slow hash methods then can't use more CPUs than this, even
+#:     when many users log in at once. If 0, passwords are checked in the
+#:     request thread. Default is 0.
+#:
+#: user_cache_size
+#:     Maximum number of users validated by token kept in memory, shared by
+#:     all requests of the app. Set to 0 to disable the local cache.
+#:     Default is 1000.
+#:
+#: user_cache_client
+#:     A memcache-style client shared by app instances, or its import path,
+#:     e.g. ``google.appengine.api.memcache``. It must provide ``get(key)``,
+#:     ``set(key, value, time=0)`` and ``delete(key)``. Keys include a
+#:     generation of each user, which is changed to invalidate all the
+#:     user's tokens at once. Default is None.
+#:
+#: user_cache_ttl
+#:     Number of seconds users validated by token are cached. If None,
+#:     ``token_cache_age`` is used. Cached users are removed when their
+#:     token is deleted or their password changes through
+#:     :meth:`AuthStore.set_password`. Default is None.
 default_config = {
     "user_model": "webapp2_extras.appengine.auth.models.User",
     "session_backend": "securecookie",
@@ -65,6 +89,10 @@ default_config = {
     "token_new_age": 86400,
     "token_cache_age": 3600,
     "user_attributes": [],
+    "password_workers": 0,
+    "user_cache_size": 1000,
+    "user_cache_client": None,
+    "user_cache_ttl": None,
 }
 
 #: Internal flag for anonymous users.
@@ -140,6 +168,13 @@ class AuthStore:
 
         return cls
 
+    @webapp2.cached_property
+    def hashing_pool(self):
+        """A :class:`webapp2_extras.security.HashingPool` to check passwords,
+        or None if ``password_workers`` is 0."""
+        workers = self.config["password_workers"]
+        return security.HashingPool(workers) if workers else None
+
     def get_user_by_auth_password(self, auth_id, password, silent=False):
         """Returns a user dict based on auth_id and password.
 
@@ -154,8 +189,12 @@ class AuthStore:
         :raises:
             ``InvalidAuthIdError`` or ``InvalidPasswordError``.
         """
+        kwargs = {}
+        if self.hashing_pool is not None:
+            kwargs["hashing_pool"] = self.hashing_pool
+
         try:
-            user = self.user_model.get_by_auth_password(auth_id, password)
+            user = self.user_model.get_by_auth_password(auth_id, password, **kwargs)
             return self.user_to_dict(user)
         except (InvalidAuthIdError, InvalidPasswordError):
             if not silent:
@@ -175,8 +214,24 @@ class AuthStore:
             The token timestamp will be None if the user is invalid or it
             is valid but the token requires renewal.
         """
-        user, ts = self.user_model.get_by_auth_token(user_id, token)
-        return self.user_to_dict(user), ts
+        key = (user_id, token)
+        rv = self.user_cache.get(key)
+        client_key = None
+        if rv is None and self.user_cache_client is not None:
+            client_key = self._get_user_cache_key(user_id, token)
+            rv = self.user_cache_client.get(client_key)
+            if rv is not None:
+                self.user_cache.set(key, rv)
+
+        if rv is None:
+            user, ts = self.user_model.get_by_auth_token(user_id, token)
+            rv = self.user_to_dict(user), ts
+            if user is not None and self.user_cache_ttl:
+                self._cache_user(key, rv, client_key)
+
+        # The user dict is updated with session data by callers.
+        user_dict, ts = rv
+        return (dict(user_dict) if user_dict is not None else None), ts
 
     def create_auth_token(self, user_id):
         """Creates a new authentication token.
@@ -189,15 +244,142 @@ class AuthStore:
         return self.user_model.create_auth_token(user_id)
 
     def delete_auth_token(self, user_id, token):
-        """Deletes an authentication token.
+        """Deletes an authentication token, and the user cached for it.
 
         :param user_id:
             User id.
         :param token:
             Authentication token.
         """
+        self.invalidate_user_cache(user_id, token)
         return self.user_model.delete_auth_token(user_id, token)
 
+    def renew_auth_token(self, user_id, token):
+        """Replaces an authentication token with a new one.
+
+        If the user model implements ``renew_auth_token()``, the old token is
+        deleted and the new one is created in a single round trip.
+
+        :param user_id:
+            User id.
+        :param token:
+            Authentication token to be replaced.
+        :returns:
+            A new authentication token.
+        """
+        renew = getattr(self.user_model, "renew_auth_token", None)
+        if renew is None:
+            self.delete_auth_token(user_id, token)
+            return self.create_auth_token(user_id)
+
+        self.invalidate_user_cache(user_id, token)
+        return renew(user_id, token)
+
+    def delete_auth_tokens(self, user_id):
+        """Deletes all authentication tokens of a user, and the users cached
+        for them. Requires a user model that implements
+        ``delete_auth_tokens()``.
+
+        :param user_id:
+            User id.
+        """
+        self.invalidate_user_cache(user_id)
+        return self.user_model.delete_auth_tokens(user_id)
+
+    def set_password(self, user, raw_password):
+        """Changes the password of a user and saves it. Users cached for all
+        tokens of the user are removed.
+
+        :param user:
+            User object: an instance the custom user model.
+        :param raw_password:
+            The new plain password.
+        """
+        user.set_password(raw_password, hashing_pool=self.hashing_pool)
+        user.put()
+        self.invalidate_user_cache(user.get_id())
+
+    # User cache --------------------------------------------------------------
+
+    @webapp2.cached_property
+    def user_cache_ttl(self):
+        """Number of seconds users validated by token are cached."""
+        ttl = self.config["user_cache_ttl"]
+        return ttl if ttl is not None else self.config["token_cache_age"]
+
+    @webapp2.cached_property
+    def user_cache(self):
+        """Process-local :class:`webapp2_extras.cache.TTLCache` of users
+        validated by token, keyed by ``(user_id, token)``."""
+        size = self.config["user_cache_size"] if self.user_cache_ttl else 0
+        return cache.TTLCache(size, self.user_cache_ttl)
+
+    @webapp2.cached_property
+    def user_cache_client(self):
+        """Configured shared cache client, or None."""
+        client = self.config["user_cache_client"]
+        if isinstance(client, str):
+            client = webapp2.import_string(client)
+
+        return client
+
+    def _get_generation_key(self, user_id):
+        return f"{__name__}.generation:{user_id}"
+
+    def _get_user_cache_key(self, user_id, token):
+        """Returns the shared cache key of a user and token.
+
+        Keys include the current cache generation of the user, so all the
+        user's entries are invalidated at once by changing the generation,
+        without keeping a list of their tokens.
+        """
+        client = self.user_cache_client
+        generation_key = self._get_generation_key(user_id)
+        generation = client.get(generation_key)
+        if generation is None:
+            # Never reuse a generation, even if it was evicted.
+            generation = security.generate_random_string(entropy=64)
+            client.set(generation_key, generation)
+
+        return f"{__name__}.user:{user_id}:{generation}:{token}"
+
+    def _cache_user(self, key, value, client_key=None):
+        self.user_cache.set(key, value)
+        client = self.user_cache_client
+        if client is None:
+            return
+
+        if client_key is None:
+            client_key = self._get_user_cache_key(*key)
+
+        client.set(client_key, value, time=self.user_cache_ttl)
+
+    def invalidate_user_cache(self, user_id, token=None):
+        """Removes cached users.
+
+        :param user_id:
+            User id.
+        :param token:
+            Authentication token. If None, the user is removed for all tokens.
+        """
+        if token is not None:
+            tokens = [token]
+        else:
+            tokens = [t for (u, t), _ in self.user_cache.items() if u == user_id]
+
+        for t in tokens:
+            self.user_cache.pop((user_id, t))
+
+        client = self.user_cache_client
+        if client is None:
+            return
+
+        if token is not None:
+            client.delete(self._get_user_cache_key(user_id, token))
+        else:
+            # Entries of the previous generation can't be read anymore.
+            client.delete(self._get_generation_key(user_id))
+
     def user_to_dict(self, user):
         """Returns a dictionary based on a user object.
 
@@ -286,7 +468,7 @@ class AuthStore:
         """
         return self.get_user_by_auth_password(auth_id, password, silent=silent)
 
-    def validate_token(self, user_id, token, token_ts=None):
+    def validate_token(self, user_id, token, token_ts=None, renew=False):
         """Validates a token.
 
         Tokens are random strings used to authenticate temporarily. They are
@@ -298,6 +480,10 @@ class AuthStore:
             Token to be checked.
         :param token_ts:
             Optional token timestamp used to pre-validate the token age.
+        :param renew:
+            If True, a token that requires renewal is replaced by a new one
+            using :meth:`renew_auth_token`. Otherwise it is deleted and None
+            is returned as token.
         :returns:
             A tuple ``(user_dict, token)``.
         """
@@ -313,6 +499,9 @@ class AuthStore:
                 delete = (now - ts) > self.config["token_max_age"]
                 create = (now - ts) > self.config["token_new_age"]
 
+        if create and not delete and renew:
+            return user, self.renew_auth_token(user_id, token)
+
         if delete or create or not user:
             if delete or create:
                 # Delete token from db.
@@ -439,9 +628,12 @@ class Auth:
 
         if self._user is None:
             # Fetch and validate the token.
-            self._user, token = self.store.validate_token(
-                user_id, token, token_ts=token_ts
+            self._user, new_token = self.store.validate_token(
+                user_id, token, token_ts=token_ts, renew=save_session
             )
+            if new_token != token:
+                # The token was renewed.
+                token, token_ts = new_token, None
 
         if self._user is None:
             self._user = _anon
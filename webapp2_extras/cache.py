@@ -0,0 +1,228 @@
+# Copyright 2011 webapp2 AUTHORS.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+webapp2_extras.cache
+====================
+
+A small thread-safe LRU cache shared by other webapp2_extras modules.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+_missing = object()
+
+
+class LRUCache:
+    """A bounded mapping that discards the least recently used items.
+
+    All operations are protected by a lock, so a single instance can be
+    shared between request threads. It also supports the basic mapping
+    operations: ``cache[key]``, ``cache[key] = value``, ``del cache[key]``
+    and iteration over the keys.
+    """
+
+    #: Maximum number of items kept in the cache.
+    max_size = None
+    #: Number of successful lookups.
+    hits = 0
+    #: Number of failed lookups.
+    misses = 0
+
+    def __init__(self, max_size=128):
+        """Initializes the cache.
+
+        :param max_size:
+            Maximum number of items to keep. If 0 or less, nothing is stored.
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Returns a cached value, marking it as recently used.
+
+        :param key:
+            The cache key.
+        :param default:
+            Value returned if the key is not cached.
+        :returns:
+            The cached value, or `default`.
+        """
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """Stores a value, discarding the least recently used one if the cache
+        is full.
+
+        :param key:
+            The cache key.
+        :param value:
+            The value to be cached.
+        """
+        if self.max_size <= 0:
+            return
+
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """Removes a value from the cache and returns it.
+
+        :param key:
+            The cache key.
+        :param default:
+            Value returned if the key is not cached.
+        """
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def items(self):
+        """Returns a list of ``(key, value)`` pairs, from least to most
+        recently used. Doesn't change the usage order.
+        """
+        with self._lock:
+            return list(self._data.items())
+
+    def clear(self):
+        """Removes all values and resets the hit counters."""
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def __getitem__(self, key):
+        value = self.get(key, _missing)
+        if value is _missing:
+            raise KeyError(key)
+
+        return value
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __delitem__(self, key):
+        if self.pop(key, _missing) is _missing:
+            raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        """Returns a list of keys, from least to most recently used."""
+        return [key for key, _ in self.items()]
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+
+class TTLCache(LRUCache):
+    """A :class:`LRUCache` whose items also expire after some time."""
+
+    #: Number of seconds an item is kept.
+    ttl = None
+
+    def __init__(self, max_size=128, ttl=60):
+        """Initializes the cache.
+
+        :param max_size:
+            Maximum number of items to keep. If 0 or less, nothing is stored.
+        :param ttl:
+            Number of seconds an item is kept.
+        """
+        super().__init__(max_size)
+        self.ttl = ttl
+
+    def get(self, key, default=None):
+        """Returns a cached value that didn't expire, marking it as recently
+        used.
+
+        :param key:
+            The cache key.
+        :param default:
+            Value returned if the key is not cached or expired.
+        :returns:
+            The cached value, or `default`.
+        """
+        with self._lock:
+            try:
+                value, expires = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+
+            if expires <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """Stores a value for :attr:`ttl` seconds, discarding the least
+        recently used one if the cache is full.
+
+        :param key:
+            The cache key.
+        :param value:
+            The value to be cached.
+        """
+        super().set(key, (value, time.monotonic() + self.ttl))
+
+    def pop(self, key, default=None):
+        """Removes a value from the cache and returns it, if it didn't
+        expire.
+
+        :param key:
+            The cache key.
+        :param default:
+            Value returned if the key is not cached or expired.
+        """
+        with self._lock:
+            entry = self._data.pop(key, None)
+
+        if entry is None or entry[1] <= time.monotonic():
+            return default
+
+        return entry[0]
+
+    def items(self):
+        """Returns a list of ``(key, value)`` pairs that didn't expire, from
+        least to most recently used. Doesn't change the usage order.
+        """
+        now = time.monotonic()
+        return [(k, v) for k, (v, expires) in super().items() if expires > now]
+
+    def __contains__(self, key):
+        entry = self._data.get(key)
+        return entry is not None and entry[1] > time.monotonic()
@@ -0,0 +1,359 @@
+# Copyright 2011 webapp2 AUTHORS.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+webapp2_extras.compression
+==========================
+
+Response compression for webapp2: gzip, deflate and, if the ``brotli``
+package is available, brotli.
+"""
+import hashlib
+import zlib
+
+import webapp2
+from webapp2_extras import cache
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+#: Default configuration values for this module. Keys are:
+#:
+#: encodings
+#:     Content codings offered to clients, in order of preference. Codings
+#:     that are not available are ignored. Default is
+#:     ``['br', 'gzip', 'deflate']``.
+#:
+#: min_size
+#:     Bodies smaller than this number of bytes are sent uncompressed.
+#:     Default is 512.
+#:
+#: level
+#:     Compression level, from 1 (fastest) to 9 (smallest). Brotli uses
+#:     the same value as its quality setting. Default is 6.
+#:
+#: content_types
+#:     Content type prefixes that are worth compressing. Anything else
+#:     (images, archives, etc.) is considered to be already compressed.
+#:
+#: cache_size
+#:     Maximum number of compressed bodies kept in memory. Byte-identical
+#:     bodies are compressed only once while they stay in the cache. Set to 0
+#:     to disable the cache. Default is 128.
+#:
+#: cache_max_body
+#:     Bodies larger than this number of bytes are never cached.
+#:     Default is 1 MB.
+default_config = {
+    "encodings": ["br", "gzip", "deflate"],
+    "min_size": 512,
+    "level": 6,
+    "content_types": [
+        "text/",
+        "application/json",
+        "application/javascript",
+        "application/xml",
+        "application/xhtml+xml",
+        "image/svg+xml",
+    ],
+    "cache_size": 128,
+    "cache_max_body": 1 << 20,
+}
+
+
+def _gzip_compressor(level):
+    return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+def _deflate_compressor(level):
+    return zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS)
+
+
+def _brotli_compressor(level):
+    return _BrotliCompressor(level)
+
+
+class _BrotliCompressor:
+    """Gives ``brotli.Compressor`` the same interface as zlib compressors."""
+
+    def __init__(self, level):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self, mode=zlib.Z_FINISH):
+        if mode == zlib.Z_FINISH:
+            return self._compressor.finish()
+
+        return self._compressor.flush()
+
+
+#: Compressor factories for each supported content coding.
+_compressors = {
+    "gzip": _gzip_compressor,
+    "deflate": _deflate_compressor,
+}
+if brotli is not None:  # pragma: no cover
+    _compressors["br"] = _brotli_compressor
+
+
+class Compressor:
+    """Compresses responses according to the request ``Accept-Encoding``.
+
+    To compress the responses of all handlers, install it in the app. It
+    registers a ``before_response`` hook using
+    :meth:`webapp2.WSGIApplication.add_hook`::
+
+        from webapp2_extras import compression
+
+        app = webapp2.WSGIApplication(routes)
+        compression.get_compressor(app=app).install()
+
+    Or compress the response at the end of a base handler's dispatch::
+
+        import webapp2
+
+        from webapp2_extras import compression
+
+        class BaseHandler(webapp2.RequestHandler):
+            def dispatch(self):
+                try:
+                    webapp2.RequestHandler.dispatch(self)
+                finally:
+                    compressor = compression.get_compressor(app=self.app)
+                    compressor.compress_response(self.request, self.response)
+
+    Buffered bodies are compressed at once and cached, so hot responses that
+    don't change are compressed only once. Streamed bodies (an ``app_iter``
+    that is not a list) are compressed and flushed chunk by chunk as they
+    are sent.
+    """
+
+    #: Configuration key.
+    config_key = __name__
+
+    #: Loaded configuration.
+    config = None
+
+    def __init__(self, app, config=None):
+        """Initializes the compressor.
+
+        :param app:
+            A :class:`webapp2.WSGIApplication` instance.
+        :param config:
+            A dictionary of configuration values to be overridden. See
+            the available keys in :data:`default_config`.
+        """
+        self.app = app
+        self.config = config = app.config.load_config(
+            self.config_key,
+            default_values=default_config,
+            user_values=config,
+            required_keys=None,
+        )
+        self.encodings = [e for e in config["encodings"] if e in _compressors]
+        self.content_types = tuple(config["content_types"])
+        self.cache = cache.LRUCache(config["cache_size"])
+        # Negotiation results, keyed by the raw Accept-Encoding header.
+        self._negotiated = cache.LRUCache(256)
+
+    def install(self):
+        """Registers a hook in the app to compress all responses."""
+        self.app.add_hook("before_response", self.on_before_response)
+
+    def uninstall(self):
+        """Unregisters the hook from the app."""
+        self.app.remove_hook("before_response", self.on_before_response)
+
+    def on_before_response(self, request, response):
+        """Compresses a response before it is sent."""
+        self.compress_response(request, response)
+
+    def negotiate(self, request):
+        """Returns the preferred content coding accepted by a request.
+
+        :param request:
+            A :class:`webapp2.Request` instance.
+        :returns:
+            A content coding, e.g. ``'gzip'``, or None if the client doesn't
+            accept any of the configured codings.
+        """
+        header = request.headers.get("Accept-Encoding")
+        if not header:
+            return None
+
+        encoding = self._negotiated.get(header, False)
+        if encoding is False:
+            offers = request.accept_encoding.acceptable_offers(self.encodings)
+            encoding = offers[0][0] if offers else None
+            self._negotiated.set(header, encoding)
+
+        return encoding
+
+    def is_compressible(self, response):
+        """Checks if a response is a candidate for compression.
+
+        :param response:
+            A :class:`webapp2.Response` instance.
+        :returns:
+            True if the response may be compressed, False otherwise.
+        """
+        if response.status_int < 200 or response.status_int in (204, 206, 304):
+            return False
+
+        headers = response.headers
+        if "Content-Encoding" in headers or "Content-Range" in headers:
+            return False
+
+        if "no-transform" in headers.get("Cache-Control", ""):
+            return False
+
+        content_type = response.content_type or ""
+        return content_type.startswith(self.content_types)
+
+    def compress_response(self, request, response):
+        """Compresses a response in place, if the client accepts it.
+
+        :param request:
+            A :class:`webapp2.Request` instance.
+        :param response:
+            A :class:`webapp2.Response` instance.
+        :returns:
+            The used content coding, or None if the response was not
+            compressed.
+        """
+        if not self.is_compressible(response):
+            return None
+
+        # The representation depends on Accept-Encoding, even if this
+        # particular client doesn't get a compressed body.
+        vary = response.vary or ()
+        if "Accept-Encoding" not in vary:
+            response.vary = tuple(vary) + ("Accept-Encoding",)
+
+        encoding = self.negotiate(request)
+        if encoding is None:
+            return None
+
+        app_iter = response.app_iter
+        if isinstance(app_iter, (list, tuple)):
+            body = response.body
+            if len(body) < self.config["min_size"]:
+                return None
+
+            response.body = self.compress(body, encoding)
+        else:
+            response.app_iter = self._stream(app_iter, encoding)
+            response.content_length = None
+
+        response.headers["Content-Encoding"] = encoding
+        etag = response.headers.get("ETag")
+        if etag and etag.startswith('"') and etag.endswith('"'):
+            # A strong ETag identifies the bytes sent, so the compressed
+            # variant needs its own.
+            response.headers["ETag"] = '%s-%s"' % (etag[:-1], encoding)
+
+        return encoding
+
+    def compress(self, body, encoding):
+        """Compresses a body, using the cache for byte-identical bodies.
+
+        :param body:
+            The bytes to be compressed.
+        :param encoding:
+            A supported content coding.
+        :returns:
+            The compressed bytes.
+        """
+        cacheable = len(body) <= self.config["cache_max_body"]
+        if cacheable:
+            key = (encoding, hashlib.blake2b(body, digest_size=16).digest())
+            rv = self.cache.get(key)
+            if rv is not None:
+                return rv
+
+        compressor = _compressors[encoding](self.config["level"])
+        rv = compressor.compress(body) + compressor.flush()
+        if cacheable:
+            self.cache.set(key, rv)
+
+        return rv
+
+    def _stream(self, app_iter, encoding):
+        """Compresses an iterable body chunk by chunk."""
+        compressor = _compressors[encoding](self.config["level"])
+        try:
+            for chunk in app_iter:
+                if not chunk:
+                    continue
+
+                # Flush each chunk, so clients get the data as it is produced.
+                yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+            yield compressor.flush()
+        finally:
+            close = getattr(app_iter, "close", None)
+            if close is not None:
+                close()
+
+
+# Factories -------------------------------------------------------------------
+
+
+#: Key used to store :class:`Compressor` in the app registry.
+_registry_key = "webapp2_extras.compression.Compressor"
+
+
+def get_compressor(factory=Compressor, key=_registry_key, app=None):
+    """Returns an instance of :class:`Compressor` from the app registry.
+
+    It'll try to get it from the current app registry, and if it is not
+    registered it'll be instantiated and registered. A second call to this
+    function will return the same instance.
+
+    :param factory:
+        The callable used to build and register the instance if it is not yet
+        registered. The default is the class :class:`Compressor` itself.
+    :param key:
+        The key used to store the instance in the registry. A default is used
+        if it is not set.
+    :param app:
+        A :class:`webapp2.WSGIApplication` instance used to store the instance.
+        The active app is used if it is not set.
+    """
+    app = app or webapp2.get_app()
+    compressor = app.registry.get(key)
+    if not compressor:
+        compressor = app.registry[key] = factory(app)
+
+    return compressor
+
+
+def set_compressor(compressor, key=_registry_key, app=None):
+    """Sets an instance of :class:`Compressor` in the app registry.
+
+    :param compressor:
+        An instance of :class:`Compressor`.
+    :param key:
+        The key used to retrieve the instance from the registry. A default
+        is used if it is not set.
+    :param app:
+        A :class:`webapp2.WSGIApplication` instance used to retrieve the
+        instance. The active app is used if it is not set.
+    """
+    app = app or webapp2.get_app()
+    app.registry[key] = compressor
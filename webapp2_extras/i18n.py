@@ -22,11 +22,18 @@ Several ideas borrowed from tipfy.i18n and Flask-Babel.
 """
 import datetime
 import gettext as gettext_stdlib
+import hashlib
+import mmap
+import os
+import re
+import struct
+import threading
 
 import pytz
 from babel import dates, numbers, support
 
 import webapp2
+from webapp2_extras import cache
 
 try:
     # Monkeypatches pytz for gae.
@@ -61,6 +68,31 @@ except ImportError:  # pragma: no cover
 #:
 #: date_formats
 #:     Default date formats for datetime, date and time.
+#:
+#: preload_locales
+#:     A list of locale codes to be loaded when the store is created, or
+#:     True to load all locales found in `translations_path`. Create the
+#:     store at startup with :func:`get_store` to use it. Default is None.
+#:
+#: compiled_path
+#:     Path to a directory where the merged catalog of each locale is
+#:     compiled. Compiled catalogs are memory-mapped, so processes share
+#:     them and don't parse .mo files. They are compiled again when the
+#:     source files change. Default is None (catalogs are not compiled).
+#:
+#: compiled_cache_size
+#:     Maximum number of decoded messages kept in memory for each compiled
+#:     catalog. Default is 1000.
+#:
+#: translations_cache_size
+#:     Maximum number of locales with translations kept in memory. The least
+#:     recently used locales are discarded. Default is 100.
+#:
+#: unknown_locales_cache_size
+#:     Maximum number of locales without translations that are remembered,
+#:     so that they don't cause a new search for catalogs on each request.
+#:     Their requests use the translations of `default_locale`. Default is
+#:     1000.
 default_config = {
     "translations_path": "locale",
     "domains": ["messages"],
@@ -88,10 +120,236 @@ default_config = {
         "datetime.long": None,
         "datetime.iso": "yyyy'-'MM'-'dd'T'HH':'mm':'ssZ",
     },
+    "preload_locales": None,
+    "compiled_path": None,
+    "compiled_cache_size": 1000,
+    "translations_cache_size": 100,
+    "unknown_locales_cache_size": 1000,
 }
 
 NullTranslations = gettext_stdlib.NullTranslations
 
+#: Locale codes that can be used as file names of compiled catalogs.
+_locale_re = re.compile(r"^[A-Za-z0-9_@-]+$")
+
+#: Magic number of little endian .mo files.
+_mo_magic = 0x950412DE
+
+#: A pair of (length, offset) in the tables of a .mo file.
+_mo_entry = struct.Struct("<2I")
+
+_missing = object()
+_uncached = object()
+
+
+def compile_translations(translations, path, headers=None):
+    """Writes a translation catalog to a .mo file that can be loaded by
+    :class:`MappedTranslations`.
+
+    Plural messages are stored with an empty plural msgid, so that they can
+    be found using only the singular msgid. The file is replaced atomically.
+
+    :param translations:
+        A ``babel.support.Translations`` instance.
+    :param path:
+        Path of the file to be written.
+    :param headers:
+        A dictionary of extra metadata headers.
+    """
+    info = dict(translations.info())
+    info["content-type"] = "text/plain; charset=UTF-8"
+    info.update(headers or {})
+    entries = {"": "".join("%s: %s\n" % item for item in info.items())}
+    plurals = {}
+    for key, value in translations._catalog.items():
+        if isinstance(key, tuple):
+            plurals.setdefault(key[0], {})[key[1]] = value
+        elif key:
+            entries[key] = value
+
+    for msgid, forms in plurals.items():
+        entries[msgid + "\0"] = "\0".join(
+            forms.get(i, "") for i in range(max(forms) + 1)
+        )
+
+    items = sorted((k.encode("utf-8"), v.encode("utf-8")) for k, v in entries.items())
+    count = len(items)
+    originals = 28
+    translations_offset = originals + count * 8
+    offset = translations_offset + count * 8
+    tables = []
+    data = []
+    for index in (0, 1):
+        for item in items:
+            value = item[index]
+            tables.append(_mo_entry.pack(len(value), offset))
+            data.append(value + b"\0")
+            offset += len(value) + 1
+
+    header = struct.pack(
+        "<7I", _mo_magic, 0, count, originals, translations_offset, 0, offset
+    )
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp_path, "wb") as f:
+        f.write(header + b"".join(tables) + b"".join(data))
+
+    os.replace(tmp_path, path)
+
+
+class MappedCatalog:
+    """A read-only message catalog backed by a memory-mapped .mo file
+    written by :func:`compile_translations`.
+
+    Messages are found with a binary search and decoded when used, so the
+    file pages are shared by all processes that map the same file. Only the
+    most recently used messages are kept decoded. Messages added by
+    :meth:`update`, e.g. when translations are merged, are kept in memory
+    and override the mapped ones.
+    """
+
+    def __init__(self, path, cache_size=1000):
+        """Maps a compiled catalog.
+
+        :param path:
+            Path to the compiled .mo file.
+        :param cache_size:
+            Maximum number of decoded messages kept in memory.
+        """
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, _, count, originals, translations = struct.unpack_from("<5I", self._map)
+        if magic != _mo_magic:
+            raise OSError(0, "Bad magic number", path)
+
+        self._count = count
+        self._originals = originals
+        self._translations = translations
+        # Decoded messages, including misses.
+        self._cache = cache.LRUCache(cache_size)
+        # Messages added by update().
+        self._extra = {}
+
+    def _get_entry(self, table, index):
+        length, offset = _mo_entry.unpack_from(self._map, table + index * 8)
+        return self._map[offset : offset + length]
+
+    def _find(self, msgid):
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            value = self._get_entry(self._originals, mid)
+            if value < msgid:
+                lo = mid + 1
+            elif value > msgid:
+                hi = mid
+            else:
+                return self._get_entry(self._translations, mid)
+
+        return None
+
+    def get(self, key, default=None):
+        value = self._extra.get(key, _missing) if self._extra else _missing
+        if value is not _missing:
+            return value
+
+        value = self._cache.get(key, _uncached)
+        if value is _uncached:
+            value = _missing
+            if isinstance(key, tuple):
+                msgid, index = key
+                data = self._find(msgid.encode("utf-8") + b"\0")
+                if data is not None:
+                    forms = data.split(b"\0")
+                    if index < len(forms):
+                        value = forms[index].decode("utf-8")
+            else:
+                data = self._find(key.encode("utf-8"))
+                if data is not None:
+                    value = data.decode("utf-8")
+
+            self._cache.set(key, value)
+
+        return default if value is _missing else value
+
+    def __getitem__(self, key):
+        value = self.get(key, _missing)
+        if value is _missing:
+            raise KeyError(key)
+
+        return value
+
+    def __contains__(self, key):
+        return self.get(key, _missing) is not _missing
+
+    def __len__(self):
+        # Like gettext catalogs, each plural form is counted.
+        return len(self.keys())
+
+    def update(self, messages):
+        """Adds messages to the catalog, overriding the existing ones.
+
+        :param messages:
+            A mapping of message ids to translations, e.g. the catalog of
+            other translations.
+        """
+        self._extra.update(messages)
+
+    def items(self):
+        extra = self._extra
+        yield from extra.items()
+        for i in range(self._count):
+            msgid = self._get_entry(self._originals, i).decode("utf-8")
+            value = self._get_entry(self._translations, i).decode("utf-8")
+            if msgid.endswith("\0"):
+                for index, form in enumerate(value.split("\0")):
+                    if (msgid[:-1], index) not in extra:
+                        yield (msgid[:-1], index), form
+            elif msgid not in extra:
+                yield msgid, value
+
+    def keys(self):
+        return [key for key, _ in self.items()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+
+class MappedTranslations(support.Translations):
+    """Translations loaded from a catalog compiled by
+    :func:`compile_translations`, without parsing it.
+
+    They can be merged with other translations using ``merge()`` and
+    ``add()``. Merged messages are kept in memory.
+    """
+
+    def __init__(self, path, domain=None, cache_size=1000):
+        """Loads a compiled catalog.
+
+        :param path:
+            Path to the compiled .mo file.
+        :param domain:
+            The message domain.
+        :param cache_size:
+            Maximum number of decoded messages kept in memory.
+        """
+        super().__init__(domain=domain)
+        self._catalog = MappedCatalog(path, cache_size)
+        self.files = [path]
+        self.plural = lambda n: int(n != 1)
+        for line in self._catalog.get("", "").split("\n"):
+            key, sep, value = line.partition(":")
+            if not sep:
+                continue
+
+            key, value = key.strip().lower(), value.strip()
+            self._info[key] = value
+            if key == "content-type":
+                self._charset = value.split("charset=")[1]
+            elif key == "plural-forms":
+                plural = value.split(";")[1].split("plural=")[1]
+                self.plural = gettext_stdlib.c2py(plural)
+
 
 class I18nStore:
     """Internalization store.
@@ -101,12 +359,21 @@ class I18nStore:
 
     #: Configuration key.
     config_key = __name__
-    #: A dictionary with all loaded translations.
+    #: A :class:`webapp2_extras.cache.LRUCache` with the loaded
+    #: translations of each locale. It can be read and updated like a
+    #: dictionary, e.g. ``store.translations[locale]``.
     translations = None
+    #: A :class:`webapp2_extras.cache.LRUCache` with the locales that don't
+    #: have translations.
+    unknown_locales = None
     #: Path to where traslations are stored.
     translations_path = None
     #: Translation domains to merge.
     domains = None
+    #: Path where merged catalogs are compiled, or None.
+    compiled_path = None
+    #: Maximum number of decoded messages kept for each compiled catalog.
+    compiled_cache_size = None
     #: Default locale code.
     default_locale = None
     #: Default timezone code.
@@ -133,7 +400,14 @@ class I18nStore:
             user_values=config,
             required_keys=None,
         )
-        self.translations = {}
+        self.translations = cache.LRUCache(config["translations_cache_size"])
+        self.unknown_locales = cache.LRUCache(config["unknown_locales_cache_size"])
+        self.compiled_path = config["compiled_path"]
+        self.compiled_cache_size = config["compiled_cache_size"]
+        self._signatures = cache.LRUCache(config["translations_cache_size"])
+        # Events of the locales being loaded, to load each one only once.
+        self._loading = {}
+        self._loading_lock = threading.Lock()
         self.translations_path = config["translations_path"]
         self.domains = config["domains"]
         self.default_locale = config["default_locale"]
@@ -141,6 +415,9 @@ class I18nStore:
         self.date_formats = config["date_formats"]
         self.set_locale_selector(config["locale_selector"])
         self.set_timezone_selector(config["timezone_selector"])
+        if config["preload_locales"]:
+            preload = config["preload_locales"]
+            self.preload(None if preload is True else preload)
 
     def set_locale_selector(self, func):
         """Sets the function that defines the locale for a request.
@@ -189,17 +466,184 @@ class I18nStore:
             A ``babel.support.Translations`` instance, or
             ``gettext.NullTranslations`` if none was found.
         """
+        debug = webapp2.get_app().debug
+        if not debug and self.unknown_locales.get(locale):
+            locale = self.default_locale
+
         trans = self.translations.get(locale)
+        if trans and debug:
+            # Reload only if a source file changed.
+            if self._signatures.get(locale) != self.get_signature(locale):
+                trans = None
+
         if not trans:
+            trans = self.load_locale(locale)
+
+        return trans
+
+    def preload(self, locales=None):
+        """Loads the translations of several locales, e.g. at startup before
+        worker processes are forked.
+
+        :param locales:
+            A list of locale codes. If None, all locales found in
+            :attr:`translations_path` are loaded.
+        """
+        if locales is None:
+            locales = self.get_available_locales()
+
+        for locale in locales:
+            self.load_locale(locale)
+
+    def get_available_locales(self):
+        """Returns the locale codes that have a catalog for at least one of
+        the :attr:`domains`.
+
+        :returns:
+            A sorted list of locale codes.
+        """
+        try:
+            names = os.listdir(self.translations_path)
+        except OSError:
+            return []
+
+        return sorted(
+            name
+            for name in names
+            if any(
+                os.path.isfile(
+                    os.path.join(
+                        self.translations_path, name, "LC_MESSAGES", domain + ".mo"
+                    )
+                )
+                for domain in self.domains
+            )
+        )
+
+    def get_signature(self, locale):
+        """Returns the paths and modification times of the files used to
+        load the translations of a locale.
+
+        :param locale:
+            A locale code.
+        :returns:
+            A tuple of tuples ``(path, mtime)``.
+        """
+        rv = []
+        locales = [locale, self.default_locale]
+        for domain in self.domains:
+            for path in gettext_stdlib.find(
+                domain, self.translations_path, locales, all=True
+            ):
+                try:
+                    rv.append((path, os.stat(path).st_mtime_ns))
+                except OSError:  # pragma: no cover
+                    pass
+
+        return tuple(rv)
+
+    def has_catalog(self, locale):
+        """Checks if a locale has a catalog for at least one of the
+        :attr:`domains`, not counting the default locale.
+
+        :param locale:
+            A locale code.
+        :returns:
+            True if a catalog was found, False otherwise.
+        """
+        return any(
+            gettext_stdlib.find(domain, self.translations_path, [locale])
+            for domain in self.domains
+        )
+
+    def load_locale(self, locale):
+        """Loads and caches the translations of a locale. If
+        :attr:`compiled_path` is set, the compiled catalog is used.
+
+        If several threads load the same locale at the same time, only one
+        of them loads it and the others wait for the result. Locales without
+        catalogs are stored in :attr:`unknown_locales` and use the
+        translations of the default locale.
+
+        :param locale:
+            A locale code.
+        :returns:
+            A ``babel.support.Translations`` instance, or
+            ``gettext.NullTranslations`` if none was found.
+        """
+        with self._loading_lock:
+            event = self._loading.get(locale)
+            if event is None:
+                event = self._loading[locale] = threading.Event()
+                loader = True
+            else:
+                loader = False
+
+        if not loader:
+            event.wait()
+            trans = self.translations.get(locale)
+            if trans is None and self.unknown_locales.get(locale):
+                trans = self.translations.get(self.default_locale)
+
+            # Load it again if the loader failed or it was already discarded.
+            return trans or self.load_locale(locale)
+
+        try:
+            if locale != self.default_locale and not self.has_catalog(locale):
+                self.unknown_locales.set(locale, True)
+                default = self.default_locale
+                return self.translations.get(default) or self.load_locale(default)
+
+            return self._load_locale(locale)
+        finally:
+            with self._loading_lock:
+                del self._loading[locale]
+
+            event.set()
+
+    def _load_locale(self, locale):
+        signature = self.get_signature(locale)
+        if self.compiled_path and _locale_re.match(locale):
+            trans = self.load_compiled(locale, signature)
+        else:
             locales = (locale, self.default_locale)
             trans = self.load_translations(
                 self.translations_path, locales, self.domains
             )
-            if not webapp2.get_app().debug:
-                self.translations[locale] = trans
 
+        self.translations.set(locale, trans)
+        self._signatures.set(locale, signature)
         return trans
 
+    def load_compiled(self, locale, signature):
+        """Loads the compiled catalog of a locale, compiling it if it doesn't
+        exist or if the source files changed.
+
+        :param locale:
+            A locale code.
+        :param signature:
+            The source files, as returned by :meth:`get_signature`.
+        :returns:
+            A :class:`MappedTranslations` instance, or
+            ``gettext.NullTranslations`` if none was found.
+        """
+        path = os.path.join(self.compiled_path, locale + ".mo")
+        digest = hashlib.sha1(repr(signature).encode("utf-8")).hexdigest()
+        cache_size = self.compiled_cache_size
+        if os.path.isfile(path):
+            trans = MappedTranslations(path, cache_size=cache_size)
+            if trans.info().get("x-sources") == digest:
+                return trans
+
+        locales = (locale, self.default_locale)
+        trans = self.load_translations(self.translations_path, locales, self.domains)
+        if not isinstance(trans, support.Translations):
+            return trans
+
+        os.makedirs(self.compiled_path, exist_ok=True)
+        compile_translations(trans, path, {"x-sources": digest})
+        return MappedTranslations(path, domain=trans.domain, cache_size=cache_size)
+
     def load_translations(self, dirname, locales, domains):
         """Loads a translation catalog.
 
@@ -217,7 +661,7 @@ class I18nStore:
         trans_null = None
         for domain in domains:
             _trans = support.Translations.load(dirname, locales, domain)
-            if isinstance(_trans, NullTranslations):
+            if not isinstance(_trans, support.Translations):
                 trans_null = _trans
                 continue
             elif trans is None:
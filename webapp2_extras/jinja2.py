@@ -104,6 +104,9 @@ class Jinja2:
     #: Loaded configuration.
     config = None
 
+    #: A :class:`webapp2.WSGIApplication` instance.
+    app = None
+
     def __init__(self, app, config=None):
         """Initializes the Jinja2 object.
 
@@ -113,6 +116,7 @@ class Jinja2:
             A dictionary of configuration values to be overridden. See
             the available keys in :data:`default_config`.
         """
+        self.app = app
         self.config = config = app.config.load_config(
             self.config_key,
             default_values=default_config,
@@ -174,7 +178,8 @@ class Jinja2:
         :returns:
             A rendered template.
         """
-        return self.environment.get_template(_filename).render(**context)
+        with self.app.time_phase(None, "template"):
+            return self.environment.get_template(_filename).render(**context)
 
     def get_template_attribute(self, filename, attribute):
         """Loads a macro (or variable) a template exports.  This can be used to
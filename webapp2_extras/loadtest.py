@@ -0,0 +1,374 @@
+# Copyright 2011 webapp2 AUTHORS.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+webapp2_extras.loadtest
+=======================
+
+In-process load generator for webapp2 apps.
+
+Requests are sent directly to the WSGI callable of an app from several
+threads, without opening sockets, and latencies are reported per route name.
+"""
+import base64
+import io
+import itertools
+import math
+import sys
+import threading
+
+import webapp2
+from webapp2_extras import timing
+
+#: Environ key where the matched route name is stored during a load test.
+_route_name_key = "webapp2_extras.loadtest.route_name"
+
+#: Environ keys that are not recorded: the input streams, and values cached
+#: by WebOb or webapp2 while the request was handled.
+_skip_keys = ("wsgi.input", "wsgi.errors", "webob.", "webapp2")
+
+
+def percentile(values, percent):
+    """Returns a percentile of sorted values, using the nearest-rank method.
+
+    :param values:
+        A sorted list of numbers.
+    :param percent:
+        The percentile, between 0 and 100.
+    :returns:
+        The value at the given percentile, or None if `values` is empty.
+    """
+    if not values:
+        return None
+
+    index = int(math.ceil(percent / 100.0 * len(values))) - 1
+    return values[max(0, min(index, len(values) - 1))]
+
+
+class RecordedRequest:
+    """A request that can be replayed any number of times."""
+
+    def __init__(self, environ, body=b""):
+        """Initializes the request.
+
+        :param environ:
+            A WSGI environment. The input streams and values cached by WebOb
+            are ignored.
+        :param body:
+            The request body, as bytes.
+        """
+        self.environ = {
+            k: v for k, v in environ.items() if not k.startswith(_skip_keys)
+        }
+        self.body = body
+
+    @classmethod
+    def from_request(cls, request):
+        """Records a :class:`webapp2.Request`, including its body."""
+        return cls(request.environ, request.body)
+
+    @classmethod
+    def blank(cls, path, **kwargs):
+        """Builds a request like :meth:`webapp2.Request.blank`."""
+        return cls.from_request(webapp2.Request.blank(path, **kwargs))
+
+    @classmethod
+    def from_dict(cls, data):
+        """Builds a request from a dictionary returned by :meth:`to_dict`."""
+        return cls(data["environ"], base64.b64decode(data["body"]))
+
+    def to_dict(self):
+        """Returns a JSON serializable dictionary for this request.
+
+        Only string and integer values of the environment are kept.
+        """
+        return {
+            "environ": {
+                k: v for k, v in self.environ.items() if isinstance(v, (str, int))
+            },
+            "body": base64.b64encode(self.body).decode("ascii"),
+        }
+
+    def make_environ(self):
+        """Returns a fresh WSGI environment to send this request."""
+        environ = self.environ.copy()
+        environ["wsgi.input"] = io.BytesIO(self.body)
+        environ["wsgi.errors"] = sys.stderr
+        environ["CONTENT_LENGTH"] = str(len(self.body))
+        return environ
+
+    def __repr__(self):
+        return "<RecordedRequest(%s %s)>" % (
+            self.environ.get("REQUEST_METHOD"),
+            self.environ.get("PATH_INFO"),
+        )
+
+
+class Recorder:
+    """Records requests handled by an app, to replay them with
+    :class:`LoadTester`::
+
+        recorder = loadtest.Recorder(app)
+        # ... run the app test suite or some real traffic ...
+        recorder.uninstall()
+        result = loadtest.LoadTester(app, recorder.requests).run(total=10000)
+    """
+
+    def __init__(self, app, max_requests=1000):
+        """Initializes the recorder and registers its hook.
+
+        :param app:
+            A :class:`webapp2.WSGIApplication` instance.
+        :param max_requests:
+            Maximum number of requests to record.
+        """
+        self.app = app
+        self.max_requests = max_requests
+        #: Recorded :class:`RecordedRequest` instances.
+        self.requests = []
+        self._lock = threading.Lock()
+        self.install()
+
+    def install(self):
+        """Registers the recorder hook in the app."""
+        self.app.add_hook("request_started", self.on_request_started)
+
+    def uninstall(self):
+        """Unregisters the recorder hook from the app."""
+        self.app.remove_hook("request_started", self.on_request_started)
+
+    def on_request_started(self, request):
+        """Records the request."""
+        if len(self.requests) >= self.max_requests:
+            return
+
+        recorded = RecordedRequest.from_request(request)
+        with self._lock:
+            if len(self.requests) < self.max_requests:
+                self.requests.append(recorded)
+
+
+class LoadTestResult:
+    """Results of a :meth:`LoadTester.run` call."""
+
+    def __init__(self, samples, elapsed, threads):
+        """Initializes the result.
+
+        :param samples:
+            A list of tuples ``(route_name, latency, status_code)``.
+        :param elapsed:
+            Wall time of the whole run, in seconds.
+        :param threads:
+            Number of threads used.
+        """
+        self.samples = samples
+        self.elapsed = elapsed
+        self.threads = threads
+
+    def summary(self):
+        """Returns statistics per route name.
+
+        :returns:
+            A dictionary mapping route names, plus ``'<total>'`` for all
+            requests, to dictionaries with the keys ``count``, ``errors``
+            (responses with a 5xx status), ``throughput`` (requests per
+            second) and ``mean``, ``p50``, ``p95``, ``p99`` and ``max``
+            latencies in seconds.
+        """
+        groups = {"<total>": []}
+        errors = {"<total>": 0}
+        for route_name, latency, status in self.samples:
+            groups.setdefault(route_name, []).append(latency)
+            groups["<total>"].append(latency)
+            if status >= 500:
+                errors[route_name] = errors.get(route_name, 0) + 1
+                errors["<total>"] += 1
+
+        rv = {}
+        for route_name, latencies in groups.items():
+            latencies.sort()
+            count = len(latencies)
+            rv[route_name] = {
+                "count": count,
+                "errors": errors.get(route_name, 0),
+                "throughput": count / self.elapsed if self.elapsed else 0.0,
+                "mean": sum(latencies) / count if count else None,
+                "p50": percentile(latencies, 50),
+                "p95": percentile(latencies, 95),
+                "p99": percentile(latencies, 99),
+                "max": latencies[-1] if latencies else None,
+            }
+
+        return rv
+
+    def format(self):
+        """Returns the summary as a text table, with latencies in
+        milliseconds."""
+        lines = [
+            "%-30s %8s %6s %10s %9s %9s %9s"
+            % ("route", "count", "errors", "req/s", "p50", "p95", "p99")
+        ]
+        summary = self.summary()
+        total = summary.pop("<total>")
+        for route_name, s in sorted(summary.items()) + [("<total>", total)]:
+            if not s["count"]:
+                continue
+
+            lines.append(
+                "%-30s %8d %6d %10.1f %9.3f %9.3f %9.3f"
+                % (
+                    route_name,
+                    s["count"],
+                    s["errors"],
+                    s["throughput"],
+                    s["p50"] * 1000,
+                    s["p95"] * 1000,
+                    s["p99"] * 1000,
+                )
+            )
+
+        return "\n".join(lines) + "\n"
+
+
+class LoadTester:
+    """Sends a mix of requests to an app from several threads.
+
+    Requests are taken in turn from the given list, so the mix is replayed
+    in the same proportions::
+
+        from webapp2_extras import loadtest
+
+        requests = [
+            loadtest.RecordedRequest.blank('/'),
+            loadtest.RecordedRequest.blank('/login', POST={'user': 'me'}),
+        ]
+        result = loadtest.LoadTester(app, requests, threads=8).run(total=5000)
+        print(result.format())
+    """
+
+    def __init__(self, app, requests, threads=4):
+        """Initializes the load tester.
+
+        :param app:
+            A :class:`webapp2.WSGIApplication` instance.
+        :param requests:
+            A list of :class:`RecordedRequest` instances.
+        :param threads:
+            Number of concurrent threads.
+        """
+        assert requests, "At least one request is required."
+        self.app = app
+        self.requests = list(requests)
+        self.threads = threads
+
+    def on_before_response(self, request, response):
+        """Stores the route name in the WSGI environment."""
+        request.environ[_route_name_key] = timing.get_route_name(request)
+
+    def send(self, recorded):
+        """Sends a single request through the WSGI callable.
+
+        :param recorded:
+            A :class:`RecordedRequest` instance.
+        :returns:
+            A tuple ``(route_name, latency, status_code)``.
+        """
+        environ = recorded.make_environ()
+        status = []
+
+        def start_response(status_line, headers, exc_info=None):
+            status.append(status_line)
+            return lambda data: None
+
+        started = webapp2._timer()
+        app_iter = self.app(environ, start_response)
+        try:
+            for _ in app_iter:
+                pass
+        finally:
+            if hasattr(app_iter, "close"):
+                app_iter.close()
+
+        latency = webapp2._timer() - started
+        status_code = int(status[-1].split(" ", 1)[0]) if status else 500
+        return environ.get(_route_name_key, "<unknown>"), latency, status_code
+
+    def run(self, total=None, duration=None, warmup=0):
+        """Runs the load test.
+
+        :param total:
+            Total number of requests to send. If neither `total` or
+            `duration` is set, each request is sent once per thread.
+        :param duration:
+            Maximum duration of the test, in seconds.
+        :param warmup:
+            Number of requests sent before measuring, from a single thread.
+        :returns:
+            A :class:`LoadTestResult` instance.
+        """
+        if total is None and duration is None:
+            total = len(self.requests) * self.threads
+
+        for i in range(warmup):
+            self.send(self.requests[i % len(self.requests)])
+
+        counter = itertools.count()
+        barrier = threading.Barrier(self.threads + 1)
+        results = [[] for _ in range(self.threads)]
+        errors = []
+        deadline = []
+
+        def worker(samples):
+            barrier.wait()
+            requests, size = self.requests, len(self.requests)
+            while True:
+                i = next(counter)
+                if total is not None and i >= total:
+                    return
+
+                if deadline and webapp2._timer() >= deadline[0]:
+                    return
+
+                try:
+                    samples.append(self.send(requests[i % size]))
+                except Exception as e:
+                    errors.append(e)
+                    return
+
+        workers = [
+            threading.Thread(target=worker, args=(samples,)) for samples in results
+        ]
+        self.app.add_hook("before_response", self.on_before_response)
+        try:
+            for thread in workers:
+                thread.start()
+
+            started = webapp2._timer()
+            if duration is not None:
+                deadline.append(started + duration)
+
+            barrier.wait()
+            for thread in workers:
+                thread.join()
+
+            elapsed = webapp2._timer() - started
+        finally:
+            self.app.remove_hook("before_response", self.on_before_response)
+
+        if errors:
+            raise errors[0]
+
+        return LoadTestResult(
+            list(itertools.chain.from_iterable(results)), elapsed, self.threads
+        )
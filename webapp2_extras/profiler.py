@@ -0,0 +1,399 @@
+# Copyright 2011 webapp2 AUTHORS.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+webapp2_extras.profiler
+=======================
+
+Sampling profiler for webapp2, with statistics aggregated per route.
+"""
+import cProfile
+import io
+import os
+import pstats
+import re
+import threading
+
+import webapp2
+from webapp2_extras import cache, securecookie, timing
+
+#: Default configuration values for this module. Keys are:
+#:
+#: sample_every
+#:     Profile one in every `sample_every` requests. Set to 0 to only
+#:     profile requests that carry a signed debug header. Default is 0.
+#:
+#: secret_key
+#:     Secret key used to sign debug header tokens. If None, the debug
+#:     header is ignored and the :class:`ProfilerHandler` denies access.
+#:
+#: header_name
+#:     Name of the request header that carries a debug token. Default is
+#:     ``X-Webapp2-Profile``.
+#:
+#: token_max_age
+#:     Maximum age in seconds of a valid debug token. Default is 3600.
+#:
+#: max_routes
+#:     Maximum number of routes for which statistics are kept. The least
+#:     recently profiled routes are discarded first. Default is 100.
+default_config = {
+    "sample_every": 0,
+    "secret_key": None,
+    "header_name": "X-Webapp2-Profile",
+    "token_max_age": 3600,
+    "max_routes": 100,
+}
+
+#: Key used to store the request profile in the request registry.
+_profile_key = "webapp2_extras.profiler.profile"
+
+#: Characters that are not safe in a dump file name.
+_unsafe_filename_re = re.compile(r"[^\w.-]+")
+
+
+class Profiler:
+    """Profiles sampled requests with ``cProfile``.
+
+    Statistics of sampled requests are merged per route name, using the hooks
+    from :meth:`webapp2.WSGIApplication.add_hook`. Instantiate it once for an
+    app, preferably through :func:`get_profiler`::
+
+        from webapp2_extras import profiler
+
+        config = {
+            'webapp2_extras.profiler': {
+                'sample_every': 1000,
+                'secret_key': 'my-super-secret',
+            },
+        }
+        app = webapp2.WSGIApplication(routes, config=config)
+        profiler.get_profiler(app=app)
+
+    A request is also profiled if it carries a token created by
+    :meth:`create_token` in the configured header.
+    """
+
+    #: Configuration key.
+    config_key = __name__
+
+    #: Loaded configuration.
+    config = None
+
+    def __init__(self, app, config=None):
+        """Initializes the profiler and registers its hooks.
+
+        :param app:
+            A :class:`webapp2.WSGIApplication` instance.
+        :param config:
+            A dictionary of configuration values to be overridden. See
+            the available keys in :data:`default_config`.
+        """
+        self.app = app
+        self.config = config = app.config.load_config(
+            self.config_key,
+            default_values=default_config,
+            user_values=config,
+            required_keys=None,
+        )
+        self.sample_every = config["sample_every"]
+        self.stats = cache.LRUCache(config["max_routes"])
+        self._counter = 0
+        self._lock = threading.Lock()
+        # The profile enabled in the current thread, if any.
+        self._active = threading.local()
+        self.install()
+
+    @webapp2.cached_property
+    def serializer(self):
+        secret_key = self.config["secret_key"]
+        if secret_key is None:
+            return None
+
+        return securecookie.SecureCookieSerializer(secret_key)
+
+    def install(self):
+        """Registers the profiler hooks in the app."""
+        self.app.add_hook("request_started", self.on_request_started)
+        self.app.add_hook("before_response", self.on_before_response)
+
+    def uninstall(self):
+        """Unregisters the profiler hooks from the app."""
+        self.app.remove_hook("request_started", self.on_request_started)
+        self.app.remove_hook("before_response", self.on_before_response)
+
+    # Sampling ----------------------------------------------------------------
+
+    def create_token(self):
+        """Returns a signed token that forces profiling of a request.
+
+        Send it in the configured header, e.g. ``X-Webapp2-Profile``.
+
+        :returns:
+            A token string.
+        """
+        assert self.serializer is not None, "Missing secret_key configuration."
+        return self.serializer.serialize(self.config["header_name"], 1).decode()
+
+    def is_valid_token(self, token):
+        """Checks a token created by :meth:`create_token`.
+
+        :param token:
+            A token string.
+        :returns:
+            True if the token is valid and not expired, False otherwise.
+        """
+        if not token or self.serializer is None:
+            return False
+
+        return (
+            self.serializer.deserialize(
+                self.config["header_name"],
+                token,
+                max_age=self.config["token_max_age"],
+            )
+            == 1
+        )
+
+    def should_profile(self, request):
+        """Decides if a request will be profiled.
+
+        :param request:
+            A :class:`webapp2.Request` instance.
+        :returns:
+            True if the request carries a valid debug token or if it is the
+            n-th request according to the ``sample_every`` configuration.
+        """
+        token = request.headers.get(self.config["header_name"])
+        if token:
+            return self.is_valid_token(token)
+
+        if not self.sample_every:
+            return False
+
+        with self._lock:
+            self._counter += 1
+            if self._counter < self.sample_every:
+                return False
+
+            self._counter = 0
+            return True
+
+    def on_request_started(self, request):
+        """Starts profiling the request, if it is sampled."""
+        # A profile left enabled by an aborted request would skew results.
+        self._stop()
+        if not self.should_profile(request):
+            return
+
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is active.
+            return
+
+        self._active.profile = profile
+        request.registry[_profile_key] = profile
+
+    def on_before_response(self, request, response):
+        """Stops profiling the request and merges its statistics."""
+        profile = request.registry.pop(_profile_key, None)
+        if profile is None:
+            return
+
+        self._stop()
+        self.add_stats(timing.get_route_name(request), profile)
+
+    def _stop(self):
+        profile = getattr(self._active, "profile", None)
+        if profile is not None:
+            profile.disable()
+            self._active.profile = None
+
+    # Statistics --------------------------------------------------------------
+
+    def add_stats(self, route_name, profile):
+        """Merges a profile into the statistics of a route.
+
+        :param route_name:
+            The route name.
+        :param profile:
+            A disabled ``cProfile.Profile`` instance.
+        """
+        with self._lock:
+            entry = self.stats.get(route_name)
+            if entry is None:
+                entry = [pstats.Stats(profile), 1]
+            else:
+                entry[0].add(profile)
+                entry[1] += 1
+
+            self.stats.set(route_name, entry)
+
+    def get_routes(self):
+        """Returns the profiled routes.
+
+        :returns:
+            A dictionary mapping route names to the number of sampled requests.
+        """
+        return {name: entry[1] for name, entry in self.stats.items()}
+
+    def get_stats(self, route_name):
+        """Returns the merged statistics of a route.
+
+        :param route_name:
+            The route name.
+        :returns:
+            A ``pstats.Stats`` instance, or None if the route was not profiled.
+        """
+        entry = self.stats.get(route_name)
+        return entry[0] if entry is not None else None
+
+    def format_stats(self, route_name, sort="cumulative", limit=50):
+        """Returns the merged statistics of a route as text.
+
+        :param route_name:
+            The route name.
+        :param sort:
+            Sort key, as accepted by ``pstats.Stats.sort_stats()``.
+        :param limit:
+            Maximum number of functions to list.
+        :returns:
+            A report string, or None if the route was not profiled.
+        """
+        with self._lock:
+            stats = self.get_stats(route_name)
+            if stats is None:
+                return None
+
+            stream = io.StringIO()
+            stats.stream = stream
+            stats.sort_stats(sort).print_stats(limit)
+
+        return stream.getvalue()
+
+    def dump_stats(self, dirname):
+        """Writes the merged statistics of each route to a directory.
+
+        Files are named after the routes, with a ``.prof`` extension, and can
+        be loaded with ``pstats`` or tools like snakeviz.
+
+        :param dirname:
+            An existing directory.
+        :returns:
+            A list of written file paths.
+        """
+        paths = []
+        with self._lock:
+            for route_name, entry in self.stats.items():
+                filename = _unsafe_filename_re.sub("_", route_name).strip("_")
+                path = os.path.join(dirname, (filename or "root") + ".prof")
+                entry[0].dump_stats(path)
+                paths.append(path)
+
+        return paths
+
+    def reset(self):
+        """Discards all collected statistics."""
+        with self._lock:
+            self.stats.clear()
+
+
+class ProfilerHandler(webapp2.RequestHandler):
+    """Shows the collected profiler statistics.
+
+    Without arguments it lists the profiled routes; with a ``route`` query
+    argument it shows the statistics for that route, sorted by the ``sort``
+    argument. Add it to the app routes::
+
+        webapp2.Route('/_profiler', profiler.ProfilerHandler)
+
+    Access is only allowed to requests that carry a valid debug token. To use
+    another authorization method, override :meth:`is_admin`.
+    """
+
+    def is_admin(self):
+        """Checks if the current request can see the statistics."""
+        prof = get_profiler(app=self.app)
+        return prof.is_valid_token(self.request.headers.get(prof.config["header_name"]))
+
+    def get(self):
+        if not self.is_admin():
+            self.abort(403)
+
+        prof = get_profiler(app=self.app)
+        self.response.content_type = "text/plain"
+        route_name = self.request.get("route")
+        if not route_name:
+            for name, count in sorted(prof.get_routes().items()):
+                self.response.write("%s\t%d\n" % (name, count))
+
+            return
+
+        report = prof.format_stats(
+            route_name, sort=self.request.get("sort", "cumulative")
+        )
+        if report is None:
+            self.abort(404)
+
+        self.response.write(report)
+
+
+# Factories -------------------------------------------------------------------
+
+
+#: Key used to store :class:`Profiler` in the app registry.
+_registry_key = "webapp2_extras.profiler.Profiler"
+
+
+def get_profiler(factory=Profiler, key=_registry_key, app=None):
+    """Returns an instance of :class:`Profiler` from the app registry.
+
+    It'll try to get it from the current app registry, and if it is not
+    registered it'll be instantiated and registered. A second call to this
+    function will return the same instance.
+
+    :param factory:
+        The callable used to build and register the instance if it is not yet
+        registered. The default is the class :class:`Profiler` itself.
+    :param key:
+        The key used to store the instance in the registry. A default is used
+        if it is not set.
+    :param app:
+        A :class:`webapp2.WSGIApplication` instance used to store the instance.
+        The active app is used if it is not set.
+    """
+    app = app or webapp2.get_app()
+    profiler = app.registry.get(key)
+    if not profiler:
+        profiler = app.registry[key] = factory(app)
+
+    return profiler
+
+
+def set_profiler(profiler, key=_registry_key, app=None):
+    """Sets an instance of :class:`Profiler` in the app registry.
+
+    :param profiler:
+        An instance of :class:`Profiler`.
+    :param key:
+        The key used to retrieve the instance from the registry. A default
+        is used if it is not set.
+    :param app:
+        A :class:`webapp2.WSGIApplication` instance used to retrieve the
+        instance. The active app is used if it is not set.
+    """
+    app = app or webapp2.get_app()
+    app.registry[key] = profiler
@@ -18,9 +18,11 @@ webapp2_extras.securecookie
 
 A serializer for signed cookies.
 """
+import base64
 import hashlib
 import hmac
 import logging
+import re
 import time
 
 from six.moves import http_cookies
@@ -28,6 +30,11 @@ from six.moves import http_cookies
 import webapp2
 from webapp2_extras import json, security
 
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
 
 class SecureCookieSerializer:
     """Serializes and deserializes secure cookie values.
@@ -42,7 +49,12 @@ class SecureCookieSerializer:
             A random string to be used as the HMAC secret for the cookie
             signature.
         """
+        assert not isinstance(
+            secret_key, KeyRing
+        ), "Key rings require FastSecureCookieSerializer."
         self.secret_key = webapp2._to_utf8(secret_key)
+        # Keys accepted when verifying signatures.
+        self._secret_keys = [self.secret_key]
 
     def serialize(self, name, value):
         """Serializes a signed cookie value.
@@ -73,6 +85,27 @@ class SecureCookieSerializer:
         :returns:
             The deserialized secure cookie, or None if it is not valid.
         """
+        rv = self.deserialize_with_timestamp(name, value)
+        if rv is None:
+            return None
+
+        if max_age is not None and self.is_expired(rv[1], max_age):
+            logging.warning("Expired cookie %r", value)
+            return None
+
+        return rv[0]
+
+    def deserialize_with_timestamp(self, name, value):
+        """Deserializes a signed cookie value, without checking its age.
+
+        :param name:
+            Cookie name.
+        :param value:
+            A cookie value to be deserialized.
+        :returns:
+            A tuple ``(value, timestamp)`` with the deserialized secure cookie
+            and the time it was serialized, or None if it is not valid.
+        """
         if not value:
             return None
 
@@ -86,23 +119,45 @@ class SecureCookieSerializer:
         if len(parts) != 3:
             return None
 
-        signature = self._get_signature(name, parts[0], parts[1])
-
-        if not security.compare_hashes(parts[2], signature):
+        for secret_key in self._secret_keys:
+            signature = self._get_signature(
+                name, parts[0], parts[1], secret_key=secret_key
+            )
+            if security.compare_hashes(parts[2], signature):
+                break
+        else:
             logging.warning("Invalid cookie signature %r", value)
             return None
 
-        if max_age is not None:
-            if int(parts[1]) < self._get_timestamp() - max_age:
-                logging.warning("Expired cookie %r", value)
-                return None
-
         try:
-            return self._decode(parts[0])
+            return self._decode(parts[0]), int(parts[1])
         except Exception:
             logging.warning("Cookie value failed to be decoded: %r", parts[0])
             return None
 
+    def is_expired(self, timestamp, max_age):
+        """Checks if a cookie timestamp is older than a maximum age.
+
+        :param timestamp:
+            A timestamp returned by :meth:`deserialize_with_timestamp`.
+        :param max_age:
+            Maximum age in seconds for a valid cookie.
+        :returns:
+            True if the cookie expired.
+        """
+        return timestamp < self._get_timestamp() - max_age
+
+    def needs_resign(self, value):
+        """Checks if a valid cookie value should be serialized again, because
+        it was signed with an old key or uses an old format.
+
+        :param value:
+            A cookie value accepted by :meth:`deserialize`.
+        :returns:
+            True if the value should be serialized again.
+        """
+        return False
+
     def _encode(self, value):
         return json.b64encode(value)
 
@@ -112,8 +167,241 @@ class SecureCookieSerializer:
     def _get_timestamp(self):
         return int(time.time())
 
-    def _get_signature(self, *parts):
+    def _get_signature(self, *parts, secret_key=None):
         """Generates an HMAC signature."""
-        signature = hmac.new(self.secret_key, digestmod=hashlib.sha1)
+        signature = hmac.new(secret_key or self.secret_key, digestmod=hashlib.sha1)
         signature.update(b"|".join(parts))
         return webapp2._to_utf8(signature.hexdigest())
+
+
+class KeyRing:
+    """A set of secret keys identified by key ids, to rotate secrets.
+
+    Values are signed with the current key, and its id is stored in the
+    serialized value, so the key used to verify a value is found without
+    trying each key::
+
+        key_ring = securecookie.KeyRing(
+            {'2024-06': 'my-new-secret', '2023-01': 'my-old-secret'}
+        )
+        serializer = securecookie.FastSecureCookieSerializer(key_ring)
+
+    To rotate secrets, add a new key and make it the current one. Remove
+    old keys when the values signed with them are no longer needed.
+    """
+
+    #: Validates key ids.
+    _key_id_re = re.compile(r"^[\w-]+$")
+
+    def __init__(self, keys, current=None):
+        """Initializes the key ring.
+
+        :param keys:
+            A dictionary or a sequence of tuples mapping key ids to secret
+            keys. Key ids can contain letters, digits, underscores and
+            hyphens.
+        :param current:
+            Id of the key used to sign new values. Default is the first key.
+        """
+        if isinstance(keys, dict):
+            keys = keys.items()
+
+        self.keys = {}
+        for key_id, secret_key in keys:
+            assert self._key_id_re.match(key_id), "Invalid key id %r." % key_id
+            self.keys[key_id] = webapp2._to_utf8(secret_key)
+
+        assert self.keys, "A key ring requires at least one key."
+        self.current = current if current is not None else next(iter(self.keys))
+        assert self.current in self.keys, "Unknown key id %r." % self.current
+
+    def __repr__(self):
+        return "<KeyRing(%r, current=%r)>" % (list(self.keys), self.current)
+
+
+class JSONCodec:
+    """Encodes cookie values as compact JSON."""
+
+    #: Identifies the codec in serialized values.
+    tag = b"j"
+
+    def __init__(self):
+        # A prepared encoder avoids building one for each call, which
+        # ``json.dumps()`` does when called with non-default arguments.
+        self._encoder = json._json.JSONEncoder(separators=(",", ":"))
+
+    def dumps(self, value):
+        return self._encoder.encode(value).encode("ascii")
+
+    def loads(self, data):
+        return json.decode(data)
+
+
+class MsgpackCodec:
+    """Encodes cookie values with MessagePack. Requires the ``msgpack``
+    package."""
+
+    #: Identifies the codec in serialized values.
+    tag = b"m"
+
+    def dumps(self, value):
+        return msgpack.packb(value, use_bin_type=True)
+
+    def loads(self, data):
+        return msgpack.unpackb(data, raw=False)
+
+
+#: Available codecs for :class:`FastSecureCookieSerializer`, by name.
+codecs = {"json": JSONCodec()}
+if msgpack is not None:
+    codecs["msgpack"] = MsgpackCodec()
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+
+def _b64decode(data):
+    return base64.urlsafe_b64decode(data + b"=" * (-len(data) % 4))
+
+
+class FastSecureCookieSerializer(SecureCookieSerializer):
+    """Serializes and deserializes secure cookie values in a compact format.
+
+    Values are encoded with a pluggable codec and signed with HMAC-SHA256.
+    The keyed HMAC state is prepared once and copied for each signature, and
+    both value and signature use URL-safe base64 without padding. A
+    serialized value has the form ``2<codec tag>|value|timestamp|signature``.
+
+    With a :class:`KeyRing`, the id of the signing key is added to the
+    first part, e.g. ``2j.key-id|...``, and selects the key used to verify
+    the signature.
+
+    Values in the format of :class:`SecureCookieSerializer` are still read
+    if `legacy` is True, so existing cookies remain valid while they are
+    replaced.
+    """
+
+    #: Identifies the format version in serialized values.
+    version = b"2"
+
+    def __init__(self, secret_key, codec="json", legacy=True):
+        """Initiliazes the serializer/deserializer.
+
+        :param secret_key:
+            A random string to be used as the HMAC secret for the cookie
+            signature, or a :class:`KeyRing`.
+        :param codec:
+            The codec used to encode values: a key from :data:`codecs`, or
+            an object with ``tag``, ``dumps()`` and ``loads()`` attributes.
+            Values encoded by any of the :data:`codecs` can be read.
+        :param legacy:
+            If True, values serialized by :class:`SecureCookieSerializer`
+            are also accepted. With a key ring, they are verified with each
+            of its keys.
+        """
+        if isinstance(secret_key, KeyRing):
+            keys = {k.encode("ascii"): v for k, v in secret_key.keys.items()}
+            key_id = secret_key.current.encode("ascii")
+        else:
+            keys = {b"": webapp2._to_utf8(secret_key)}
+            key_id = b""
+
+        super().__init__(keys[key_id])
+        self._secret_keys = list(keys.values())
+        if isinstance(codec, str):
+            codec = codecs[codec]
+
+        self.codec = codec
+        self.legacy = legacy
+        self._codec_header = self.version + codec.tag
+        self._header = self._codec_header + (b"." + key_id if key_id else b"")
+        self._codecs = {self.version + c.tag: c for c in codecs.values()}
+        self._codecs[self._codec_header] = codec
+        # Prepared HMAC states, by key id.
+        self._hmacs = {
+            k: hmac.new(v, digestmod=hashlib.sha256) for k, v in keys.items()
+        }
+        self._hmac = self._hmacs[key_id]
+
+    def serialize(self, name, value):
+        """Serializes a signed cookie value.
+
+        :param name:
+            Cookie name.
+        :param value:
+            Cookie value to be serialized.
+        :returns:
+            A serialized value ready to be stored in a cookie.
+        """
+        name = webapp2._to_utf8(name)
+        timestamp = str(self._get_timestamp()).encode("ascii")
+        value = _b64encode(self.codec.dumps(value))
+        signature = self._sign(name, self._header, value, timestamp)
+        return b"|".join([self._header, value, timestamp, signature])
+
+    def deserialize_with_timestamp(self, name, value):
+        """Deserializes a signed cookie value, without checking its age.
+
+        :param name:
+            Cookie name.
+        :param value:
+            A cookie value to be deserialized.
+        :returns:
+            A tuple ``(value, timestamp)`` with the deserialized secure cookie
+            and the time it was serialized, or None if it is not valid.
+        """
+        if not value:
+            return None
+
+        value = http_cookies._unquote(webapp2._to_utf8(value))
+        parts = value.split(b"|")
+        if len(parts) == 3 and self.legacy:
+            return super().deserialize_with_timestamp(name, value)
+
+        if len(parts) != 4:
+            return None
+
+        header, payload, timestamp, signature = parts
+        codec_header, _, key_id = header.partition(b".")
+        codec = self._codecs.get(codec_header)
+        if codec is None:
+            return None
+
+        prepared = self._hmacs.get(key_id)
+        if prepared is None:
+            logging.warning("Unknown cookie key id %r", value)
+            return None
+
+        name = webapp2._to_utf8(name)
+        if not hmac.compare_digest(
+            signature, self._sign(name, header, payload, timestamp, prepared=prepared)
+        ):
+            logging.warning("Invalid cookie signature %r", value)
+            return None
+
+        try:
+            return codec.loads(_b64decode(payload)), int(timestamp)
+        except Exception:
+            logging.warning("Cookie value failed to be decoded: %r", payload)
+            return None
+
+    def needs_resign(self, value):
+        """Checks if a valid cookie value should be serialized again, because
+        it was signed with a key other than the current one, or uses another
+        codec or the :class:`SecureCookieSerializer` format.
+
+        :param value:
+            A cookie value accepted by :meth:`deserialize`.
+        :returns:
+            True if the value should be serialized again.
+        """
+        value = http_cookies._unquote(webapp2._to_utf8(value))
+        return not value.startswith(self._header + b"|")
+
+    def _sign(self, *parts, prepared=None):
+        """Generates an HMAC signature from a prepared key state. The current
+        key is used if `prepared` is not set."""
+        signature = (prepared or self._hmac).copy()
+        signature.update(b"|".join(parts))
+        return _b64encode(signature.digest())
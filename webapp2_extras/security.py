@@ -20,9 +20,12 @@ Security related helpers such as secure password hashing tools and a
 random token generator.
 """
 
+import concurrent.futures
+import functools
 import hashlib
 import hmac
 import math
+import os
 import random
 import string
 
@@ -44,6 +47,14 @@ PUNCTUATION = string.punctuation
 
 long = int
 
+#: Default cost parameters of the slow password hashing methods: the number
+#: of iterations for ``pbkdf2_sha256``, and ``(n, r, p)`` for ``scrypt``. Use
+#: :func:`calibrate_password_method` to choose them for your hardware.
+PASSWORD_COSTS = {
+    "pbkdf2_sha256": (600000,),
+    "scrypt": (2**15, 8, 1),
+}
+
 
 def generate_random_string(length=0, entropy=0, pool=ALPHANUMERIC):
     """Generates a random string using the given sequence pool.
@@ -89,7 +100,10 @@ def generate_random_string(length=0, entropy=0, pool=ALPHANUMERIC):
     :returns:
         A string with characters randomly chosen from the pool.
     """
-    pool = list(set(pool))
+    if not isinstance(pool, str):
+        pool = "".join(pool)
+
+    pool, table, rejected = _prepare_pool(pool)
 
     if length and entropy:
         raise ValueError("Use length or entropy, not both.")
@@ -104,7 +118,40 @@ def generate_random_string(length=0, entropy=0, pool=ALPHANUMERIC):
         log_of_2 = 0.6931471805599453
         length = long(math.ceil((log_of_2 / math.log(len(pool))) * entropy))
 
-    return "".join(_rng.choice(pool) for _ in range(length))
+    if table is None:
+        return "".join(_rng.choice(pool) for _ in range(length))
+
+    # Draw random bytes in bulk and map them to the pool, discarding the
+    # bytes that would make some characters more likely than others.
+    chunks = []
+    missing = length
+    while missing > 0:
+        size = missing * 256 // (256 - len(rejected)) + 8
+        chunk = os.urandom(size).translate(table, rejected)[:missing]
+        chunks.append(chunk)
+        missing -= len(chunk)
+
+    return b"".join(chunks).decode("latin-1")
+
+
+@functools.lru_cache(maxsize=32)
+def _prepare_pool(pool):
+    """Returns the unique characters of a pool, and the arguments for
+    :meth:`bytes.translate` to map random bytes uniformly to them.
+
+    Byte ``b`` maps to character ``b % N``, where N is the pool size. Bytes
+    from the highest multiple of N up to 255 are rejected, so every
+    character is reached by the same number of byte values. The table is
+    None if the pool can't be mapped from bytes.
+    """
+    chars = "".join(sorted(set(pool)))
+    if not chars or len(chars) > 256 or max(chars) > "\xff":
+        return chars, None, None
+
+    limit = 256 - 256 % len(chars)
+    encoded = chars.encode("latin-1")
+    table = bytes(encoded[b % len(chars)] for b in range(256))
+    return chars, table, bytes(range(limit, 256))
 
 
 def generate_password_hash(password, method="sha1", length=22, pepper=None):
@@ -117,10 +164,17 @@ def generate_password_hash(password, method="sha1", length=22, pepper=None):
     to set the method to plain to enforce plaintext passwords. If a salt
     is used, hmac is used internally to salt the password.
 
+    The slow methods ``pbkdf2_sha256`` and ``scrypt`` can include their cost
+    parameters, e.g. ``'pbkdf2_sha256:600000'`` or ``'scrypt:32768:8:1'``.
+    Without them the defaults from :data:`PASSWORD_COSTS` are used. The
+    parameters are always stored in the hash, so it can be checked after
+    the defaults change.
+
     :param password:
         The password to hash.
     :param method:
-        The hash method to use (``'md5'`` or ``'sha1'``).
+        The hash method to use: ``'pbkdf2_sha256'``, ``'scrypt'``, a
+        ``hashlib`` method such as ``'md5'`` or ``'sha1'``, or ``'plain'``.
     :param length:
         Length of the salt to be created.
     :param pepper:
@@ -128,10 +182,11 @@ def generate_password_hash(password, method="sha1", length=22, pepper=None):
     :returns:
         A formatted hashed string that looks like this::
 
-            method$salt$hash
+            hash$method$salt
 
     This function was ported and adapted from `Werkzeug`_.
     """
+    method = _normalize_method(method)
     salt = method != "plain" and generate_random_string(length) or ""
     hashval = hash_password(password, method, salt, pepper)
     if hashval is None:
@@ -161,7 +216,8 @@ def check_password_hash(password, pwhash, pepper=None):
         return False
 
     hashval, method, salt = pwhash.split("$", 2)
-    return hash_password(password, method, salt, pepper) == hashval
+    rv = hash_password(password, method, salt, pepper)
+    return rv is not None and compare_hashes(rv, hashval)
 
 
 def hash_password(password, method, salt=None, pepper=None):
@@ -173,7 +229,9 @@ def hash_password(password, method, salt=None, pepper=None):
     :param password:
         The password to be hashed.
     :param method:
-        A method from ``hashlib``, e.g., `sha1` or `md5`, or `plain`.
+        A method from ``hashlib``, e.g., `sha1` or `md5`, `plain`, or a slow
+        method with optional cost parameters, e.g., `pbkdf2_sha256:600000`
+        or `scrypt:32768:8:1`.
     :param salt:
         A random salt string.
     :param pepper:
@@ -188,6 +246,34 @@ def hash_password(password, method, salt=None, pepper=None):
 
     password = webapp2._to_utf8(password)
 
+    name, costs = _parse_method(method)
+    if name in PASSWORD_COSTS:
+        if costs is None:
+            return None
+
+        if name == "scrypt":
+            n, r, p = costs
+            h = hashlib.scrypt(
+                password,
+                salt=webapp2._to_utf8(salt or ""),
+                n=n,
+                r=r,
+                p=p,
+                maxmem=128 * r * (n + p + 2),
+                dklen=32,
+            ).hex()
+        else:
+            h = hashlib.pbkdf2_hmac(
+                "sha256", password, webapp2._to_utf8(salt or ""), costs[0]
+            ).hex()
+
+        if pepper:
+            h = hmac.new(
+                webapp2._to_utf8(pepper), h.encode(), hashlib.sha256
+            ).hexdigest()
+
+        return h
+
     method = getattr(hashlib, method, None)
     if not method:
         return None
@@ -203,11 +289,158 @@ def hash_password(password, method, salt=None, pepper=None):
     return h.hexdigest()
 
 
+def _parse_method(method):
+    """Returns the name and the cost parameters of a hash method. The costs
+    are None if they are invalid."""
+    name, _, costs = method.partition(":")
+    if name not in PASSWORD_COSTS:
+        return method, ()
+
+    if not costs:
+        return name, PASSWORD_COSTS[name]
+
+    try:
+        costs = tuple(int(c) for c in costs.split(":"))
+    except ValueError:
+        return name, None
+
+    if len(costs) != len(PASSWORD_COSTS[name]) or min(costs) <= 0:
+        return name, None
+
+    return name, costs
+
+
+def _normalize_method(method):
+    """Returns a hash method including its cost parameters, if any."""
+    name, costs = _parse_method(method)
+    if not costs:
+        return method
+
+    return ":".join([name] + [str(c) for c in costs])
+
+
+def password_needs_rehash(pwhash, method):
+    """Checks if a password hash was generated with another method or cost
+    parameters than the given ones.
+
+    Use it after a password was checked, to hash it again with the current
+    settings::
+
+        if security.check_password_hash(password, user.password):
+            if security.password_needs_rehash(user.password, 'pbkdf2_sha256'):
+                user.password = security.generate_password_hash(
+                    password, 'pbkdf2_sha256')
+
+    :param pwhash:
+        A hashed string like returned by :func:`generate_password_hash`.
+    :param method:
+        The current hash method, as accepted by
+        :func:`generate_password_hash`.
+    :returns:
+        True if the password should be hashed again.
+    """
+    if pwhash.count("$") < 2:
+        return True
+
+    return pwhash.split("$", 2)[1] != _normalize_method(method)
+
+
+def calibrate_password_method(method="pbkdf2_sha256", target=0.25):
+    """Returns a hash method with cost parameters chosen so that hashing a
+    password takes about `target` seconds on the current machine.
+
+    For ``pbkdf2_sha256`` the number of iterations is scaled from a short
+    measurement. For ``scrypt`` the ``n`` parameter is doubled, with ``r=8``
+    and ``p=1``, until hashing takes at least half of `target`.
+
+    :param method:
+        ``'pbkdf2_sha256'`` or ``'scrypt'``.
+    :param target:
+        Desired duration of a hash, in seconds.
+    :returns:
+        A method string to use with :func:`generate_password_hash`.
+    """
+    timer = webapp2._timer
+    if method == "pbkdf2_sha256":
+        iterations = 10000
+        started = timer()
+        hash_password("password", "pbkdf2_sha256:%d" % iterations, "salt")
+        elapsed = max(timer() - started, 1e-6)
+        iterations = max(10000, int(iterations * target / elapsed) // 1000 * 1000)
+        return "pbkdf2_sha256:%d" % iterations
+
+    if method == "scrypt":
+        n = 2**12
+        while n < 2**24:
+            started = timer()
+            hash_password("password", "scrypt:%d:8:1" % n, "salt")
+            if timer() - started >= target / 2:
+                break
+
+            n *= 2
+
+        return "scrypt:%d:8:1" % n
+
+    raise ValueError(f"Can't calibrate method {method!r}.")
+
+
+class HashingPool:
+    """Runs password hashing in a bounded number of worker threads.
+
+    The ``pbkdf2_sha256`` and ``scrypt`` methods are slow on purpose. When
+    many logins arrive at once, checking them in a pool limits how many
+    CPUs they take from other requests. The request threads wait for the
+    result, while other threads keep running, as ``hashlib`` releases the
+    interpreter lock while hashing.
+    """
+
+    def __init__(self, max_workers=2):
+        """Initializes the pool.
+
+        :param max_workers:
+            Maximum number of passwords hashed at the same time.
+        """
+        self.max_workers = max_workers
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers, thread_name_prefix="webapp2-hashing"
+        )
+
+    def check_password_hash(self, password, pwhash, pepper=None, timeout=None):
+        """Like :func:`check_password_hash`, but runs in the pool.
+
+        :param timeout:
+            Maximum number of seconds to wait, or None.
+        :raises:
+            ``concurrent.futures.TimeoutError`` if the timeout expires.
+        """
+        future = self._executor.submit(check_password_hash, password, pwhash, pepper)
+        return future.result(timeout)
+
+    def generate_password_hash(
+        self, password, method="sha1", length=22, pepper=None, timeout=None
+    ):
+        """Like :func:`generate_password_hash`, but runs in the pool.
+
+        :param timeout:
+            Maximum number of seconds to wait, or None.
+        :raises:
+            ``concurrent.futures.TimeoutError`` if the timeout expires.
+        """
+        future = self._executor.submit(
+            generate_password_hash, password, method, length, pepper
+        )
+        return future.result(timeout)
+
+    def shutdown(self, wait=True):
+        """Stops the worker threads."""
+        self._executor.shutdown(wait)
+
+
 def compare_hashes(a, b):
     """Checks if two hash strings are identical.
 
-    The intention is to make the running time be less dependant on the size of
-    the string.
+    The comparison uses :func:`hmac.compare_digest`, so its running time
+    doesn't depend on how many leading characters match.
 
     :param a:
         String 1.
@@ -216,14 +449,11 @@ def compare_hashes(a, b):
     :returns:
         True if both strings are equal, False otherwise.
     """
-    if len(a) != len(b):
-        return False
-
-    result = 0
-    for x, y in zip(webapp2._to_basestring(a), webapp2._to_basestring(b)):
-        result |= ord(x) ^ ord(y)
-
-    return result == 0
+    try:
+        return hmac.compare_digest(a, b)
+    except TypeError:
+        # Mixed str and bytes, or non-ASCII strings.
+        return hmac.compare_digest(webapp2._to_utf8(a), webapp2._to_utf8(b))
 
 
 # Old names.
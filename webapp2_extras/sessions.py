@@ -18,17 +18,21 @@ webapp2_extras.sessions
 
 Lightweight but flexible session support for webapp2.
 """
+import functools
 import re
 
 import webapp2
-from webapp2_extras import securecookie, security
+from webapp2_extras import cache, securecookie, security
 
 #: Default configuration values for this module. Keys are:
 #:
 #: secret_key
 #:     Secret key to generate session cookies. Set this to something random
 #:     and unguessable. This is the only required configuration key:
-#:     an exception is raised if it is not defined.
+#:     an exception is raised if it is not defined. To rotate secrets, set
+#:     it to a :class:`webapp2_extras.securecookie.KeyRing` and use the
+#:     :class:`webapp2_extras.securecookie.FastSecureCookieSerializer`
+#:     serializer.
 #:
 #: cookie_name
 #:     Name of the cookie to save a session or session id. Default is
@@ -62,6 +66,35 @@ from webapp2_extras import securecookie, security
 #: backends
 #:     A dictionary of available session backend classes used by
 #:     :meth:`SessionStore.get_session`.
+#:
+#: serializer
+#:     Class used to sign and serialize cookies, or its import path. It is
+#:     instantiated with the secret key. Default is
+#:     :class:`webapp2_extras.securecookie.SecureCookieSerializer`. Set it to
+#:     :class:`webapp2_extras.securecookie.FastSecureCookieSerializer` to
+#:     use the faster format; cookies in the default format are still read.
+#:
+#: cookie_cache_size
+#:     Maximum number of verified cookie values kept in memory, shared by all
+#:     requests of the app. A cookie value found in the cache is not verified
+#:     and decoded again. Set to 0 to disable the cache. Default is 1000.
+#:
+#: resign_cookies
+#:     If True, sessions read from a cookie signed with an old key or format
+#:     are saved again when sessions are saved, even if they were not
+#:     modified, so they are signed with the current key. Default is True.
+#:
+#: sid_miss_cache_size
+#:     Maximum number of session ids remembered as not found by a custom
+#:     backend, shared by all requests of the app. A session id found in
+#:     this cache is not looked up in the backend again, so replayed cookies
+#:     of expired sessions don't hit the backend on every request. Set to 0
+#:     to disable the cache. Default is 10000. The ``hits`` counter of
+#:     ``SessionStore.sid_miss_cache`` is the number of lookups saved.
+#:
+#: sid_miss_cache_ttl
+#:     Number of seconds a session id is remembered as not found. Default
+#:     is 300.
 default_config = {
     "secret_key": None,
     "cookie_name": "session",
@@ -78,61 +111,231 @@ default_config = {
         "datastore": "webapp2_extras.appengine.sessions_ndb." "DatastoreSessionFactory",
         "memcache": "webapp2_extras.appengine.sessions_memcache."
         "MemcacheSessionFactory",
+        "memory": "webapp2_extras.sessions_memory.MemorySessionFactory",
+        "redis": "webapp2_extras.sessions_redis.RedisSessionFactory",
     },
+    "serializer": securecookie.SecureCookieSerializer,
+    "cookie_cache_size": 1000,
+    "resign_cookies": True,
+    "sid_miss_cache_size": 10000,
+    "sid_miss_cache_ttl": 300,
 }
 
 _default_value = object()
 
 
-class _UpdateDictMixin:
-    """Makes dicts call `self.on_update` on modifications.
+#: Types of values that can't be modified in place.
+_immutable_types = (str, bytes, int, float, bool, type(None))
+
 
-    From werkzeug.datastructures.
+def _copy_value(value):
+    """Copies the dicts and lists of a deserialized cookie value, so that
+    changes to it don't affect the cached value.
+    """
+    cls = type(value)
+    if cls is dict:
+        return {
+            k: v if type(v) in _immutable_types else _copy_value(v)
+            for k, v in value.items()
+        }
+    elif cls is list:
+        return [v if type(v) in _immutable_types else _copy_value(v) for v in value]
+
+    return value
+
+
+class _LazyDictMixin:
+    """Makes dicts call `self._load` before their data is first read."""
+
+    _loader = None
+
+    def loads_data(name):
+        method = getattr(dict, name)
+
+        def onaccess(self, *args, **kw):
+            if self._loader is not None:
+                self._load()
+            return method(self, *args, **kw)
+
+        onaccess.__name__ = name
+        return onaccess
+
+    __contains__ = loads_data("__contains__")
+    __getitem__ = loads_data("__getitem__")
+    __iter__ = loads_data("__iter__")
+    __len__ = loads_data("__len__")
+    __repr__ = loads_data("__repr__")
+    __eq__ = loads_data("__eq__")
+    __ne__ = loads_data("__ne__")
+    __reversed__ = loads_data("__reversed__")
+    __or__ = loads_data("__or__")
+    __ror__ = loads_data("__ror__")
+    copy = loads_data("copy")
+    get = loads_data("get")
+    items = loads_data("items")
+    keys = loads_data("keys")
+    values = loads_data("values")
+    del loads_data
+
+
+class SessionDict(_LazyDictMixin, dict):
+    """A dictionary for session data.
+
+    Changes are tracked per key: :attr:`changed` and :attr:`deleted` are the
+    keys set and removed since the session was loaded, so backends can store
+    only what changed. Setting a key to an immutable value (a string, number,
+    boolean or None) equal to the current one is not a change. Other values
+    and values returned by :meth:`setdefault` may be changed in place, so
+    their key is always considered changed.
+
+    If a `loader` is set, it is called to load the session data when it is
+    first accessed.
     """
 
-    on_update = None
+    __slots__ = ("container", "changed", "deleted", "_new", "_modified", "_loader")
 
-    def calls_update(name):
-        def oncall(self, *args, **kw):
-            rv = getattr(super(_UpdateDictMixin, self), name)(*args, **kw)
-            if self.on_update is not None:
-                self.on_update()
-            return rv
+    def __init__(self, container, data=None, new=False, loader=None):
+        """Initializes the session.
 
-        oncall.__name__ = name
-        return oncall
+        :param container:
+            The session factory that owns this session.
+        :param data:
+            A dictionary with the session data.
+        :param new:
+            True if this is a new session.
+        :param loader:
+            A callable that returns the session data, or None if the session
+            doesn't exist. If set, `data` and `new` are ignored.
+        """
+        self.container = container
+        self.changed = set()
+        self.deleted = set()
+        self._new = new
+        self._modified = False
+        self._loader = loader
+        if loader is None:
+            dict.update(self, data or ())
+
+    def _load(self):
+        loader, self._loader = self._loader, None
+        data = loader()
+        if data is None:
+            self._new = True
+        else:
+            dict.update(self, data)
+
+    @property
+    def loaded(self):
+        """True if the session data was loaded."""
+        return self._loader is None
+
+    @property
+    def new(self):
+        """True if this is a new session."""
+        if self._loader is not None:
+            self._load()
+
+        return self._new
+
+    @new.setter
+    def new(self, value):
+        self._new = value
+
+    @property
+    def modified(self):
+        """True if the session must be saved: keys were changed or deleted,
+        or it was explicitly set as modified."""
+        return self._modified or bool(self.changed) or bool(self.deleted)
+
+    @modified.setter
+    def modified(self, value):
+        self._modified = value
+        if not value:
+            self.changed.clear()
+            self.deleted.clear()
+
+    def get_changes(self):
+        """Returns the changes since the session was loaded.
 
-    __setitem__ = calls_update("__setitem__")
-    __delitem__ = calls_update("__delitem__")
-    clear = calls_update("clear")
-    pop = calls_update("pop")
-    popitem = calls_update("popitem")
-    setdefault = calls_update("setdefault")
-    update = calls_update("update")
-    del calls_update
+        :returns:
+            A tuple ``(changed, deleted)``: a dictionary with the keys set and
+            their values, and a set of deleted keys.
+        """
+        changed = {key: dict.__getitem__(self, key) for key in self.changed}
+        return changed, set(self.deleted)
 
+    def _set_changed(self, key):
+        self.changed.add(key)
+        self.deleted.discard(key)
 
-class SessionDict(_UpdateDictMixin, dict):
-    """A dictionary for session data."""
+    def _set_deleted(self, key):
+        self.changed.discard(key)
+        self.deleted.add(key)
 
-    __slots__ = ("container", "new", "modified")
+    def __setitem__(self, key, value):
+        if self._loader is not None:
+            self._load()
 
-    def __init__(self, container, data=None, new=False):
-        self.container = container
-        self.new = new
-        self.modified = False
-        dict.update(self, data or ())
+        if type(value) in _immutable_types and dict.__contains__(self, key):
+            # Mutable values are always stored, as they may change later.
+            current = dict.__getitem__(self, key)
+            if type(current) is type(value) and current == value:
+                return
+
+        dict.__setitem__(self, key, value)
+        self._set_changed(key)
+
+    def __delitem__(self, key):
+        if self._loader is not None:
+            self._load()
+
+        dict.__delitem__(self, key)
+        self._set_deleted(key)
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
 
     def pop(self, key, *args):
         # Only pop if key doesn't exist, do not alter the dictionary.
         if key in self:
-            return super().pop(key, *args)
+            self._set_deleted(key)
+            return dict.pop(self, key)
         if args:
             return args[0]
         raise KeyError(key)
 
-    def on_update(self):
-        self.modified = True
+    def popitem(self):
+        if self._loader is not None:
+            self._load()
+
+        key, value = dict.popitem(self)
+        self._set_deleted(key)
+        return key, value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+            return default
+
+        value = dict.__getitem__(self, key)
+        if type(value) not in _immutable_types:
+            self._set_changed(key)
+
+        return value
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def clear(self):
+        if self._loader is not None:
+            self._load()
+
+        for key in dict.keys(self):
+            self._set_deleted(key)
+
+        dict.clear(self)
 
     def get_flashes(self, key="_flash"):
         """Returns a flash message. Flash messages are deleted when first read.
@@ -179,9 +382,90 @@ class BaseSessionFactory:
         raise NotImplementedError()
 
     def save_session(self, response):
+        """Saves the session in a response object.
+
+        :param response:
+            A :class:`webapp2.Response` object.
+        """
+        batch = SessionBatch(self.session_store, response)
+        self.add_to_batch(batch)
+        batch.commit()
+
+    def add_to_batch(self, batch):
+        """Adds the pending writes of the session to a batch.
+
+        Factories that override :meth:`save_session`, including subclasses
+        of the built-in factories, are saved through it instead by
+        :meth:`SessionStore.save_sessions`.
+
+        :param batch:
+            A :class:`SessionBatch` instance.
+        """
         raise NotImplementedError()
 
 
+class SessionBatch:
+    """Pending session writes, saved together by
+    :meth:`SessionStore.save_sessions`.
+
+    Writes are grouped by writer, a callable that receives a list of items
+    and saves them in one operation, e.g. a single ``memcache.set_multi()``
+    call for all memcache sessions. Cookies are coalesced by name, so each
+    cookie is set only once in the response.
+    """
+
+    def __init__(self, session_store, response):
+        """Initializes the batch.
+
+        :param session_store:
+            A :class:`SessionStore` instance.
+        :param response:
+            A :class:`webapp2.Response` object.
+        """
+        self.session_store = session_store
+        self.response = response
+        self.writes = {}
+        self.cookies = {}
+
+    def add(self, writer, item):
+        """Adds a pending write.
+
+        :param writer:
+            A callable that saves a list of items.
+        :param item:
+            The item to be saved.
+        """
+        self.writes.setdefault(writer, []).append(item)
+
+    def set_secure_cookie(self, name, value, **kwargs):
+        """Sets a secure cookie to be saved, replacing one previously set with
+        the same name.
+
+        :param name:
+            Cookie name.
+        :param value:
+            Cookie value.
+        :param kwargs:
+            Options to save the cookie.
+        """
+        self.cookies[name] = (value, kwargs)
+
+    def commit(self):
+        """Calls each writer once with its items, then sets the cookies."""
+        writes, self.writes = self.writes, {}
+        for writer, items in writes.items():
+            writer(items)
+
+        cookies, self.cookies = self.cookies, {}
+        response = self.response
+        for name, (value, kwargs) in cookies.items():
+            if "Set-Cookie" in response.headers:
+                # Don't repeat a cookie set by a previous save.
+                response.unset_cookie(name, strict=False)
+
+            self.session_store.save_secure_cookie(response, name, value, **kwargs)
+
+
 class SecureCookieSessionFactory(BaseSessionFactory):
     """A session factory that stores data serialized in a signed cookie.
 
@@ -198,19 +482,24 @@ class SecureCookieSessionFactory(BaseSessionFactory):
 
     def get_session(self, max_age=_default_value):
         if self.session is None:
-            data = self.session_store.get_secure_cookie(self.name, max_age=max_age)
-            new = data is None
-            self.session = SessionDict(self, data=data, new=new)
+            self.session = SessionDict(
+                self, loader=functools.partial(self._load_session, max_age)
+            )
 
         return self.session
 
-    def save_session(self, response):
+    def _load_session(self, max_age):
+        data = self.session_store.get_secure_cookie(self.name, max_age=max_age)
+        if data is not None and self.session_store.needs_resign(self.name):
+            self.session.modified = True
+
+        return data
+
+    def add_to_batch(self, batch):
         if self.session is None or not self.session.modified:
             return
 
-        self.session_store.save_secure_cookie(
-            response, self.name, dict(self.session), **self.session_args
-        )
+        batch.set_secure_cookie(self.name, dict(self.session), **self.session_args)
 
 
 class CustomBackendSessionFactory(BaseSessionFactory):
@@ -224,12 +513,32 @@ class CustomBackendSessionFactory(BaseSessionFactory):
 
     def get_session(self, max_age=_default_value):
         if self.session is None:
-            data = self.session_store.get_secure_cookie(self.name, max_age=max_age)
-            sid = data.get("_sid") if data else None
-            self.session = self._get_by_sid(sid)
+            self.session = SessionDict(
+                self, loader=functools.partial(self._load_session, max_age)
+            )
 
         return self.session
 
+    def _load_session(self, max_age):
+        data = self.session_store.get_secure_cookie(self.name, max_age=max_age)
+        sid = data.get("_sid") if data else None
+        misses = self.session_store.sid_miss_cache
+        if sid is not None and misses.get((self.__class__, sid)):
+            # Recently not found: don't look it up in the backend again.
+            sid = None
+
+        session = self._get_by_sid(sid)
+        if session.new:
+            if sid is not None and self._is_valid_sid(sid):
+                misses.set((self.__class__, sid), True)
+
+            return None
+
+        if self.session_store.needs_resign(self.name):
+            self.session.modified = True
+
+        return session
+
     def _get_by_sid(self, sid):
         raise NotImplementedError()
 
@@ -238,7 +547,9 @@ class CustomBackendSessionFactory(BaseSessionFactory):
         return sid and self._sid_re.match(sid) is not None
 
     def _get_new_sid(self):
-        return security.generate_random_string(entropy=128)
+        sid = security.generate_random_string(entropy=128)
+        self.session_store.sid_miss_cache.pop((self.__class__, sid))
+        return sid
 
 
 class SessionStore:
@@ -321,8 +632,49 @@ class SessionStore:
 
     @webapp2.cached_property
     def serializer(self):
-        # Serializer and deserializer for signed cookies.
-        return securecookie.SecureCookieSerializer(self.config["secret_key"])
+        # Serializer and deserializer for signed cookies. It is shared by all
+        # requests of the app, as it may prepare state for the secret key.
+        return self._get_shared(_serializer_registry_key, self._make_serializer)
+
+    @webapp2.cached_property
+    def cookie_cache(self):
+        # Verified cookie values, shared by all requests of the app.
+        return self._get_shared(
+            _cookie_cache_registry_key,
+            lambda: cache.LRUCache(self.config["cookie_cache_size"]),
+        )
+
+    @webapp2.cached_property
+    def sid_miss_cache(self):
+        # Session ids recently not found by custom backends, shared by all
+        # requests of the app. Its hits count the backend lookups saved.
+        return self._get_shared(
+            _sid_miss_cache_registry_key,
+            lambda: cache.TTLCache(
+                self.config["sid_miss_cache_size"], self.config["sid_miss_cache_ttl"]
+            ),
+        )
+
+    def _get_serializer_class(self):
+        factory = self.config["serializer"]
+        if isinstance(factory, str):
+            factory = self.config["serializer"] = webapp2.import_string(factory)
+
+        return factory
+
+    def _make_serializer(self):
+        return self._get_serializer_class()(self.config["secret_key"])
+
+    def _get_shared(self, prefix, factory):
+        """Returns an object stored in the app registry for the current
+        serializer and secret key, building it if needed."""
+        registry = self.request.app.registry
+        key = (prefix, self._get_serializer_class(), self.config["secret_key"])
+        obj = registry.get(key)
+        if obj is None:
+            obj = registry[key] = factory()
+
+        return obj
 
     def get_backend(self, name):
         """Returns a configured session backend, importing it if needed.
@@ -371,6 +723,8 @@ class SessionStore:
               backend.
             - ``datastore``: uses App Engine's datastore.
             - ``memcache``:  uses App Engine's memcache.
+            - ``memory``: uses the memory of the current process.
+            - ``redis``: uses a Redis server.
         :returns:
             A dictionary-like session object.
         """
@@ -400,8 +754,39 @@ class SessionStore:
             max_age = self.config["session_max_age"]
 
         value = self.request.cookies.get(name)
-        if value:
-            return self.serializer.deserialize(name, value, max_age=max_age)
+        if not value:
+            return None
+
+        cache_key = (name, value)
+        rv = self.cookie_cache.get(cache_key)
+        if rv is None:
+            rv = self.serializer.deserialize_with_timestamp(name, value)
+            if rv is None:
+                return None
+
+            self.cookie_cache.set(cache_key, rv)
+
+        data, timestamp = rv
+        if max_age is not None and self.serializer.is_expired(timestamp, max_age):
+            return None
+
+        return _copy_value(data)
+
+    def needs_resign(self, name):
+        """Checks if a secure cookie should be saved again because it was
+        signed with an old key or format. Always False if the
+        ``resign_cookies`` configuration is disabled.
+
+        :param name:
+            Cookie name.
+        :returns:
+            True if the cookie should be saved again.
+        """
+        if not self.config["resign_cookies"]:
+            return False
+
+        value = self.request.cookies.get(name)
+        return bool(value) and self.serializer.needs_resign(value)
 
     def set_secure_cookie(self, name, value, **kwargs):
         """Sets a secure cookie to be saved.
@@ -426,8 +811,17 @@ class SessionStore:
         :param response:
             A :class:`webapp.Response` object.
         """
-        for session in self.sessions.values():
-            session.save_session(response)
+        with webapp2._time_phase(self.request, "sessions"):
+            batch = SessionBatch(self, response)
+            for session in self.sessions.values():
+                if type(session).save_session is BaseSessionFactory.save_session:
+                    session.add_to_batch(batch)
+                else:
+                    # Factories that override save_session() are saved
+                    # through it.
+                    session.save_session(response)
+
+            batch.commit()
 
     def save_secure_cookie(self, response, name, value, **kwargs):
         value = self.serializer.serialize(name, value)
@@ -440,6 +834,16 @@ class SessionStore:
 #: Key used to store :class:`SessionStore` in the request registry.
 _registry_key = "webapp2_extras.sessions.SessionStore"
 
+#: Key prefix used to store cookie serializers in the app registry.
+_serializer_registry_key = "webapp2_extras.sessions.serializer"
+
+#: Key prefix used to store verified cookie values in the app registry.
+_cookie_cache_registry_key = "webapp2_extras.sessions.cookie_cache"
+
+#: Key prefix used to store session ids not found by backends in the app
+#: registry.
+_sid_miss_cache_registry_key = "webapp2_extras.sessions.sid_miss_cache"
+
 
 def get_store(factory=SessionStore, key=_registry_key, request=None):
     """Returns an instance of :class:`SessionStore` from the request registry.
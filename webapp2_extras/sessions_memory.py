@@ -0,0 +1,266 @@
+# Copyright 2011 webapp2 AUTHORS.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+webapp2_extras.sessions_memory
+==============================
+
+Extended sessions stored in the memory of the current process.
+"""
+import math
+import pickle
+import threading
+import time
+
+import webapp2
+from webapp2_extras import sessions
+
+#: Default configuration values for this module. Keys are:
+#:
+#: shards
+#:     Number of independently locked partitions of the store. More shards
+#:     reduce lock contention between request threads. Default is 16.
+#:
+#: max_entries
+#:     Maximum number of stored sessions. When a shard is full, its least
+#:     recently saved sessions are discarded. None means no limit. Default
+#:     is 10000.
+#:
+#: purge_interval
+#:     Minimum number of seconds between automatic purges of expired
+#:     sessions, done while saving sessions. Default is 60.
+default_config = {
+    "shards": 16,
+    "max_entries": 10000,
+    "purge_interval": 60,
+}
+
+
+class MemoryStore:
+    """A thread-safe store for session data, partitioned in shards.
+
+    Values are pickled when stored, so sessions can't change each other's
+    data, like with an external store. Data is lost when the process exits,
+    so this is meant for single process deployments and tests.
+
+    Memory is bounded: expired values are purged periodically when values
+    are stored, and each shard keeps at most its part of ``max_entries``.
+    """
+
+    #: Configuration key.
+    config_key = __name__
+
+    #: Loaded configuration.
+    config = None
+
+    def __init__(self, app, config=None):
+        """Initializes the store.
+
+        :param app:
+            A :class:`webapp2.WSGIApplication` instance.
+        :param config:
+            A dictionary of configuration values to be overridden. See
+            the available keys in :data:`default_config`.
+        """
+        self.config = app.config.load_config(
+            self.config_key,
+            default_values=default_config,
+            user_values=config,
+            required_keys=None,
+        )
+        shards = self.config["shards"]
+        self._shards = [({}, threading.Lock()) for _ in range(shards)]
+        max_entries = self.config["max_entries"]
+        self._shard_size = (
+            math.ceil(max_entries / shards) if max_entries is not None else None
+        )
+        self._next_purge = time.time() + self.config["purge_interval"]
+
+    def _get_shard(self, key):
+        return self._shards[hash(key) % len(self._shards)]
+
+    def get(self, key):
+        """Returns a stored value.
+
+        :param key:
+            The value key.
+        :returns:
+            The value, or None if it doesn't exist or expired.
+        """
+        data, lock = self._get_shard(key)
+        with lock:
+            entry = data.get(key)
+            if entry is None:
+                return None
+
+            value, expires = entry
+            if expires is not None and expires <= time.time():
+                del data[key]
+                return None
+
+        return pickle.loads(value)
+
+    def set_multi(self, items):
+        """Stores values.
+
+        :param items:
+            A list of tuples ``(key, value, ttl)``, where `ttl` is the time
+            to live in seconds, or None if the value doesn't expire.
+        """
+        now = time.time()
+        if now >= self._next_purge:
+            self._next_purge = now + self.config["purge_interval"]
+            self.purge()
+
+        for key, value, ttl in items:
+            entry = (
+                pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+                now + ttl if ttl is not None else None,
+            )
+            data, lock = self._get_shard(key)
+            with lock:
+                # Keep the shard ordered by save time.
+                data.pop(key, None)
+                data[key] = entry
+                if self._shard_size is not None:
+                    while len(data) > self._shard_size:
+                        del data[next(iter(data))]
+
+    def delete(self, key):
+        """Removes a value.
+
+        :param key:
+            The value key.
+        """
+        data, lock = self._get_shard(key)
+        with lock:
+            data.pop(key, None)
+
+    def purge(self):
+        """Removes expired values.
+
+        :returns:
+            The number of removed values.
+        """
+        now = time.time()
+        count = 0
+        for data, lock in self._shards:
+            with lock:
+                expired = [
+                    k for k, (_, exp) in data.items() if exp is not None and exp <= now
+                ]
+                for key in expired:
+                    del data[key]
+
+                count += len(expired)
+
+        return count
+
+    def clear(self):
+        """Removes all values."""
+        for data, lock in self._shards:
+            with lock:
+                data.clear()
+
+    def __len__(self):
+        return sum(len(data) for data, _ in self._shards)
+
+
+class MemorySessionFactory(sessions.CustomBackendSessionFactory):
+    """A session factory that stores data in the memory of the current
+    process, using the app :class:`MemoryStore`.
+
+    To use memory sessions, pass this class as the `factory` keyword to
+    :meth:`webapp2_extras.sessions.SessionStore.get_session`, or use the
+    ``memory`` backend::
+
+        session = self.session_store.get_session(
+            name='mem_session', backend='memory')
+
+    Sessions expire after the ``session_max_age`` configured for
+    :mod:`webapp2_extras.sessions`, if it is set.
+    """
+
+    @webapp2.cached_property
+    def store(self):
+        return get_store(app=self.session_store.request.app)
+
+    def _get_by_sid(self, sid):
+        """Returns a session given a session id."""
+        if self._is_valid_sid(sid):
+            data = self.store.get(sid)
+            if data is not None:
+                self.sid = sid
+                return sessions.SessionDict(self, data=data)
+
+        self.sid = self._get_new_sid()
+        return sessions.SessionDict(self, new=True)
+
+    def add_to_batch(self, batch):
+        if self.session is None or not self.session.modified:
+            return
+
+        # Reading the data loads the session, which sets the sid.
+        data = dict(self.session)
+        ttl = self.session_store.config["session_max_age"]
+        batch.add(self.store.set_multi, (self.sid, data, ttl))
+        batch.set_secure_cookie(self.name, {"_sid": self.sid}, **self.session_args)
+
+
+# Factories -------------------------------------------------------------------
+
+
+#: Key used to store :class:`MemoryStore` in the app registry.
+_registry_key = "webapp2_extras.sessions_memory.MemoryStore"
+
+
+def get_store(factory=MemoryStore, key=_registry_key, app=None):
+    """Returns an instance of :class:`MemoryStore` from the app registry.
+
+    It'll try to get it from the current app registry, and if it is not
+    registered it'll be instantiated and registered. A second call to this
+    function will return the same instance.
+
+    :param factory:
+        The callable used to build and register the instance if it is not yet
+        registered. The default is the class :class:`MemoryStore` itself.
+    :param key:
+        The key used to store the instance in the registry. A default is used
+        if it is not set.
+    :param app:
+        A :class:`webapp2.WSGIApplication` instance used to store the instance.
+        The active app is used if it is not set.
+    """
+    app = app or webapp2.get_app()
+    store = app.registry.get(key)
+    if store is None:
+        store = app.registry[key] = factory(app)
+
+    return store
+
+
+def set_store(store, key=_registry_key, app=None):
+    """Sets an instance of :class:`MemoryStore` in the app registry.
+
+    :param store:
+        An instance of :class:`MemoryStore`.
+    :param key:
+        The key used to retrieve the instance from the registry. A default
+        is used if it is not set.
+    :param app:
+        A :class:`webapp2.WSGIApplication` instance used to retrieve the
+        instance. The active app is used if it is not set.
+    """
+    app = app or webapp2.get_app()
+    app.registry[key] = store
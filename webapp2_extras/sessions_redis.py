@@ -0,0 +1,386 @@
+# Copyright 2011 webapp2 AUTHORS.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+webapp2_extras.sessions_redis
+=============================
+
+Extended sessions stored in Redis, or any server that speaks the Redis
+protocol. Includes a small client, so no extra package is required.
+"""
+import socket
+import threading
+
+import webapp2
+from webapp2_extras import json, sessions
+
+#: Default configuration values for this module. Keys are:
+#:
+#: host
+#:     Server host name. Default is ``localhost``.
+#:
+#: port
+#:     Server port. Default is 6379.
+#:
+#: db
+#:     Database number. Default is 0.
+#:
+#: password
+#:     Password to authenticate with, or None. Default is None.
+#:
+#: key_prefix
+#:     Prefix added to session ids to build keys. Default is
+#:     ``webapp2_session:``.
+#:
+#: max_connections
+#:     Maximum number of idle connections kept in the pool. Default is 10.
+#:
+#: socket_timeout
+#:     Timeout in seconds for socket operations. Default is 5.
+default_config = {
+    "host": "localhost",
+    "port": 6379,
+    "db": 0,
+    "password": None,
+    "key_prefix": "webapp2_session:",
+    "max_connections": 10,
+    "socket_timeout": 5,
+}
+
+
+class RedisError(Exception):
+    """An error returned by the server."""
+
+
+class Connection:
+    """A connection to a server using the Redis protocol."""
+
+    def __init__(self, host, port, timeout=None):
+        """Opens the connection.
+
+        :param host:
+            Server host name.
+        :param port:
+            Server port.
+        :param timeout:
+            Timeout in seconds for socket operations.
+        """
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.sock.makefile("rb")
+
+    def send(self, commands):
+        """Sends commands without waiting for their replies.
+
+        :param commands:
+            A list of commands, each a sequence of arguments.
+        """
+        buf = []
+        for args in commands:
+            buf.append(b"*%d\r\n" % len(args))
+            for arg in args:
+                if not isinstance(arg, bytes):
+                    arg = str(arg).encode("utf-8")
+
+                buf.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+
+        self.sock.sendall(b"".join(buf))
+
+    def read_reply(self):
+        """Reads one reply.
+
+        :returns:
+            The reply value. Errors are returned as :class:`RedisError`
+            instances, so that all replies of a pipeline can be read.
+        """
+        line = self.reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("Connection closed by the server.")
+
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode("utf-8")
+        elif kind == b"-":
+            return RedisError(rest.decode("utf-8"))
+        elif kind == b":":
+            return int(rest)
+        elif kind == b"$":
+            size = int(rest)
+            if size < 0:
+                return None
+
+            data = self.reader.read(size + 2)
+            if len(data) != size + 2:
+                raise ConnectionError("Connection closed by the server.")
+
+            return data[:-2]
+        elif kind == b"*":
+            size = int(rest)
+            if size < 0:
+                return None
+
+            return [self.read_reply() for _ in range(size)]
+
+        raise RedisError("Invalid reply: %r" % line)
+
+    def close(self):
+        """Closes the connection."""
+        try:
+            self.reader.close()
+            self.sock.close()
+        except OSError:  # pragma: no cover
+            pass
+
+
+class RedisClient:
+    """A minimal Redis client with a connection pool and pipelining.
+
+    It is safe to share an instance between request threads: each command
+    or pipeline uses a connection taken from the pool.
+    """
+
+    #: Configuration key.
+    config_key = __name__
+
+    #: Loaded configuration.
+    config = None
+
+    def __init__(self, app, config=None):
+        """Initializes the client. Connections are opened when needed.
+
+        :param app:
+            A :class:`webapp2.WSGIApplication` instance.
+        :param config:
+            A dictionary of configuration values to be overridden. See
+            the available keys in :data:`default_config`.
+        """
+        self.config = app.config.load_config(
+            self.config_key,
+            default_values=default_config,
+            user_values=config,
+            required_keys=None,
+        )
+        self._pool = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        config = self.config
+        conn = Connection(config["host"], config["port"], config["socket_timeout"])
+        setup = []
+        if config["password"] is not None:
+            setup.append(("AUTH", config["password"]))
+
+        if config["db"]:
+            setup.append(("SELECT", config["db"]))
+
+        if setup:
+            conn.send(setup)
+            for reply in [conn.read_reply() for _ in setup]:
+                if isinstance(reply, RedisError):
+                    conn.close()
+                    raise reply
+
+        return conn
+
+    def _get_connection(self):
+        """Returns a tuple ``(connection, pooled)``, where `pooled` is True
+        if the connection was taken from the pool."""
+        with self._lock:
+            if self._pool:
+                return self._pool.pop(), True
+
+        return self._connect(), False
+
+    def _release(self, conn):
+        with self._lock:
+            if len(self._pool) < self.config["max_connections"]:
+                self._pool.append(conn)
+                return
+
+        conn.close()
+
+    def pipeline(self, commands):
+        """Sends several commands in one round trip.
+
+        :param commands:
+            A list of commands, each a sequence of arguments, e.g.
+            ``[('GET', 'foo'), ('SET', 'bar', 'baz')]``.
+        :returns:
+            A list with the reply of each command.
+        :raises:
+            :class:`RedisError` if a command failed, after all replies were
+            read.
+        """
+        if not commands:
+            return []
+
+        conn, pooled = self._get_connection()
+        try:
+            replies = self._send(conn, commands)
+        except OSError as e:
+            if not pooled or isinstance(e, TimeoutError):
+                raise
+
+            # The server closed the idle connection, e.g. after its timeout
+            # or a restart: retry once with a new one.
+            conn = self._connect()
+            replies = self._send(conn, commands)
+
+        self._release(conn)
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+
+        return replies
+
+    def _send(self, conn, commands):
+        """Sends commands and reads their replies. The connection is closed
+        if it fails."""
+        try:
+            conn.send(commands)
+            return [conn.read_reply() for _ in commands]
+        except Exception:
+            # The connection state is unknown.
+            conn.close()
+            raise
+
+    def execute(self, *args):
+        """Sends a command and returns its reply.
+
+        :param args:
+            The command arguments, e.g. ``('GET', 'foo')``.
+        """
+        return self.pipeline([args])[0]
+
+    def get(self, key):
+        """Returns the value of a key, or None."""
+        return self.execute("GET", key)
+
+    def set_multi(self, items):
+        """Sets several keys in one round trip.
+
+        :param items:
+            A list of tuples ``(key, value, ttl)``, where `ttl` is the time
+            to live in seconds, or None if the key doesn't expire.
+        """
+        self.pipeline(
+            [
+                ("SET", key, value) if ttl is None else ("SETEX", key, ttl, value)
+                for key, value, ttl in items
+            ]
+        )
+
+    def delete(self, *keys):
+        """Removes keys and returns the number of removed keys."""
+        return self.execute("DEL", *keys)
+
+    def close(self):
+        """Closes the pooled connections."""
+        with self._lock:
+            pool, self._pool = self._pool, []
+
+        for conn in pool:
+            conn.close()
+
+
+class RedisSessionFactory(sessions.CustomBackendSessionFactory):
+    """A session factory that stores data in Redis, using the app
+    :class:`RedisClient`.
+
+    To use Redis sessions, pass this class as the `factory` keyword to
+    :meth:`webapp2_extras.sessions.SessionStore.get_session`, or use the
+    ``redis`` backend::
+
+        session = self.session_store.get_session(
+            name='redis_session', backend='redis')
+
+    Session data is stored as JSON. Keys expire after the
+    ``session_max_age`` configured for :mod:`webapp2_extras.sessions`, if it
+    is set. All Redis sessions of a request are saved in a single pipeline.
+    """
+
+    @webapp2.cached_property
+    def client(self):
+        return get_client(app=self.session_store.request.app)
+
+    def _get_key(self, sid):
+        return self.client.config["key_prefix"] + sid
+
+    def _get_by_sid(self, sid):
+        """Returns a session given a session id."""
+        if self._is_valid_sid(sid):
+            data = self.client.get(self._get_key(sid))
+            if data is not None:
+                self.sid = sid
+                return sessions.SessionDict(self, data=json.decode(data))
+
+        self.sid = self._get_new_sid()
+        return sessions.SessionDict(self, new=True)
+
+    def add_to_batch(self, batch):
+        if self.session is None or not self.session.modified:
+            return
+
+        ttl = self.session_store.config["session_max_age"]
+        data = json.encode(dict(self.session))
+        batch.add(self.client.set_multi, (self._get_key(self.sid), data, ttl))
+        batch.set_secure_cookie(self.name, {"_sid": self.sid}, **self.session_args)
+
+
+# Factories -------------------------------------------------------------------
+
+
+#: Key used to store :class:`RedisClient` in the app registry.
+_registry_key = "webapp2_extras.sessions_redis.RedisClient"
+
+
+def get_client(factory=RedisClient, key=_registry_key, app=None):
+    """Returns an instance of :class:`RedisClient` from the app registry.
+
+    It'll try to get it from the current app registry, and if it is not
+    registered it'll be instantiated and registered. A second call to this
+    function will return the same instance.
+
+    :param factory:
+        The callable used to build and register the instance if it is not yet
+        registered. The default is the class :class:`RedisClient` itself.
+    :param key:
+        The key used to store the instance in the registry. A default is used
+        if it is not set.
+    :param app:
+        A :class:`webapp2.WSGIApplication` instance used to store the instance.
+        The active app is used if it is not set.
+    """
+    app = app or webapp2.get_app()
+    client = app.registry.get(key)
+    if client is None:
+        client = app.registry[key] = factory(app)
+
+    return client
+
+
+def set_client(client, key=_registry_key, app=None):
+    """Sets an instance of :class:`RedisClient` in the app registry.
+
+    :param client:
+        An instance of :class:`RedisClient`.
+    :param key:
+        The key used to retrieve the instance from the registry. A default
+        is used if it is not set.
+    :param app:
+        A :class:`webapp2.WSGIApplication` instance used to retrieve the
+        instance. The active app is used if it is not set.
+    """
+    app = app or webapp2.get_app()
+    app.registry[key] = client
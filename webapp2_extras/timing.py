@@ -0,0 +1,273 @@
+# Copyright 2011 webapp2 AUTHORS.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+webapp2_extras.timing
+=====================
+
+Per-request phase timings for webapp2, aggregated per route.
+"""
+import bisect
+import threading
+
+import webapp2
+
+#: Default configuration values for this module. Keys are:
+#:
+#: server_timing
+#:     If True, adds a ``Server-Timing`` header with the phase durations to
+#:     all responses. If None, the header is only added in debug mode.
+#:     Default is None.
+#:
+#: buckets
+#:     Upper bounds, in seconds, of the histogram buckets used to aggregate
+#:     phase durations. Durations above the last bound are counted in an
+#:     extra overflow bucket.
+default_config = {
+    "server_timing": None,
+    "buckets": [
+        0.001,
+        0.0025,
+        0.005,
+        0.01,
+        0.025,
+        0.05,
+        0.1,
+        0.25,
+        0.5,
+        1.0,
+        2.5,
+        5.0,
+        10.0,
+    ],
+}
+
+#: Key used to store the phase timings in the request registry.
+_timings_key = "webapp2_extras.timing.timings"
+
+
+def get_route_name(request):
+    """Returns the name used to aggregate timings for a request.
+
+    :param request:
+        A :class:`webapp2.Request` instance.
+    :returns:
+        The matched route name, the route template if the route has no name,
+        or ``'<unmatched>'`` if no route matched.
+    """
+    route = request.route
+    if route is None:
+        return "<unmatched>"
+
+    return route.name or route.template
+
+
+class TimingRecorder:
+    """Records request phase timings using :meth:`webapp2.WSGIApplication.add_hook`.
+
+    Durations of each phase are collected during the request and, when it
+    finishes, added to histograms keyed by route name and phase. Instantiate
+    it once for an app, preferably through :func:`get_recorder`::
+
+        from webapp2_extras import timing
+
+        app = webapp2.WSGIApplication(routes, debug=True)
+        recorder = timing.get_recorder(app=app)
+
+        # Later, e.g. in an admin handler:
+        data = recorder.snapshot()
+    """
+
+    #: Configuration key.
+    config_key = __name__
+
+    #: Loaded configuration.
+    config = None
+
+    def __init__(self, app, config=None):
+        """Initializes the recorder and registers its hooks.
+
+        :param app:
+            A :class:`webapp2.WSGIApplication` instance.
+        :param config:
+            A dictionary of configuration values to be overridden. See
+            the available keys in :data:`default_config`.
+        """
+        self.app = app
+        self.config = config = app.config.load_config(
+            self.config_key,
+            default_values=default_config,
+            user_values=config,
+            required_keys=None,
+        )
+        self.buckets = sorted(config["buckets"])
+        self.server_timing = config["server_timing"]
+        if self.server_timing is None:
+            self.server_timing = app.debug
+
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self.install()
+
+    def install(self):
+        """Registers the recorder hooks in the app."""
+        self.app.add_hook("phase", self.on_phase)
+        self.app.add_hook("before_response", self.on_before_response)
+        self.app.add_hook("request_finished", self.on_request_finished)
+
+    def uninstall(self):
+        """Unregisters the recorder hooks from the app."""
+        self.app.remove_hook("phase", self.on_phase)
+        self.app.remove_hook("before_response", self.on_before_response)
+        self.app.remove_hook("request_finished", self.on_request_finished)
+
+    def on_phase(self, request, name, duration):
+        """Stores a phase duration in the request registry."""
+        timings = request.registry.get(_timings_key)
+        if timings is None:
+            timings = request.registry[_timings_key] = []
+
+        timings.append((name, duration))
+
+    def on_before_response(self, request, response):
+        """Adds the ``Server-Timing`` header, if enabled."""
+        if not self.server_timing:
+            return
+
+        timings = self.get_timings(request)
+        if timings:
+            response.headers["Server-Timing"] = ", ".join(
+                "%s;dur=%.3f" % (name, duration * 1000)
+                for name, duration in timings.items()
+            )
+
+    def on_request_finished(self, request, response):
+        """Adds the request timings to the histograms."""
+        timings = self.get_timings(request)
+        if not timings:
+            return
+
+        route_name = get_route_name(request)
+        buckets = self.buckets
+        with self._lock:
+            for name, duration in timings.items():
+                key = (route_name, name)
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    # Bucket counts, plus the overflow bucket, count and sum.
+                    histogram = self._histograms[key] = [0] * (len(buckets) + 3)
+
+                histogram[bisect.bisect_left(buckets, duration)] += 1
+                histogram[-2] += 1
+                histogram[-1] += duration
+
+    def get_timings(self, request):
+        """Returns the phase durations recorded so far for a request.
+
+        :param request:
+            A :class:`webapp2.Request` instance.
+        :returns:
+            A dictionary mapping phase names to total durations in seconds.
+            Phases that happen more than once, e.g. rendering several
+            templates, are added up.
+        """
+        rv = {}
+        for name, duration in request.registry.get(_timings_key, ()):
+            rv[name] = rv.get(name, 0.0) + duration
+
+        return rv
+
+    def snapshot(self, reset=False):
+        """Returns the aggregated histograms.
+
+        :param reset:
+            If True, clears the histograms after taking the snapshot.
+        :returns:
+            A dictionary ``{route_name: {phase: histogram}}``. Each histogram
+            is a dictionary with the keys ``count``, ``sum`` (in seconds) and
+            ``buckets``, a list of ``[upper_bound, cumulative_count]`` pairs
+            where the last bound is ``'+Inf'``. The result can be serialized
+            to JSON.
+        """
+        with self._lock:
+            histograms = self._histograms
+            if reset:
+                self._histograms = {}
+            else:
+                histograms = {k: list(v) for k, v in histograms.items()}
+
+        bounds = self.buckets + ["+Inf"]
+        rv = {}
+        for (route_name, name), histogram in histograms.items():
+            cumulative = 0
+            buckets = []
+            for bound, count in zip(bounds, histogram):
+                cumulative += count
+                buckets.append([bound, cumulative])
+
+            rv.setdefault(route_name, {})[name] = {
+                "count": histogram[-2],
+                "sum": histogram[-1],
+                "buckets": buckets,
+            }
+
+        return rv
+
+
+# Factories -------------------------------------------------------------------
+
+
+#: Key used to store :class:`TimingRecorder` in the app registry.
+_registry_key = "webapp2_extras.timing.TimingRecorder"
+
+
+def get_recorder(factory=TimingRecorder, key=_registry_key, app=None):
+    """Returns an instance of :class:`TimingRecorder` from the app registry.
+
+    It'll try to get it from the current app registry, and if it is not
+    registered it'll be instantiated and registered. A second call to this
+    function will return the same instance.
+
+    :param factory:
+        The callable used to build and register the instance if it is not yet
+        registered. The default is the class :class:`TimingRecorder` itself.
+    :param key:
+        The key used to store the instance in the registry. A default is used
+        if it is not set.
+    :param app:
+        A :class:`webapp2.WSGIApplication` instance used to store the instance.
+        The active app is used if it is not set.
+    """
+    app = app or webapp2.get_app()
+    recorder = app.registry.get(key)
+    if not recorder:
+        recorder = app.registry[key] = factory(app)
+
+    return recorder
+
+
+def set_recorder(recorder, key=_registry_key, app=None):
+    """Sets an instance of :class:`TimingRecorder` in the app registry.
+
+    :param recorder:
+        An instance of :class:`TimingRecorder`.
+    :param key:
+        The key used to retrieve the instance from the registry. A default
+        is used if it is not set.
+    :param app:
+        A :class:`webapp2.WSGIApplication` instance used to retrieve the
+        instance. The active app is used if it is not set.
+    """
+    app = app or webapp2.get_app()
+    app.registry[key] = recorder
@@ -20,12 +20,59 @@ Helpers for defending against cross-site request forgery attacks.
 """
 
 import base64
+import binascii
+import functools
 import hashlib
 import hmac
 import time
 
 import webapp2
 
+#: Default configuration values for :class:`XSRFProtection`. Keys are:
+#:
+#: secret_key
+#:     Secret key used to sign tokens. Set this to something random and
+#:     unguessable. This is the only required configuration key.
+#:
+#: user_id_getter
+#:     A callable, or its import path, that returns the id of the user of a
+#:     request as a string. Tokens are only valid for this user. Default is
+#:     :func:`get_auth_user_id`.
+#:
+#: timeout
+#:     Number of seconds a token is valid, or None for no expiration.
+#:     Default is 86400 (1 day).
+#:
+#: field_name
+#:     Name of the form field that carries the token. Default is
+#:     ``xsrf_token``.
+#:
+#: header_name
+#:     Name of the request header that carries the token, e.g. for AJAX
+#:     requests. Default is ``X-XSRF-Token``.
+#:
+#: safe_methods
+#:     Request methods that are not checked. Default is ``GET``, ``HEAD``,
+#:     ``OPTIONS`` and ``TRACE``.
+#:
+#: exempt_paths
+#:     Path prefixes that are not checked, e.g. for webhooks. Default is an
+#:     empty list.
+#:
+#: check_action
+#:     If True, tokens must be generated for the request path as action,
+#:     e.g. for the URL a form posts to. Default is False.
+default_config = {
+    "secret_key": None,
+    "user_id_getter": "webapp2_extras.xsrf.get_auth_user_id",
+    "timeout": 86400,
+    "field_name": "xsrf_token",
+    "header_name": "X-XSRF-Token",
+    "safe_methods": ("GET", "HEAD", "OPTIONS", "TRACE"),
+    "exempt_paths": [],
+    "check_action": False,
+}
+
 
 class XSRFException(Exception):
     pass
@@ -43,6 +90,13 @@ class XSRFTokenInvalid(XSRFException):
     pass
 
 
+@functools.lru_cache(maxsize=32)
+def _get_prototype(secret):
+    """Returns a HMAC keyed with a secret, to be copied for each token. The
+    key is processed only once per secret."""
+    return hmac.new(secret, digestmod=hashlib.sha1)
+
+
 class XSRFToken:
     _DELIMITER = b"|"
 
@@ -67,9 +121,26 @@ class XSRFToken:
             self.current_time = int(current_time)
 
         self.current_time = webapp2._to_utf8(str(self.current_time))
+        # HMAC state after the user id, copied for each token.
+        self._user_hmac = _get_prototype(self.secret).copy()
+        self._user_hmac.update(self.user_id + self._DELIMITER)
+        # Tokens generated by this object: {action: token_string}.
+        self._generated = {}
+        # Tokens verified by this object: {(token_string, action): time}.
+        self._verified = {}
 
     def _digest_maker(self):
-        return hmac.new(self.secret, digestmod=hashlib.sha1)
+        return _get_prototype(self.secret).copy()
+
+    def _make_token_string(self, action, token_time):
+        digest_maker = self._user_hmac.copy()
+        if action:
+            digest_maker.update(webapp2._to_utf8(action) + self._DELIMITER)
+
+        digest_maker.update(token_time)
+        return base64.urlsafe_b64encode(
+            digest_maker.hexdigest().encode("ascii") + self._DELIMITER + token_time
+        )
 
     def generate_token_string(self, action=None):
         """Generate a hash of the given token contents that can be verified.
@@ -81,27 +152,36 @@ class XSRFToken:
             A string containing the hash contents of the given `action` and the
             contents of the `XSRFToken`. Can be verified with
             `verify_token_string`. The string is base64 encoded so it is safe
-            to use in HTML forms without escaping.
+            to use in HTML forms without escaping. The same token is returned
+            for an action each time this method is called.
         """
-        digest_maker = self._digest_maker()
-        digest_maker.update(self.user_id)
-        digest_maker.update(self._DELIMITER)
-        if action:
-            digest_maker.update(webapp2._to_utf8(action))
-            digest_maker.update(self._DELIMITER)
-
-        digest_maker.update(self.current_time)
-        return base64.urlsafe_b64encode(
-            self._DELIMITER.join(
-                [webapp2._to_utf8(digest_maker.hexdigest()), self.current_time]
+        token_string = self._generated.get(action)
+        if token_string is None:
+            token_string = self._generated[action] = self._make_token_string(
+                action, self.current_time
             )
-        )
+
+        return token_string
+
+    def generate_token_strings(self, actions):
+        """Generates tokens for several actions, e.g. for all forms of a page.
+
+        :param actions:
+            A list of strings representing actions, as accepted by
+            `generate_token_string`.
+        :returns:
+            A dictionary mapping each action to its token string.
+        """
+        return {action: self.generate_token_string(action) for action in actions}
 
     def verify_token_string(
         self, token_string, action=None, timeout=None, current_time=None
     ):
         """Generate a hash of the given token contents that can be verified.
 
+        A token that was already verified by this object is not hashed
+        again; only its expiry is checked.
+
         :param token_string:
             A string containing the hashed token (generated by
             `generate_token_string`).
@@ -120,12 +200,35 @@ class XSRFToken:
             XSRFTokenInvalid if the given token string does not match the
             contents of the `XSRFToken`.
         """
-        import binascii
+        token_string = webapp2._to_utf8(token_string)
+        token_time = self._verified.get((token_string, action))
+        if token_time is None:
+            token_time = self._parse_token_string(token_string)
+
+        if timeout is not None:
+            if current_time is None:
+                current_time = time.time()
+            # If an attacker modifies the plain text time then
+            # it will not match the hashed time so this check is sufficient.
+            if (token_time + timeout) < current_time:
+                raise XSRFTokenExpiredException()
+
+        if (token_string, action) in self._verified:
+            return
+
+        expected_token_string = self._make_token_string(
+            action, webapp2._to_utf8(str(token_time))
+        )
+        # Compare the two strings in constant time to prevent timing attacks.
+        if not hmac.compare_digest(expected_token_string, token_string):
+            raise XSRFTokenInvalid()
+
+        self._verified[(token_string, action)] = token_time
 
+    def _parse_token_string(self, token_string):
+        """Returns the time of a token string."""
         try:
-            decoded_token_string = base64.urlsafe_b64decode(
-                webapp2._to_utf8(token_string)
-            )
+            decoded_token_string = base64.urlsafe_b64decode(token_string)
         except (TypeError, binascii.Error):
             raise XSRFTokenMalformed()
 
@@ -134,30 +237,223 @@ class XSRFToken:
             raise XSRFTokenMalformed()
 
         try:
-            token_time = int(split_token[1])
+            return int(split_token[1])
         except ValueError:
             raise XSRFTokenMalformed()
 
-        if timeout is not None:
-            if current_time is None:
-                current_time = time.time()
-            # If an attacker modifies the plain text time then
-            # it will not match the hashed time so this check is sufficient.
-            if (token_time + timeout) < current_time:
-                raise XSRFTokenExpiredException()
 
-        expected_token = XSRFToken(self.user_id, self.secret, token_time)
-        expected_token_string = expected_token.generate_token_string(action)
+def get_auth_user_id(request):
+    """Returns the id of the user authenticated by :mod:`webapp2_extras.auth`,
+    or an empty string for anonymous users.
 
-        if len(expected_token_string) != len(token_string):
-            raise XSRFTokenInvalid()
+    :param request:
+        A :class:`webapp2.Request` instance.
+    """
+    from webapp2_extras import auth
 
-        # Compare the two strings in constant time to prevent timing attacks.
-        different = 0
-        for a, b in zip(
-            webapp2._to_basestring(token_string),
-            webapp2._to_basestring(expected_token_string),
-        ):
-            different |= ord(a) ^ ord(b)
-        if different:
-            raise XSRFTokenInvalid()
+    user = auth.get_auth(request=request).get_user_by_session()
+    return str(user["user_id"]) if user else ""
+
+
+class XSRFProtection:
+    """Checks XSRF tokens of all requests with unsafe methods, using
+    :meth:`webapp2.WSGIApplication.add_hook`.
+
+    The token is checked once, before the request is routed. Requests with
+    a missing or invalid token get a 403 response, and no handler is built.
+    Instantiate it once for an app, preferably through
+    :func:`get_protection`::
+
+        from webapp2_extras import xsrf
+
+        config = {'webapp2_extras.xsrf': {'secret_key': 'my-super-secret'}}
+        app = webapp2.WSGIApplication(routes, config=config)
+        xsrf.get_protection(app=app)
+
+    Then add tokens to forms, e.g. passing :meth:`generate_token` to
+    templates::
+
+        <input type="hidden" name="xsrf_token" value="{{ xsrf_token() }}">
+
+    Tokens are memoized per request and user, so each action is signed once
+    even if a page has many forms.
+    """
+
+    #: Configuration key.
+    config_key = __name__
+
+    #: Loaded configuration.
+    config = None
+
+    def __init__(self, app, config=None):
+        """Initializes the protection and registers its hook.
+
+        :param app:
+            A :class:`webapp2.WSGIApplication` instance.
+        :param config:
+            A dictionary of configuration values to be overridden. See
+            the available keys in :data:`default_config`.
+        """
+        self.app = app
+        self.config = config = app.config.load_config(
+            self.config_key,
+            default_values=default_config,
+            user_values=config,
+            required_keys=("secret_key",),
+        )
+        self.safe_methods = frozenset(config["safe_methods"])
+        self.exempt_paths = tuple(config["exempt_paths"])
+        self.install()
+
+    def install(self):
+        """Registers the protection hook in the app."""
+        self.app.add_hook("request_started", self.on_request_started)
+
+    def uninstall(self):
+        """Unregisters the protection hook from the app."""
+        self.app.remove_hook("request_started", self.on_request_started)
+
+    @webapp2.cached_property
+    def user_id_getter(self):
+        getter = self.config["user_id_getter"]
+        if isinstance(getter, str):
+            getter = webapp2.import_string(getter)
+
+        return getter
+
+    def get_token(self, request):
+        """Returns the :class:`XSRFToken` of a request for its current user.
+        It is built once per request and user, so forms rendered after a
+        user logs in or out are signed for the new user.
+
+        :param request:
+            A :class:`webapp2.Request` instance.
+        """
+        tokens = request.registry.get(_token_registry_key)
+        if tokens is None:
+            tokens = request.registry[_token_registry_key] = {}
+
+        user_id = self.user_id_getter(request)
+        token = tokens.get(user_id)
+        if token is None:
+            token = tokens[user_id] = XSRFToken(user_id, self.config["secret_key"])
+
+        return token
+
+    def generate_token(self, request, action=None):
+        """Returns a token string for a request and action, to be added to a
+        form.
+
+        :param request:
+            A :class:`webapp2.Request` instance.
+        :param action:
+            The path the form posts to. It is only signed if ``check_action``
+            is set, so templates can always pass it.
+        """
+        if not self.config["check_action"]:
+            action = None
+
+        return self.get_token(request).generate_token_string(action).decode("ascii")
+
+    def is_exempt(self, request):
+        """Checks if a request doesn't need a token."""
+        if request.method in self.safe_methods:
+            return True
+
+        return bool(self.exempt_paths) and request.path.startswith(self.exempt_paths)
+
+    def verify(self, request):
+        """Verifies the token of a request.
+
+        :param request:
+            A :class:`webapp2.Request` instance.
+        :raises:
+            :class:`XSRFException` if the token is missing or invalid.
+        """
+        token_string = request.headers.get(self.config["header_name"])
+        if not token_string:
+            token_string = request.POST.get(self.config["field_name"])
+
+        if not token_string:
+            raise XSRFTokenMalformed()
+
+        action = request.path if self.config["check_action"] else None
+        self.get_token(request).verify_token_string(
+            token_string, action, timeout=self.config["timeout"]
+        )
+
+    def on_request_started(self, request):
+        """Aborts requests with unsafe methods and no valid token."""
+        if self.is_exempt(request):
+            return
+
+        try:
+            self.verify(request)
+        except XSRFException as e:
+            webapp2.abort(403, detail="Invalid XSRF token: %s" % type(e).__name__)
+
+
+# Factories -------------------------------------------------------------------
+
+
+#: Key used to store :class:`XSRFProtection` in the app registry.
+_registry_key = "webapp2_extras.xsrf.XSRFProtection"
+
+#: Key used to store the :class:`XSRFToken` of each user id in the request
+#: registry.
+_token_registry_key = "webapp2_extras.xsrf.XSRFToken"
+
+
+def get_protection(factory=XSRFProtection, key=_registry_key, app=None):
+    """Returns an instance of :class:`XSRFProtection` from the app registry.
+
+    It'll try to get it from the current app registry, and if it is not
+    registered it'll be instantiated and registered. A second call to this
+    function will return the same instance.
+
+    :param factory:
+        The callable used to build and register the instance if it is not yet
+        registered. The default is the class :class:`XSRFProtection` itself.
+    :param key:
+        The key used to store the instance in the registry. A default is used
+        if it is not set.
+    :param app:
+        A :class:`webapp2.WSGIApplication` instance used to store the instance.
+        The active app is used if it is not set.
+    """
+    app = app or webapp2.get_app()
+    protection = app.registry.get(key)
+    if protection is None:
+        protection = app.registry[key] = factory(app)
+
+    return protection
+
+
+def set_protection(protection, key=_registry_key, app=None):
+    """Sets an instance of :class:`XSRFProtection` in the app registry.
+
+    :param protection:
+        An instance of :class:`XSRFProtection`.
+    :param key:
+        The key used to retrieve the instance from the registry. A default
+        is used if it is not set.
+    :param app:
+        A :class:`webapp2.WSGIApplication` instance used to retrieve the
+        instance. The active app is used if it is not set.
+    """
+    app = app or webapp2.get_app()
+    app.registry[key] = protection
+
+
+def generate_token(action=None, request=None):
+    """Returns a token string for the current request, using the app
+    :class:`XSRFProtection`. Useful as a template global.
+
+    :param action:
+        The path the form posts to. See :meth:`XSRFProtection.generate_token`.
+    :param request:
+        A :class:`webapp2.Request` instance. The active request is used if it
+        is not set.
+    """
+    request = request or webapp2.get_request()
+    return get_protection(app=request.app).generate_token(request, action)